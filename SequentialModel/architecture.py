@@ -0,0 +1,64 @@
+import tensorflow as tf
+from tensorflow.keras.models import Model
+from tensorflow.keras.layers import Embedding, LSTM, Dense, Dropout, Input, BatchNormalization
+from tensorflow.keras.activations import relu
+
+
+def build_model(vocab_size, batch_size, embedding_size=200, lstm_unit_1=2048, lstm_unit_2=4096,
+                hidden_size=256, dropout_value=0.5, stateful=False):
+    """ DeepComedy stacked LSTM, the training model or (stateful=True) the generator.
+
+    Both share the same layers and weights order, so the trained weights can be
+    copied into the generator with set_weights.
+
+    The layers follow the global Keras dtype policy, with mixed_bfloat16 they
+    compute in bfloat16 on float32 weights; the logits are always float32.
+    """
+    # Input Layer
+    X = Input(shape=(None, ), batch_size=batch_size)
+
+    # Embedding Layer
+    embedded = Embedding(vocab_size, embedding_size,
+                         embeddings_regularizer=tf.keras.regularizers.L2()
+                         )(X)
+
+    # Dense layer
+    embedded = Dense(embedding_size, relu)(embedded)
+
+    # First LSTM
+    encoder_output, hidden_state, cell_state = LSTM(units=lstm_unit_1,
+                                                    return_sequences=True,
+                                                    return_state=True,
+                                                    stateful=stateful)(embedded)
+    encoder_output = BatchNormalization()(encoder_output)
+
+    # Dropout
+    encoder_output = Dropout(dropout_value)(encoder_output)
+    # Dense layer
+    encoder_output = Dense(embedding_size, activation='relu')(encoder_output)
+
+    # Dropout
+    encoder_output = Dropout(dropout_value)(encoder_output)
+
+    # Concat of first LSTM hidden state
+    initial_state_double = [tf.concat([hidden_state, hidden_state], 1), tf.concat([hidden_state, hidden_state], 1)]
+
+    # Second LSTM
+    encoder_output, hidden_state, cell_state = LSTM(units=lstm_unit_2,
+                                                    return_sequences=True,
+                                                    return_state=True,
+                                                    stateful=stateful)(encoder_output, initial_state=initial_state_double)
+    encoder_output = BatchNormalization()(encoder_output)
+
+    # Dropout
+    encoder_output = Dropout(dropout_value)(encoder_output)
+    # Dense layer
+    encoder_output = Dense(hidden_size, activation='relu')(encoder_output)
+
+    # Dropout
+    encoder_output = Dropout(dropout_value)(encoder_output)
+
+    # Prediction Layer
+    Y = Dense(units=vocab_size, dtype='float32')(encoder_output)
+
+    return Model(inputs=X, outputs=Y)
@@ -0,0 +1,66 @@
+import numpy as np
+import tensorflow as tf
+
+
+def get_text_matrix(sequence, len_input):
+    """ Legacy float64 matrix of time windows, one Python-level copy per row.
+
+    Kept only as a reference for benchmarks/bench_text_matrix.py, use
+    get_text_windows instead.
+    """
+    # create empty matrix
+    X = np.empty((len(sequence)-len_input, len_input))
+
+    # fill each row/time window from input sequence
+    for i in range(X.shape[0]):
+        X[i,:] = sequence[i : i+len_input]
+
+    return X
+
+
+def get_text_windows(sequence, len_input, dtype=np.uint8):
+    """ Zero-copy view of every time window of len_input+1 characters.
+
+    Row i is sequence[i : i+len_input+1]: the first len_input characters are
+    the train sequence and the last len_input the target sequence, so both
+    come out of the same buffer (see split_input_target).
+    The only copy is the cast of the encoded text to the compact dtype.
+    """
+    if len(sequence) <= len_input:
+        raise ValueError("sequence of length {} is too short for windows of {} characters".format(
+            len(sequence), len_input))
+    if np.issubdtype(dtype, np.integer) and np.max(sequence) > np.iinfo(dtype).max:
+        raise ValueError("vocabulary does not fit in {}".format(np.dtype(dtype).name))
+
+    sequence = np.ascontiguousarray(sequence, dtype=dtype)
+    return np.lib.stride_tricks.sliding_window_view(sequence, len_input + 1)
+
+
+def split_input_target(windows):
+    """ Train and target views over the same windows, shifted by one character """
+    return windows[:, :-1], windows[:, 1:]
+
+
+def make_training_dataset(sequence, len_input, batch_size, seed=None):
+    """ Endless tf.data pipeline of (train, target) batches of random windows.
+
+    Window starts are drawn uniformly with replacement, like the
+    np.random.randint sampling it replaces; gathering the windows from the
+    encoded text, batching and prefetching all run on tf.data background
+    threads, so the training step never waits on the Python interpreter.
+    Batches have a fixed batch_size because the training model is built with it.
+    """
+    sequence = np.ascontiguousarray(sequence, dtype=np.uint8)
+    n_windows = len(sequence) - len_input
+    text = tf.constant(sequence)
+    offsets = tf.range(len_input + 1, dtype=tf.int64)
+
+    def gather_windows(starts):
+        windows = tf.gather(text, starts[:, tf.newaxis] + offsets[tf.newaxis, :])
+        return windows[:, :-1], windows[:, 1:]
+
+    return tf.data.Dataset.random(seed=seed) \
+        .map(lambda r: tf.math.floormod(r, n_windows)) \
+        .batch(batch_size, drop_remainder=True) \
+        .map(gather_windows, num_parallel_calls=tf.data.AUTOTUNE) \
+        .prefetch(tf.data.AUTOTUNE)
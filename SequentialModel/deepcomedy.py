@@ -15,8 +15,10 @@ The final goal of this project is to rewrite one Canto.
 """
 
 # Commented out IPython magic to ensure Python compatibility.
+import sys
 import time
 import re
+from contextlib import nullcontext
 
 import numpy as np
 import pandas as pd
@@ -32,6 +34,24 @@ from tensorflow.keras.metrics import categorical_accuracy, sparse_categorical_cr
 
 from matplotlib import pyplot as plt
 
+sys.path.append("..")  # modules shared with the ThreeLinesModel
+from common.checkpoint import AsyncCheckpointWriter, load_checkpoint, latest_checkpoint
+from common.telemetry import JsonlSink, StepRecorder
+from common.normalize import load_corpus
+from common.encoding import load_encoded_corpus, numerical_encoding
+from common.structure import PoemIndex
+from common.rhymes import RhymeIndex
+from common.plagiarism import NgramIndex
+from common.metrics import CantoMetrics
+from common.syllables import is_hendecasyllable
+
+from dataset import get_text_windows, split_input_target, make_training_dataset
+from architecture import build_model
+from training import make_train_step
+from generation import generate_batch, PromptStateCache, GraphDecoder, BeamSearchDecoder
+from export import export_generator
+from numpy_generator import export_weights
+
 """# Preliminaries Steps
 
 ## Import and initial cleaning
@@ -41,28 +61,9 @@ We also remove the title of each Canto and each introductory text at his start.
 Moreover we remove the last row of each Canto to have only terzine.
 """
 
-# Read the Divina Commedia
-with open( "DivinaCommedia.txt", 'r', encoding="utf8") as file:
-    divina_commedia = file.read()
-
-# Replace rare characters
-divina_commedia = divina_commedia.replace("ä", "a")
-divina_commedia = divina_commedia.replace("é", "è")
-divina_commedia = divina_commedia.replace("ë", "è")
-divina_commedia = divina_commedia.replace("Ë", "E")
-divina_commedia = divina_commedia.replace("ï", "i")
-divina_commedia = divina_commedia.replace("Ï", "I")
-divina_commedia = divina_commedia.replace("ó", "ò")
-divina_commedia = divina_commedia.replace("ö", "o")
-divina_commedia = divina_commedia.replace("ü", "u")
-
-divina_commedia = divina_commedia.replace("(", "-")
-divina_commedia = divina_commedia.replace(")", "-")
-
-divina_commedia = re.sub(r'[0-9]+', '', divina_commedia)
-divina_commedia = re.sub(r'\[.*\r?\n', '', divina_commedia)
-divina_commedia = re.sub(r'.*Canto.*\r?\n', '', divina_commedia)
-divina_commedia = re.sub(r'.*?\n\n\n\n', "", divina_commedia)  # remove the last row of each Canto, it's alone and can ruin the generation on correct terzine
+# Read the Divina Commedia, normalized and flattened to the terzine by common/normalize.py:
+# the result is cached on disk, so the text is cleaned only the first time
+divina_commedia = load_corpus("DivinaCommedia.txt", flat=True)
 
 # divina_commedia = divina_commedia.replace(" \n", "\n")  # with this i lose the "terzina": results are not so exciting
 #divina_commedia = divina_commedia.replace(" \n", "<eot>")  # end of terzina
@@ -78,9 +79,9 @@ print(len(divina_commedia))
 Creation of an vector of ids for each character in the Comedy's vocabulary
 """
 
-# Store unique characters into a dict with numerical encoding
-unique_chars = list(set(divina_commedia))
-unique_chars.sort()  # to make sure you get the same encoding at each run
+# The whole Comedy encoded as uint8 ids and its sorted unique characters: they are written on disk
+# the first time (see common/encoding.py), then the ids are only memory-mapped
+encoded_text, unique_chars = load_encoded_corpus("DivinaCommedia.txt")
 
 # Store them in a dict, associated with a numerical index
 char2idx = { char[1]: char[0] for char in enumerate(unique_chars) }
@@ -90,12 +91,7 @@ char2idx = { char[1]: char[0] for char in enumerate(unique_chars) }
 Encode each character with a numerical vector of predefined length
 """
 
-def numerical_encoding(text, char_dict):
-    """ Text to list of chars, to np.array of numerical idx """
-    chars_list = [ char for char in text ]
-    chars_list = [ char_dict[char] for char in chars_list ]
-    chars_list = np.array(chars_list)
-    return chars_list
+# numerical_encoding looks up the ids of all the characters at once in an array indexed by code point
 
 # Let's see what will look like
 print("{}".format(divina_commedia[276:511]))
@@ -119,164 +115,39 @@ be associated with the target sequence:
 `el mezzo del cammin di nostra vita`
 
 
-Train and target sets are fundamentally the same matrix, with the train having the last row removed, and the target set having the first removed.
+Train and target sets are fundamentally the same matrix, with the train having the last column removed, and the target set having the first removed.
 """
 
-# Apply it on the whole Comedy
-encoded_text = numerical_encoding(divina_commedia, char2idx)
-
+# Already applied on the whole Comedy by load_encoded_corpus
 print(encoded_text[311:600])
 
-def get_text_matrix(sequence, len_input):
-    
-    # create empty matrix
-    X = np.empty((len(sequence)-len_input, len_input))
-    
-    # fill each row/time window from input sequence
-    for i in range(X.shape[0]):
-        X[i,:] = sequence[i : i+len_input]
-        
-    return X
-
+# Each window holds len_text+1 characters: train and target are two views over
+# the same uint8 buffer, shifted by one position, no copy of the text is made.
 len_text = 150
-text_matrix = get_text_matrix(encoded_text, len_text)
+text_windows = get_text_windows(encoded_text, len_text)
+text_matrix, target_matrix = split_input_target(text_windows)
 
 print(text_matrix.shape)
 
 print("100th train sequence:\n")
 print(text_matrix[ 100, : ])
 print("\n\n100th target sequence:\n")
-print(text_matrix[ 101, : ])
+print(target_matrix[ 100, : ])
 
 """# Custom Loss
 Evaluate the structure of the rhymes, based on the real scheme with the aim to recreate the same exact rhyme structure of the Comedy
-"""
-
-from functools import reduce
-
-
-def divide_versi(y):
-  doppiozero = False
-
-  y_divided = [[]]
-  for ly in y:
-    ly = int(ly)
-
-    # I have to clean the list of punctuation marks,
-    # in chartoidx means the numbers 1 to 10 inclusive.
-    if ly in [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]:
-        continue
-    else:
-      # if it is zero it means \ n so I add a new line
-      if ly is 0:
-        if not doppiozero:
-          y_divided.append([])
-        doppiozero = True
-        continue
-
-      y_divided[-1].append(ly)
-      doppiozero = False
-
-  if y_divided is not []:
-    if y[-1] != 0:
-      # since the last line does not end with 0 it means that it is incomplete and I remove it
-      y_divided.pop()
 
-  # i need to re check because maybe i pop the only one
-  if len(y_divided) != 0:
-    if len(y_divided[0]) < 3:
-      # if the first line is less than 4 I can't do anything about it so I delete it
-      y_divided.pop(0)
-
-  return y_divided
-
-def rhymes_extractor(y_divided):
-  # I extract the rhyme scheme from y
-  rhymes = []
-  for i in range(len(y_divided)):
-    # with the end of the line (last two letters) I check if the other lines
-    # end with the same letters
-    vy = y_divided[i]
-
-    last_word_1 = vy[-2:]
-
-    # ABA BCB CDC
-
-    # I have to check if line i rhymes with line i + 2
-    if i+2 < len(y_divided):
-      next_vy = y_divided[i+2]
-      if last_word_1 == next_vy[-2:]:
-        rhymes.append((i, i+2))
-    
-    if i+4 < len(y_divided):
-      next_vy = y_divided[i+4]
-      if last_word_1 == next_vy[-2:]:
-        rhymes.append((i, i+4))
-
-  return rhymes
-
-
-def get_custom_loss(x_batch, y_batch):
-  summed_custom_loss = 0
-
-  # max number of rhymes (arbitrary choosen, it's an hyperparameter)
-  max_rhymes = 4
-
-  x_bin_tot = np.ones(shape=(len(x_batch), max_rhymes), dtype='float32')
-  y_bin_tot = np.ones(shape=(len(x_batch), max_rhymes), dtype='float32')
-
-  # iterate over each vector
-  for v in range(len(x_batch)):
-    x = x_batch[v]
-    y = y_batch[v]
-
-    # given that the model returns a matrix with shape (len_text, vocab_size) with the probability
-    # for each of the vocab_size character i need to use a categorical to choose the best
-    # then flatten the matrix into a list for evaluating
-    predicted_text = list(tf.random.categorical(x, num_samples=1).numpy())
-    x = np.concatenate(predicted_text).ravel().tolist()
-
-    # dividing the vector in verse
-    x_divided = divide_versi(x)
-    y_divided = divide_versi(y)
+The loss splits each sequence in verses on the newline id, ignoring the punctuation ids, and checks which verses rhyme at distance 2 and 4, that is the ABA BCB scheme. Two verses rhyme when they end with the same rhyme of the Comedy, from the stressed vowel on: the rhymes are indexed once from the poem (see `common/rhymes.py`) and each verse gets the id of its longest known ending, so only integers are compared. The same check is done on Dante's target and the two rhyme schemes are compared with a MSE.
 
-    # extract the structure of the rhymes from generated and groud truth
-    x_rhymes = rhymes_extractor(x_divided)
-    y_rhymes = rhymes_extractor(y_divided)
-
-    # it returns me a list with the number of rhyming lines
-    # Example: [(1,3), (2,4)] means that lines 1 and 3 rhyme and that the
-    # lines 2 and 4 as well
-
-    # I create a vector of 1 for y because the rhymes are always there
-    y_bin = np.ones(max_rhymes, dtype='float32')
-    # I create a vector of 1 for the rhymes generated, I will put 0 if it rhyme
-    # Is NOT present in dante, discount with a 0.5 since there is at least the rhyme
-    x_bin = np.ones(max_rhymes, dtype='float32')
+Everything is computed on tensors for the whole batch at once (see `rhyme_loss.py`), so it runs inside the graph without moving the predictions to the host. A step by step Python version, used for debug and explaination, is at the end of the notebook.
+"""
 
-    if x_rhymes == []:
-      x_bin = np.zeros(max_rhymes, dtype='float32')
+from rhyme_loss import rhyme_loss, RhymeTable
 
-    # if the generated rhyme is in Dante's original rhymes then I sign it as valid
-    # I keep maximum max_ryhmes rhymes: I can because in 150-200 characters I don't have more than 5-6 lines
-    # so in Dante I would have 2 rhymes, I exceed 2 to help the network create even wrong rhymes
-    for i in range(max_rhymes+1):
-      if i < len(y_rhymes):
-        # check dante's rhyme with predicted rhymes, if it not exist set 0.0
-        if y_rhymes[i] not in x_rhymes:
-          x_bin[i] = 0.0
-        # check predicted rhyme with Dante's rhymes, if not exist set 0.5 to increase number of rhymes produced
-        if i < len(x_rhymes) and x_rhymes[i] not in y_rhymes:
-          x_bin[i] = 0.5
-
-    # concatenate vectors with rhyming encoding
-    x_bin_tot[v] = x_bin
-    y_bin_tot[v] = y_bin
-  
-  # MSE over vector
-  r = tf.keras.losses.mean_squared_error(y_bin_tot, x_bin_tot)
-
-  return np.mean(r)
+# compact ids of the rhyme endings of the poem, built the first time and then read from the corpus cache
+rhyme_index = RhymeIndex.load("DivinaCommedia.txt")
+rhyme_table = RhymeTable(rhyme_index, char2idx)
+print("{} rhymes, e.g. {}".format(len(rhyme_index.endings), rhyme_index.endings[:10]))
 
 """# Training Model
 
@@ -312,6 +183,15 @@ hidden_size = 256  # for Dense() layers 250
 n_epochs = 75
 learning_rate = 0.001  # 0.0001
 
+# run the training step as a compiled graph (tf.function), optionally with XLA
+compile_train_step = True
+jit_compile = False
+
+# train with bfloat16 computations on float32 weights (opt-in, see benchmarks/bench_mixed_precision.py),
+# with loss scaling of the gradients; the generator always runs in float32
+mixed_precision = False
+loss_scaling = True
+
 """## Metrics"""
 
 def perplexity_metric(loss):
@@ -355,54 +235,17 @@ plt.xlabel("Train Step")
 
 optimizer = tf.keras.optimizers.Adamax(learning_rate=learning_rate_custom_2)
 
-"""## Architecture"""
-
-# Input Layer
-X = Input(shape=(None, ), batch_size=batch_size)
-
-# Embedding Layer
-embedded = Embedding(vocab_size, embedding_size, 
-                     batch_input_shape=(batch_size, None), 
-                     embeddings_regularizer=tf.keras.regularizers.L2()
-                     )(X)
-
-# Dense layer
-embedded = Dense(embedding_size, relu)(embedded)
+if mixed_precision:
+  tf.keras.mixed_precision.set_global_policy('mixed_bfloat16')
+  if loss_scaling:
+    optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
 
-# First LSTM
-encoder_output, hidden_state, cell_state = LSTM(units=lstm_unit_1,return_sequences=True,return_state=True)(embedded)
-encoder_output = BatchNormalization()(encoder_output)
-
-# Dropout
-encoder_output = Dropout(dropout_value)(encoder_output)
-# Dense layer
-encoder_output = Dense(embedding_size, activation='relu')(encoder_output)
-
-# Dropout
-encoder_output = Dropout(dropout_value)(encoder_output)
-
-# Concat of first LSTM hidden state
-initial_state_double = [tf.concat([hidden_state, hidden_state], 1), tf.concat([hidden_state, hidden_state], 1)]
-
-# Second LSTM
-encoder_output, hidden_state, cell_state = LSTM(units=lstm_unit_2,
-                                                return_sequences=True, 
-                                                return_state=True)(encoder_output, initial_state=initial_state_double) 
-encoder_output = BatchNormalization()(encoder_output)
-
-# Dropout
-encoder_output = Dropout(dropout_value)(encoder_output)
-# Dense layer
-encoder_output = Dense(hidden_size, activation='relu')(encoder_output)
-
-# Dropout
-encoder_output = Dropout(dropout_value)(encoder_output)
+"""## Architecture"""
 
-# Prediction Layer
-Y = Dense(units=vocab_size)(encoder_output)
+# Embedding -> Dense -> LSTM -> BatchNorm -> Dense -> LSTM -> BatchNorm -> Dense -> Dense, see architecture.py
+model = build_model(vocab_size, batch_size, embedding_size, lstm_unit_1, lstm_unit_2, hidden_size, dropout_value)
 
 # Compile model
-model = Model(inputs=X, outputs=Y)
 model.compile(loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits = True), optimizer=optimizer)
 print(model.summary())
 
@@ -411,27 +254,39 @@ print(model.summary())
 min_custom_loss = 1.0  # max value for the custom loss
 min_custom_epoch = 0  # epoch of minimum custom loss
 
-def train_on_batch(x, y, min_custom_loss):
-    with tf.GradientTape() as tape:
-        # returns a tensor with shape (batch_size, len_text)
-        y_predicted = model(x)
+# the best model is snapshotted in memory and written to disk on a background thread,
+# at most once every checkpoint_interval seconds
+checkpoint_interval = 60
+checkpoint_writer = AsyncCheckpointWriter("checkpoints", filename="best_model-{step:07d}.npz",
+                                          min_interval_sec=checkpoint_interval, keep_last=3)
 
-        scce = tf.keras.losses.sparse_categorical_crossentropy(y, y_predicted, from_logits = True)
-        # we cant return a tensor with that shape so we return a float that are summed
-        custom = get_custom_loss(y_predicted, y)
+# time of each phase of every step, chars/sec and RSS, one JSON line per step in telemetry.jsonl;
+# with profile_steps = (first, last) the TensorFlow profiler traces those steps in the "profile" folder
+profile_steps = None
+telemetry = StepRecorder(JsonlSink("telemetry.jsonl"), profile_dir="profile", profile_steps=profile_steps)
 
-        current_loss = tf.reduce_mean(scce + custom)
+# forward pass, losses, gradients and update of one batch, traced once in a single graph
+# (not compiled, each of them is timed as a phase)
+train_step = make_train_step(model, optimizer, rhyme_table, compiled=compile_train_step, jit_compile=jit_compile,
+                             recorder=telemetry)
 
-    gradients = tape.gradient(current_loss, model.trainable_variables)
-    optimizer.apply_gradients(zip(gradients, model.trainable_variables))
+def train_on_batch(x, y, min_custom_loss):
+    with telemetry.phase('train_step') if compile_train_step else nullcontext():
+      current_loss, scce, custom = train_step(x, y)
+      # wait for the step to finish, to time it
+      custom = float(custom)
 
     perp = perplexity_metric(tf.reduce_mean(scce))
 
     # checking for the best model using custom loss
     # needed to do here because here we can save the model
-    if custom < min_custom_loss:
-      min_custom_loss = custom
-      model.save("best_model.h5", overwrite=True)
+    # a best model that comes before checkpoint_interval is deferred, written once the interval has passed
+    with telemetry.phase('checkpoint'):
+      if custom < min_custom_loss:
+        min_custom_loss = custom
+        checkpoint_writer.save(model, int(optimizer.iterations))
+      else:
+        checkpoint_writer.poll(int(optimizer.iterations))
     return current_loss, scce, custom, perp, min_custom_loss
 
 
@@ -440,22 +295,24 @@ custom_loss_history = []
 perplexity_history = []
 
 
+# Random windows of train and target, sampled, batched and prefetched on background threads
+train_batches = iter(make_training_dataset(encoded_text, len_text, batch_size))
+
 for epoch in range(n_epochs):
     
     start = time.time()
-    
-    # Take subsets of train and target
-    sample = np.random.randint(0, text_matrix.shape[0]-1, subset_size)
-    sample_train = text_matrix[ sample , : ]
-    sample_target = text_matrix[ sample+1 , : ]
+    input_wait = 0.0  # time spent waiting on the input pipeline
 
-    for iteration in range(sample_train.shape[0] // batch_size):
-        take = iteration * batch_size
-        x = sample_train[ take:take+batch_size , : ]
-
-        y = sample_target[ take:take+batch_size , : ]
+    for iteration in range(subset_size // batch_size):
+        telemetry.begin_step(epoch * (subset_size // batch_size) + iteration)
+        wait_start = time.time()
+        with telemetry.phase('input'):
+          x, y = next(train_batches)
+        input_wait += time.time() - wait_start
 
         current_loss, scce, custom, perplexity, new_min_custom_loss = train_on_batch(x, y, min_custom_loss)
+        telemetry.end_step(chars=batch_size * len_text, epoch=epoch, loss=float(current_loss), custom=custom,
+                           perplexity=float(perplexity))
 
         # save infos about the new min_custom_loss
         if new_min_custom_loss < min_custom_loss:
@@ -466,10 +323,14 @@ for epoch in range(n_epochs):
         custom_loss_history.append(custom)
         perplexity_history.append(perplexity)
     
-    print("{}.  \t  Total-Loss: {}  \t  Custom-Loss: {}  \t Perplexity: {}  \t Time: {} sec/epoch".format(
-        epoch+1, current_loss.numpy(), custom, perplexity, round(time.time()-start, 2)))
+    print("{}.  \t  Total-Loss: {}  \t  Custom-Loss: {}  \t Perplexity: {}  \t Time: {} sec/epoch  \t Input-Wait: {} sec".format(
+        epoch+1, current_loss.numpy(), custom, perplexity, round(time.time()-start, 2), round(input_wait, 2)))
+
+checkpoint_writer.close()
 
-model.save(F"/content/gdrive/My Drive/DeepComedyModels/deep_comedy_custom_loss_01_62char.h5")
+with telemetry.phase('model_save'):
+  model.save(F"/content/gdrive/My Drive/DeepComedyModels/deep_comedy_custom_loss_01_62char.h5")
+telemetry.close()
 
 """## Graphs"""
 
@@ -508,35 +369,12 @@ We will instantiate a new `generator` RNN with these new features, and transfer
 ## Architecture
 """
 
-# Input Layer
-X = Input(shape=(None, ), batch_size=1)
-embedded = Embedding(vocab_size, embedding_size)(X)
-embedded = Dense(embedding_size, relu)(embedded)
-
-encoder_output, hidden_state, cell_state = LSTM(units=lstm_unit_1,
-                                                         return_sequences=True,
-                                                         return_state=True,
-                                              stateful=True)(embedded)
-encoder_output = BatchNormalization()(encoder_output)
-encoder_output = Dropout(dropout_value)(encoder_output)
-encoder_output = Dense(embedding_size, activation='relu')(encoder_output)
-
-initial_state_double = [tf.concat([hidden_state, hidden_state], 1), tf.concat([hidden_state, hidden_state], 1)]
-
-encoder_output, hidden_state, cell_state = LSTM(units=lstm_unit_2,
-                                                         return_sequences=True,
-                                                         return_state=True,
-                                                stateful=True)(encoder_output, initial_state=initial_state_double)
-
-encoder_output = BatchNormalization()(encoder_output)
-encoder_output = Dropout(dropout_value)(encoder_output)
-encoder_output = Dense(hidden_size, activation='relu')(encoder_output)
-encoder_output = Dropout(dropout_value)(encoder_output)
-
-Y = Dense(units=vocab_size)(encoder_output)
+# Same layers of the training model, with stateful LSTMs and batch size 1
+tf.keras.mixed_precision.set_global_policy('float32')
+generator = build_model(vocab_size, 1, embedding_size, lstm_unit_1, lstm_unit_2, hidden_size, dropout_value,
+                        stateful=True)
 
 # Compile model
-generator = Model(inputs=X, outputs=Y)
 generator.compile(loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits = True), optimizer=optimizer)
 print(generator.summary())
 
@@ -545,35 +383,47 @@ print(generator.summary())
 # Import trained weights from RNN to generator
 load_file = False
 if load_file:
-  generator.load_weights("best_model.h5")
+  load_checkpoint(generator, latest_checkpoint("checkpoints"))
 else:
   generator.set_weights(model.get_weights())
 
+# TFLite generator with int8 weights for CPU inference, run with export.QuantizedGenerator in place of the
+# Keras generator; quantization='int8' also quantizes the activations, but the LSTM states lose too much
+# precision from a character to the next (see benchmarks/bench_quantized_generation.py)
+export_quantized = False
+if export_quantized:
+  export_generator(generator, "generator-int8.tflite", quantization='dynamic')
+
+# Weights and characters for numpy_generator.NumpyGenerator, which generates without importing TensorFlow
+export_numpy = False
+if export_numpy:
+  export_weights(generator, "generator.npz", unique_chars)
+
 """## Generating methods"""
 
-def generate_text(start_string, model, num_generate = 1000, temperature = 1.0):
-    
-    # Vectorize input string
-    input_eval = [char2idx[s] for s in start_string]  
-    input_eval = tf.expand_dims(input_eval, 0)
+def generate_text(start_string, model, num_generate = 1000, temperature = 1.0, prompt_cache = None):
     
     text_generated = [] # List to append predicted chars 
     predicted_ids = []
     
     idx2char = { v: k for k, v in char2idx.items() }  # invert char-index mapping
     
-    model.reset_states()
+    if prompt_cache is not None:
+        # restore the LSTM states after the prompt if it was already consumed
+        predictions = prompt_cache.consume_prompts(model, [start_string], char2idx)
+    else:
+        # Vectorize input string
+        input_eval = [char2idx[s] for s in start_string]  
+        input_eval = tf.expand_dims(input_eval, 0)
+
+        model.reset_states()
+        predictions = model(input_eval)[:, -1, :]
     
     for i in range(num_generate):
-        predictions = model(input_eval)
-        predictions = tf.squeeze(predictions, 0)
-        
         # sample next char based on distribution and temperature
         predictions = predictions / temperature
         predicted_id = tf.random.categorical(predictions, num_samples=1)[-1,0].numpy()
         
-        input_eval = tf.expand_dims([predicted_id], 0)  # one letter input
-        
         # build the input for the next iteration, based on the last 5 characters generated
         # become like a poetry!
         #predicted_ids.append(predicted_id)
@@ -582,6 +432,10 @@ def generate_text(start_string, model, num_generate = 1000, temperature = 1.0):
         #input_eval = tf.expand_dims(predicted_ids, 0)
 
         text_generated.append(idx2char[predicted_id])
+
+        if i + 1 < num_generate:
+            input_eval = tf.expand_dims([predicted_id], 0)  # one letter input
+            predictions = model(input_eval)[:, -1, :]
         
     return (start_string + ''.join(text_generated))
 
@@ -595,73 +449,117 @@ chè la diritta via era smarrita.
 
 """
 
-for t in [0.1, 0.2, 0.3, 0.5, 1.0]:
+# All the temperatures are generated at once, one for each row of a generator with a bigger batch
+temperatures = [0.1, 0.2, 0.3, 0.5, 1.0]
+batch_generator = build_model(vocab_size, len(temperatures), embedding_size, lstm_unit_1, lstm_unit_2, hidden_size,
+                              dropout_value, stateful=True)
+batch_generator.set_weights(generator.get_weights())
+
+generated_texts = generate_batch([start_string] * len(temperatures), batch_generator, char2idx,
+                                 num_generate = 1000, temperatures = temperatures)
+for t, text in zip(temperatures, generated_texts):
     print("####### TEXT GENERATION - temperature = {}\n".format(t))
-    print(generate_text(start_string, generator, num_generate = 1000, temperature = t))
+    print(text)
     print("\n\n\n")
 
 # Exam mode for 1 Canto so 33 terzine. 4000 characters to write
-start_inferno = """
-Nel mezzo del cammin di nostra vita
-mi ritrovai per una selva oscura,
-chè la diritta via era smarrita.
+# the openings are sliced out of the normalized text through the index of its terzine
+poem = PoemIndex.load("DivinaCommedia.txt")
 
-"""
+start_inferno = "\n" + poem.terzina("inferno", 1, 1) + "\n\n"
 
-start_purgatorio = """
-Per correr miglior acque alza le vele
-omai la navicella del mio ingegno,
-che lascia dietro a se mar si crudele;
+start_purgatorio = "\n" + poem.terzina("purgatorio", 1, 1) + "\n\n"
 
+start_paradiso = "\n" + poem.terzina("paradiso", 1, 1) + "\n\n"
+
+start_new = """
 """
 
-start_paradiso = """
-La gloria di colui che tutto move
-per l'universo penetra, e risplende
-in una parte più e meno altrove.
+# the states after the canonical openings are kept, every generation after the first skips the prompt
+prompt_cache = PromptStateCache()
 
-"""
+# the whole sampling loop runs in one compiled graph, the ids are decoded to text only at the end
+graph_decoder = GraphDecoder(generator, char2idx)
 
-start_new = """
-"""
 start = time.time()
-generated = generate_text(start_inferno, generator, num_generate = 7000, temperature = 0.1)
-print("Time to generate {} characters: {} sec".format(7000, round(time.time()-start, 2)))
+generated = graph_decoder.generate([start_inferno], num_generate = 7000, temperatures = 0.1, prompt_cache = prompt_cache)[0]
+sampling_seconds = time.time()-start
+print("Time to generate {} characters: {} sec, {:.1f} chars/sec".format(
+    7000, round(sampling_seconds, 2), 7000 / sampling_seconds))
+
+# set to True to time the Python sampling loop of generate_text too
+compare_python_loop = False
+if compare_python_loop:
+  start = time.time()
+  generate_text(start_inferno, generator, num_generate = 7000, temperature = 0.1, prompt_cache = prompt_cache)
+  print("Time to generate {} characters with the Python loop: {} sec".format(7000, round(time.time()-start, 2)))
 
 print(generated)
 
-"""## Save generated Canto to file for Plagiarism Test and Metrics"""
+"""## Save generated Canto to file"""
 
 with open("generated.txt", "w+") as text_file:
     text_file.write(generated)
 
 """# Plagiarism Test
 
-Include the file **ngrams_plagiarism.py** downloaded from Virtuale
-
-This mehod needs two file, we called it generated.txt (the same for the Metrics) and Inferno.txt (the first Canto of the Inferno).
+The word 4-grams of the generated Canto are searched among the 4-grams of the whole Comedy, that are hashed once and then read from the corpus cache (see `common/plagiarism.py`): the result is the share of the generated 4-grams copied from the poem, overall and for each Cantica.
 """
 
-from ngrams_plagiarism import ngrams_plagiarism
+plagiarism_index = NgramIndex.load("DivinaCommedia.txt", n=4)
 
-gen = open('generated.txt').read()
-truth = open('Inferno.txt').read()
-ngrams_plagiarism(gen, truth)
+start = time.time()
+plagiarism = plagiarism_index.score(generated)
+print("Plagiarism test in {} sec".format(round(time.time()-start, 4)))
+print("{:.1%} of the {} generated 4-grams are in the Comedy".format(plagiarism['poem'], plagiarism['ngrams']))
+for cantica in ['inferno', 'purgatorio', 'paradiso']:
+  print("  {}: {:.1%}".format(cantica, plagiarism[cantica]))
 
 """# Metrics
 
-Include the content of the folder **Deep Comedy Metrics** downloaded from Virtuale.
-
-This method needs one file:
-*   generated.txt: the file generated by the network
-
-with UTF-8 Encoding!
+Structure of the generated Canto, computed on the string by `common/metrics.py`: share of stanzas that are terzine, of hendecasyllables, of the ABA BCB rhymes of the terza rima, of words that are not in the Comedy and of copied 4-grams. `evaluate` takes a list of texts, many generated Canti are scored together.
+"""
 
+metrics = CantoMetrics(rhyme_index, plagiarism_index)
+for name, value in metrics.summary([generated]).items():
+  print("{:18s} {:.3f}".format(name, value))
 
+"""# Beam search
 
+Every verse constrained to be an hendecasyllable in terza rima, one row of the generator per beam. The beam search canto is compared with the sampled one above and written to its own file, the sampled canto stays the output of the notebook.
 """
 
-!python3 main.py
+use_beam_search = False
+beam_width = 8
+beam_seconds = 600  # latency budget, the best beam found so far is returned when it's over
+
+def hendecasyllables_share(text):
+  verses = [verse for verse in text.split("\n") if verse.strip()]
+  return sum(is_hendecasyllable(verse) for verse in verses) / max(len(verses), 1)
+
+if use_beam_search:
+  beam_generator = build_model(vocab_size, beam_width, embedding_size, lstm_unit_1, lstm_unit_2, hidden_size,
+                               dropout_value, stateful=True)
+  beam_generator.set_weights(generator.get_weights())
+  beam_decoder = BeamSearchDecoder(beam_generator, char2idx, rhyme_index = rhyme_index)
+
+  start = time.time()
+  beam_generated = beam_decoder.generate(start_inferno, num_generate = 7000, max_seconds = beam_seconds)
+  beam_seconds_taken = time.time()-start
+  beam_chars = len(beam_generated) - len(start_inferno)
+  print("Time to generate {} characters with beam search: {} sec{}".format(
+      beam_chars, round(beam_seconds_taken, 2), " (cut by the latency budget)" if beam_chars < 7000 else ""))
+  print("chars/sec: {:.1f} sampling, {:.1f} beam search".format(
+      7000 / sampling_seconds, beam_chars / beam_seconds_taken))
+  print("Hendecasyllables: {:.1%} sampling, {:.1%} beam search".format(
+      hendecasyllables_share(generated[len(start_inferno):]), hendecasyllables_share(beam_generated[len(start_inferno):])))
+  print(beam_generated)
+
+  with open("generated_beam.txt", "w+") as text_file:
+    text_file.write(beam_generated)
+
+  for name, value in metrics.summary([beam_generated]).items():
+    print("{:18s} {:.3f}".format(name, value))
 
 """# Custom loss used for debug and explaination"""
 
@@ -751,28 +649,22 @@ def divide_versi(y):
 def rhymes_extractor(y_divided):
   # estraggo lo schema di rime da y
   rhymes = []
+  # la rima di ogni verso, dalla vocale accentata in poi, come id dell'indice delle rime
+  # (0 se il verso non finisce con nessuna rima nota)
+  rhyme_ids = rhyme_index.lookup([''.join(unique_chars[ly] for ly in vy) for vy in y_divided])
   for i in range(len(y_divided)):
-    # con la fine del verso (ultime due lettere) controllo se le altre righe 
-    # finiscono con le stesse lettere
-    vy = y_divided[i]
-
-    last_word_1 = vy[-2:]
+    # con la rima del verso controllo se le altre righe fanno rima
+    rhyme_1 = rhyme_ids[i]
 
     # ABA BCB CDC
 
     # devo controllare se la riga i fa rima con la riga i+2 
     if i+2 < len(y_divided):
-      next_vy = y_divided[i+2]
-      # print(vy[-2:])
-      # print(next_vy[-2:])
-      if last_word_1 == next_vy[-2:]:
+      if rhyme_1 != 0 and rhyme_1 == rhyme_ids[i+2]:
         rhymes.append((i, i+2))
     
     if i+4 < len(y_divided):
-      # print(vy[-2:])
-      # print(next_vy[-2:])
-      next_vy = y_divided[i+4]
-      if last_word_1 == next_vy[-2:]:
+      if rhyme_1 != 0 and rhyme_1 == rhyme_ids[i+4]:
         rhymes.append((i, i+4))
 
   # print(rhymes)
@@ -873,4 +765,9 @@ def get_custom_loss(x_batch, y_batch):
   return np.mean(r)
 
 
-custom_loss = get_custom_loss(x,y)
\ No newline at end of file
+custom_loss = get_custom_loss(x,y)
+
+# the in-graph loss used in training must give the same value
+graph_custom_loss = rhyme_loss(np.array(x), np.array(y), rhyme_table).numpy()
+print("In-graph rhyme loss: {}".format(graph_custom_loss))
+assert np.isclose(custom_loss, graph_custom_loss)
@@ -0,0 +1,105 @@
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import BatchNormalization, Dense, Embedding, LSTM
+
+from architecture import build_model
+from common.tflite import TFLiteRunner, convert, lstm_sequence
+
+
+def generator_step(model):
+    """ tf.function of one call of the DeepComedy generator, with the LSTM states as inputs and outputs.
+
+    step(ids (1, T) int32, h1, c1 (1, lstm_unit_1), h2, c2 (1, lstm_unit_2))
+    returns (logits (1, vocab_size) of the last character, h1, c1, h2, c2),
+    the same as generator(ids)[:, -1, :] from those LSTM states. Like the
+    stateful Keras LSTM given an initial_state, the second LSTM starts from
+    its own states when they are not all zeros, and from the last hidden
+    state of the first LSTM (see architecture.py) after a reset.
+
+    model is the training model or the generator of build_model, its weights
+    are copied into a model with the same sizes that is not stateful.
+    """
+    embedding = next(layer for layer in model.layers if isinstance(layer, Embedding))
+    lstm_1, lstm_2 = [layer for layer in model.layers if isinstance(layer, LSTM)]
+    denses = [layer for layer in model.layers if isinstance(layer, Dense)]
+    vocab_size, embedding_size = embedding.input_dim, embedding.output_dim
+
+    stateless = build_model(vocab_size, 1, embedding_size, lstm_1.units, lstm_2.units, denses[2].units)
+    stateless.set_weights(model.get_weights())
+    embedding = next(layer for layer in stateless.layers if isinstance(layer, Embedding))
+    lstm_1, lstm_2 = [layer for layer in stateless.layers if isinstance(layer, LSTM)]
+    norm_1, norm_2 = [layer for layer in stateless.layers if isinstance(layer, BatchNormalization)]
+    dense_in, dense_1, dense_2, dense_out = [layer for layer in stateless.layers if isinstance(layer, Dense)]
+
+    @tf.function(input_signature=[tf.TensorSpec((1, None), tf.int32),
+                                  tf.TensorSpec((1, lstm_1.units), tf.float32),
+                                  tf.TensorSpec((1, lstm_1.units), tf.float32),
+                                  tf.TensorSpec((1, lstm_2.units), tf.float32),
+                                  tf.TensorSpec((1, lstm_2.units), tf.float32)])
+    def step(ids, h1, c1, h2, c2):
+        # the dropouts are not applied at inference
+        x = dense_in(embedding(ids))
+        x, h1, c1 = lstm_sequence(lstm_1.cell, x, h1, c1)
+        x = dense_1(norm_1(x, training=False))
+
+        # 1 if the second LSTM has a state, without a conditional op
+        has_state = tf.cast(tf.reduce_any(tf.not_equal(h2, 0)) | tf.reduce_any(tf.not_equal(c2, 0)), tf.float32)
+        initial_state_double = tf.concat([h1, h1], 1)
+        h2 = has_state * h2 + (1 - has_state) * initial_state_double
+        c2 = has_state * c2 + (1 - has_state) * initial_state_double
+        x, h2, c2 = lstm_sequence(lstm_2.cell, x, h2, c2)
+        x = dense_2(norm_2(x, training=False))
+        return dense_out(x[:, -1]), h1, c1, h2, c2
+
+    # the model of the weights of the step, kept alive with it
+    step.model = stateless
+    return step
+
+
+def calibration_windows(encoded_text, step, n_windows=100, len_text=100, seed=0):
+    """ Representative dataset of single characters with the states after the window before them """
+    rng = np.random.default_rng(seed)
+    zeros = [np.zeros(spec.shape, dtype=np.float32) for spec in step.input_signature[1:]]
+
+    def dataset():
+        for start in rng.integers(0, len(encoded_text) - len_text - 1, n_windows):
+            window = np.asarray(encoded_text[start:start + len_text + 1], dtype=np.int32)[None]
+            states = [state.numpy() for state in step(window[:, :-1], *zeros)[1:]]
+            yield dict(zip(('h1', 'c1', 'h2', 'c2'), states), ids=window[:, -1:])
+    return dataset
+
+
+def export_generator(model, path, quantization='dynamic', encoded_text=None):
+    """ Write the generator as a TFLite model, with int8 weights by default (see common.tflite.convert).
+
+    encoded_text, the corpus as character ids, is needed by the 'int8'
+    quantization to calibrate the activations on the states of real text.
+    """
+    step = generator_step(model)
+    representative_dataset = calibration_windows(encoded_text, step) if encoded_text is not None else None
+    return convert(step, path, quantization, representative_dataset)
+
+
+class QuantizedGenerator:
+    """ Runs a generator written by export_generator, keeping the LSTM state across calls.
+
+    A drop in for the stateful Keras generator in the generation loop:
+
+        generator = QuantizedGenerator('generator-int8.tflite')
+        generator.reset_states()
+        logits = generator(input_eval)  # generator(input_eval)[:, -1, :] of Keras
+    """
+
+    def __init__(self, path, num_threads=None):
+        self.runner = TFLiteRunner(path, num_threads=num_threads)
+        self.states = { name: np.zeros(self.runner.inputs[name]['shape'], dtype=np.float32)
+                        for name in ('h1', 'c1', 'h2', 'c2') }
+
+    def reset_states(self):
+        for state in self.states.values():
+            state[:] = 0
+
+    def __call__(self, input_ids):
+        logits, *states = self.runner(ids=np.reshape(input_ids, (1, -1)), **self.states)
+        self.states = dict(zip(('h1', 'c1', 'h2', 'c2'), states))
+        return logits
@@ -0,0 +1,354 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import LSTM
+
+from common.syllables import can_reach_hendecasyllable, is_hendecasyllable
+
+
+def stateful_lstms(model):
+    """ The stateful LSTM layers of a generator, in order """
+    return [layer for layer in model.layers if isinstance(layer, LSTM) and layer.stateful]
+
+
+def get_lstm_states(model):
+    """ Copy of the (h, c) states of every stateful LSTM, as numpy arrays """
+    return [[state.numpy() for state in lstm.states] for lstm in stateful_lstms(model)]
+
+
+def set_lstm_states(model, states):
+    for lstm, lstm_states in zip(stateful_lstms(model), states):
+        lstm.reset_states(states=lstm_states)
+
+
+def consume_prompts(model, prompts_ids):
+    """ Feed one prompt per row of the stateful generator, returns the logits after the last character.
+
+    Each prompt is fed whole in one call, exactly like generate_text does. The
+    generator has a fixed batch size, so prompts of different lengths are fed
+    in one call per length and the LSTM states of each row are taken from the
+    call with its own prompt.
+    """
+    batch_size = len(prompts_ids)
+    lengths = np.array([len(prompt) for prompt in prompts_ids])
+    logits = None
+    states = None
+
+    for length in np.unique(lengths):
+        rows = np.flatnonzero(lengths == length)
+        # the other rows are filled with a prompt of this length, their results are discarded
+        batch = np.array([prompts_ids[b] if lengths[b] == length else prompts_ids[rows[0]]
+                          for b in range(batch_size)])
+
+        model.reset_states()
+        length_logits = model(batch)[:, -1, :].numpy()
+        length_states = get_lstm_states(model)
+
+        if logits is None:
+            logits, states = length_logits, length_states
+        else:
+            logits[rows] = length_logits[rows]
+            for lstm_states, lstm_length_states in zip(states, length_states):
+                for state, length_state in zip(lstm_states, lstm_length_states):
+                    state[rows] = length_state[rows]
+
+    set_lstm_states(model, states)
+    return logits
+
+
+def weights_hash(model):
+    """ Hash of the weights of model, identifies the trained model in the prompt cache """
+    digest = hashlib.sha1()
+    for weights in model.get_weights():
+        digest.update(np.ascontiguousarray(weights).tobytes())
+    return digest.hexdigest()
+
+
+class PromptStateCache:
+    """ LRU cache of the generator state after a prompt has been consumed.
+
+    For each (weights hash, prompt) it keeps the (h, c) states of the stateful
+    LSTMs and the logits of the next character, so a generation starting from
+    a cached prompt, like the opening terzina of each Cantica, restores them
+    instead of feeding the prompt through the LSTMs again.
+
+    The weights hash of a model is computed the first time the model is seen:
+    call forget_model after changing its weights.
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._weights_hashes = {}
+
+    def forget_model(self, model):
+        self._weights_hashes.pop(id(model), None)
+
+    def _weights_hash(self, model):
+        if id(model) not in self._weights_hashes:
+            self._weights_hashes[id(model)] = weights_hash(model)
+        return self._weights_hashes[id(model)]
+
+    def consume_prompts(self, model, start_strings, char2idx):
+        """ Like consume_prompts, with the prompts as text: the cached ones are not fed to the model """
+        model_hash = self._weights_hash(model)
+        keys = [(model_hash, start_string) for start_string in start_strings]
+        found = {}
+        for key in keys:
+            if key in self.entries and key not in found:
+                self.entries.move_to_end(key)
+                found[key] = self.entries[key]
+        missing = [b for b, key in enumerate(keys) if key not in found]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            # rows already in the cache are fed one of the missing prompts, their results are discarded
+            prompts_ids = [[char2idx[s] for s in start_strings[b if b in missing else missing[0]]]
+                           for b in range(len(keys))]
+            logits = consume_prompts(model, prompts_ids)
+            states = get_lstm_states(model)
+            for b in missing:
+                found[keys[b]] = (logits[b].copy(), [[state[b].copy() for state in lstm_states] for lstm_states in states])
+
+        logits = np.stack([found[key][0] for key in keys])
+        states = [[np.stack([found[key][1][l][s] for key in keys]) for s in range(len(lstm_states))]
+                  for l, lstm_states in enumerate(found[keys[0]][1])]
+        set_lstm_states(model, states)
+
+        for b in missing:
+            self.entries[keys[b]] = found[keys[b]]
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return logits
+
+
+def sample_ids(logits, temperatures, rngs):
+    """ Sample one id per row from logits / temperature, each row with its own random generator """
+    logits = np.asarray(logits, dtype='float64') / temperatures[:, np.newaxis]
+    probs = np.exp(logits - logits.max(axis=1, keepdims=True))
+    cdf = np.cumsum(probs, axis=1)
+    u = np.array([rng.random() for rng in rngs]) * cdf[:, -1]
+    return np.minimum((cdf < u[:, np.newaxis]).sum(axis=1), logits.shape[1] - 1)
+
+
+def generate_batch(start_strings, model, char2idx, num_generate=1000, temperatures=1.0, seeds=None,
+                   prompt_cache=None):
+    """ Generate len(start_strings) independent texts at once with a stateful generator.
+
+    The generator must be built with batch size len(start_strings): every
+    sequence goes through the LSTMs as one row of the batch, so the cost of a
+    step is shared by all of them. Each sequence has its own prompt,
+    temperature and random seed, and its output doesn't depend on the others.
+    With a PromptStateCache the prompts already seen are not fed again.
+    """
+    batch_size = len(start_strings)
+    temperatures = np.broadcast_to(np.asarray(temperatures, dtype='float64'), (batch_size,))
+    if seeds is None:
+        seeds = [None] * batch_size
+    rngs = [np.random.default_rng(seed) for seed in seeds]
+
+    idx2char = np.empty(len(char2idx), dtype=object)
+    for char, idx in char2idx.items():
+        idx2char[idx] = char
+
+    if prompt_cache is not None:
+        logits = prompt_cache.consume_prompts(model, start_strings, char2idx)
+    else:
+        prompts_ids = [[char2idx[s] for s in start_string] for start_string in start_strings]
+        logits = consume_prompts(model, prompts_ids)
+
+    generated_ids = np.empty((batch_size, num_generate), dtype=np.int64)
+    for i in range(num_generate):
+        predicted_ids = sample_ids(logits, temperatures, rngs)
+        generated_ids[:, i] = predicted_ids
+        if i + 1 < num_generate:
+            logits = model(tf.constant(predicted_ids[:, np.newaxis]))[:, -1, :].numpy()
+
+    return [start_string + ''.join(idx2char[ids]) for start_string, ids in zip(start_strings, generated_ids)]
+
+
+class GraphDecoder:
+    """ Autoregressive sampling of the stateful generator inside a single tf.function.
+
+    The whole sampling loop is a graph while loop: the LSTM states stay in the
+    stateful layers, the ids are collected in a TensorArray and only the final
+    (batch, num_generate) ids tensor comes back to Python to be decoded to text.
+    The loop is traced once per generator, num_generate and temperatures are
+    tensors so changing them doesn't trace it again.
+    """
+
+    def __init__(self, model, char2idx, jit_compile=False):
+        self.model = model
+        self.char2idx = char2idx
+        self.idx2char = np.empty(len(char2idx), dtype=object)
+        for char, idx in char2idx.items():
+            self.idx2char[idx] = char
+        self.decode = tf.function(self._decode, jit_compile=jit_compile)
+
+    def _decode(self, logits, num_generate, temperatures):
+        ids = tf.TensorArray(tf.int64, size=num_generate)
+        for i in tf.range(num_generate):
+            # sample next char based on distribution and temperature
+            predicted_ids = tf.random.categorical(logits / temperatures[:, tf.newaxis], num_samples=1)
+            ids = ids.write(i, predicted_ids[:, 0])
+            logits = self.model(predicted_ids)[:, -1, :]
+        return tf.transpose(ids.stack())
+
+    def generate_ids(self, start_strings, num_generate=1000, temperatures=1.0, prompt_cache=None):
+        if prompt_cache is not None:
+            logits = prompt_cache.consume_prompts(self.model, start_strings, self.char2idx)
+        else:
+            logits = consume_prompts(self.model, [[self.char2idx[s] for s in start_string]
+                                                  for start_string in start_strings])
+        temperatures = np.broadcast_to(np.asarray(temperatures, dtype='float32'), (len(start_strings),))
+        return self.decode(tf.constant(logits), tf.constant(num_generate), tf.constant(temperatures)).numpy()
+
+    def generate(self, start_strings, num_generate=1000, temperatures=1.0, prompt_cache=None):
+        """ Like generate_batch, the texts are decoded from the ids only at the end """
+        generated_ids = self.generate_ids(start_strings, num_generate, temperatures, prompt_cache)
+        return [start_string + ''.join(self.idx2char[ids]) for start_string, ids in zip(start_strings, generated_ids)]
+
+
+class BeamSearchDecoder:
+    """ Beam search of the stateful generator, with every verse an hendecasyllable.
+
+    The generator must be built with batch size beam_width: each beam is a row
+    of the batch and its (h, c) states stay in the stateful LSTMs, so a step of
+    the search is one batched call of the model, after the states are gathered
+    from the parent beam of each row in the same tf.function.
+
+    A beam whose current verse can no longer be read as 11 syllables, or is
+    longer than max_verse_length characters, is pruned, and a verse can end
+    ('\\n') only if it's an hendecasyllable.
+    With a common.rhymes.RhymeIndex the verses also follow the terza rima,
+    counted from the first verse of start_string: ending a verse without the
+    rhyme id of the verse two before it costs rhyme_penalty to the score of
+    the beam (np.inf forbids it), except for the second verse of each
+    terzina, that opens a new rhyme.
+    With stochastic the beams are chosen by Gumbel-top-k, a sample without
+    replacement, instead of the top scores, which on long texts collapse on a
+    single repeating beam.
+    """
+
+    def __init__(self, model, char2idx, max_verse_length=50, rhyme_index=None, rhyme_penalty=5.0,
+                 jit_compile=False):
+        self.model = model
+        self.rhyme_index = rhyme_index
+        self.rhyme_penalty = rhyme_penalty
+        self.beam_width = model.input_shape[0]
+        self.max_verse_length = max_verse_length
+        self.char2idx = char2idx
+        self.idx2char = np.empty(len(char2idx), dtype=object)
+        for char, idx in char2idx.items():
+            self.idx2char[idx] = char
+        self.newline = char2idx['\n']
+        self.step = tf.function(self._step, jit_compile=jit_compile)
+
+    def _step(self, parents, ids):
+        for lstm in stateful_lstms(self.model):
+            for state in lstm.states:
+                state.assign(tf.gather(state, parents))
+        return tf.nn.log_softmax(self.model(ids[:, tf.newaxis])[:, -1, :])
+
+    def _allowed(self, verse, after_blank):
+        """ (newline, other characters) allowed after the current verse of a beam """
+        if not verse.strip():
+            # a single blank line between the terzine
+            return not after_blank, True
+        return is_hendecasyllable(verse), len(verse) < self.max_verse_length and can_reach_hendecasyllable(verse)
+
+    def _rhymes(self, verses, allowed, rhymes, n_verses):
+        """ (rhyme id of each verse, True where ending the verse would break the terza rima) """
+        ending = allowed[:, 0] & np.array([bool(verse.strip()) for verse in verses])
+        verse_rhymes = np.zeros(len(verses), dtype=np.int32)
+        if ending.any():
+            verse_rhymes[ending] = self.rhyme_index.lookup([verse for verse, e in zip(verses, ending) if e])
+        # the second verse of a terzina is free, the others rhyme with the verse two before,
+        # if the rhyme of that one is known
+        required = np.where((n_verses >= 2) & (n_verses % 3 != 1), rhymes[:, 0], 0)
+        return verse_rhymes, ending & (required != 0) & (verse_rhymes != required)
+
+    def generate(self, start_string, num_generate=1000, temperature=1.0, stochastic=True, seed=None,
+                 max_seconds=None):
+        """ The best of beam_width continuations of start_string.
+
+        With max_seconds the search stops when the time is over and the best
+        beam up to there is returned, shorter than num_generate.
+        """
+        start = time.perf_counter()
+        rng = np.random.default_rng(seed)
+        vocab_size = len(self.char2idx)
+        logits = consume_prompts(self.model, [[self.char2idx[s] for s in start_string]] * self.beam_width)
+        log_probs = tf.nn.log_softmax(logits).numpy()
+
+        # all the beams start from the same prompt, only one is kept at the first step
+        scores = np.full(self.beam_width, -np.inf)
+        scores[0] = 0
+        last_line = start_string.split('\n')[-1]
+        verses = [last_line] * self.beam_width
+        after_blank = [start_string.endswith('\n\n')] * self.beam_width
+        # rhyme ids of the last two verses of each beam, and number of its verses
+        prompt_verses = [line for line in start_string.split('\n')[:-1] if line.strip()]
+        prompt_rhymes = [0, 0] + list(self.rhyme_index.lookup(prompt_verses[-2:])) if self.rhyme_index is not None else [0, 0]
+        rhymes = np.tile(np.array(prompt_rhymes[-2:], dtype=np.int32), (self.beam_width, 1))
+        n_verses = np.full(self.beam_width, len(prompt_verses))
+        parents_history = np.zeros((num_generate, self.beam_width), dtype=np.int64)
+        ids_history = np.zeros((num_generate, self.beam_width), dtype=np.int64)
+
+        n_generated = 0
+        for i in range(num_generate):
+            allowed = np.array([self._allowed(verse, blank) for verse, blank in zip(verses, after_blank)])
+            if self.rhyme_index is not None:
+                verse_rhymes, off_rhyme = self._rhymes(verses, allowed, rhymes, n_verses)
+            candidates = scores[:, np.newaxis] + log_probs / temperature
+            if self.rhyme_index is not None:
+                candidates[off_rhyme, self.newline] -= self.rhyme_penalty
+            candidates[~allowed[:, 0], self.newline] = -np.inf
+            other = np.ones(vocab_size, dtype=bool)
+            other[self.newline] = False
+            candidates[np.ix_(~allowed[:, 1], other)] = -np.inf
+
+            keys = candidates.flatten()
+            if stochastic:
+                keys = keys + rng.gumbel(size=keys.shape)
+            best = np.argpartition(-keys, self.beam_width)[:self.beam_width]
+            # the end of a verse is rarely the most likely character: the best beam that can end
+            # its verse here always keeps a place, in case the ones going on have to be pruned later
+            newlines = np.arange(self.beam_width) * vocab_size + self.newline
+            best_newline = newlines[np.argmax(keys[newlines])]
+            if np.isfinite(keys[best_newline]) and not np.isin(best_newline, best):
+                best[np.argmin(keys[best])] = best_newline
+            if not np.isfinite(keys[best]).any():
+                break
+            parents, ids = best // vocab_size, best % vocab_size
+            scores = candidates.flatten()[best]
+
+            parents_history[i], ids_history[i] = parents, ids
+            n_generated = i + 1
+            after_blank = [ids[b] == self.newline and not verses[parent].strip() for b, parent in enumerate(parents)]
+            if self.rhyme_index is not None:
+                ends_verse = (ids == self.newline) & np.array([bool(verses[parent].strip()) for parent in parents])
+                rhymes = np.where(ends_verse[:, np.newaxis],
+                                  np.stack([rhymes[parents, 1], verse_rhymes[parents]], axis=1), rhymes[parents])
+                n_verses = n_verses[parents] + ends_verse
+            verses = ['' if ids[b] == self.newline else verses[parent] + self.idx2char[ids[b]]
+                      for b, parent in enumerate(parents)]
+
+            if max_seconds is not None and time.perf_counter() - start > max_seconds:
+                break
+            if i + 1 < num_generate:
+                log_probs = self.step(tf.constant(parents), tf.constant(ids)).numpy()
+
+        # follow the parents back from the best beam
+        beam = int(np.argmax(scores))
+        generated_ids = np.empty(n_generated, dtype=np.int64)
+        for i in range(n_generated - 1, -1, -1):
+            generated_ids[i] = ids_history[i, beam]
+            beam = parents_history[i, beam]
+        return start_string + ''.join(self.idx2char[generated_ids])
@@ -0,0 +1,171 @@
+import os
+from pathlib import Path
+
+import numpy as np
+
+# epsilon of the Keras BatchNormalization layers of build_model
+BATCH_NORM_EPSILON = 1e-3
+
+# arrays of model.get_weights() for each layer of build_model, in order
+LAYERS = (('embedding', 1), ('dense_in', 2), ('lstm_1', 3), ('norm_1', 4), ('dense_1', 2),
+          ('lstm_2', 3), ('norm_2', 4), ('dense_2', 2), ('dense_out', 2))
+
+
+def export_weights(model, path, chars):
+    """ Write the weights of a build_model model, training model or generator, with its characters for NumpyGenerator.
+
+    The arrays are those of model.get_weights() as arr_0, arr_1, ... like the
+    checkpoints of common.checkpoint.AsyncCheckpointWriter, which NumpyGenerator
+    can also load, plus the characters of the vocabulary in 'chars'.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.%d.tmp' % os.getpid())
+    with open(tmp_path, 'wb') as file:
+        np.savez(file, *model.get_weights(), chars=np.array(list(chars)))
+    os.replace(tmp_path, path)
+    return path
+
+
+def _sigmoid(x):
+    np.negative(x, out=x)
+    np.exp(x, out=x)
+    x += 1
+    np.reciprocal(x, out=x)
+
+
+def _lstm_step(z, h, c):
+    """ Update (h, c) in place from z, the input and recurrent projections summed (gates i, f, c, o) """
+    units = len(h)
+    _sigmoid(z[:2 * units])
+    _sigmoid(z[3 * units:])
+    i, f, g, o = z[:units], z[units:2 * units], z[2 * units:3 * units], z[3 * units:]
+    np.tanh(g, out=g)
+    c *= f
+    i *= g
+    c += i
+    np.tanh(c, out=h)
+    h *= o
+
+
+class NumpyGenerator:
+    """ The DeepComedy generator (build_model with stateful=True and batch size 1) in NumPy, without TensorFlow.
+
+    The weights are read from export_weights() or from a checkpoint, and
+    folded once for the inference of one sequence:
+
+        embedding -> dense_in -> input projection of the first LSTM:
+            a (vocab_size, 4 * lstm_unit_1) table, a step looks up a row
+        batch normalization -> dense:
+            the affine normalization folded into the kernel and bias
+
+    A call runs the recurrence on buffers allocated at load time, so the
+    only work per character is the two recurrent matrix products and the
+    small dense layers. Like the stateful Keras LSTM given an initial_state,
+    the second LSTM starts from the last hidden state of the first one
+    (concatenated twice) only when its own states are all zeros.
+
+        generator = NumpyGenerator.load('generator.npz')
+        generator.reset_states()
+        logits = generator(input_ids)  # generator(input_eval)[:, -1, :] of Keras
+    """
+
+    def __init__(self, weights, chars):
+        weights = [np.asarray(w, dtype=np.float32) for w in weights]
+        layers = {}
+        for name, count in LAYERS:
+            layers[name], weights = weights[:count], weights[count:]
+        if weights:
+            raise ValueError("{} arrays left over, the weights are not those of build_model".format(len(weights)))
+
+        self.chars = list(chars)
+        self.char2idx = { char: idx for idx, char in enumerate(self.chars) }
+
+        embeddings, = layers['embedding']
+        kernel, bias = layers['dense_in']
+        self.kernel_1, self.recurrent_kernel_1, self.bias_1 = layers['lstm_1']
+        # the input projection of the first LSTM for each character
+        self.input_table_1 = np.maximum(embeddings @ kernel + bias, 0) @ self.kernel_1 + self.bias_1
+        self.dense_1 = self._fold(layers['norm_1'], *layers['dense_1'])
+        self.kernel_2, self.recurrent_kernel_2, self.bias_2 = layers['lstm_2']
+        self.dense_2 = self._fold(layers['norm_2'], *layers['dense_2'])
+        self.kernel_out, self.bias_out = layers['dense_out']
+
+        units_1, units_2 = len(self.recurrent_kernel_1), len(self.recurrent_kernel_2)
+        if units_2 != 2 * units_1:
+            raise ValueError("lstm_unit_2 ({}) must be twice lstm_unit_1 ({})".format(units_2, units_1))
+        self.h1, self.c1 = np.zeros(units_1, dtype=np.float32), np.zeros(units_1, dtype=np.float32)
+        self.h2, self.c2 = np.zeros(units_2, dtype=np.float32), np.zeros(units_2, dtype=np.float32)
+        self._z1 = np.empty(4 * units_1, dtype=np.float32)
+        self._z2 = np.empty(4 * units_2, dtype=np.float32)
+        self._hidden = np.empty(len(self.dense_2[1]), dtype=np.float32)
+        self._logits = np.empty(len(self.bias_out), dtype=np.float32)
+
+    @staticmethod
+    def _fold(norm, kernel, bias):
+        """ (kernel, bias) of dense(batch_norm(x)) as a single affine layer """
+        gamma, beta, moving_mean, moving_variance = norm
+        scale = gamma / np.sqrt(moving_variance + BATCH_NORM_EPSILON)
+        shift = beta - moving_mean * scale
+        return (scale[:, None] * kernel).astype(np.float32), (shift @ kernel + bias).astype(np.float32)
+
+    @classmethod
+    def load(cls, path, chars=None):
+        """ Generator with the weights of export_weights() or of a checkpoint, which needs the chars """
+        with np.load(path) as data:
+            weights = [data['arr_%d' % i] for i in range(sum(name.startswith('arr_') for name in data.files))]
+            if chars is None:
+                if 'chars' not in data.files:
+                    raise ValueError("{} has no characters, they must be given".format(path))
+                chars = [str(char) for char in data['chars']]
+        return cls(weights, chars)
+
+    def reset_states(self):
+        for state in (self.h1, self.c1, self.h2, self.c2):
+            state[:] = 0
+
+    def __call__(self, input_ids):
+        """ Logits (1, vocab_size) of the character after input_ids, updating the LSTM states """
+        input_ids = np.asarray(input_ids).reshape(-1)
+        dense_kernel_1, dense_bias_1 = self.dense_1
+        has_state = self.h2.any() or self.c2.any()
+
+        # the first LSTM over the whole input, before the second one can start
+        outputs_1 = np.empty((len(input_ids), len(self.h1)), dtype=np.float32)
+        for t, idx in enumerate(input_ids):
+            np.dot(self.h1, self.recurrent_kernel_1, out=self._z1)
+            self._z1 += self.input_table_1[idx]
+            _lstm_step(self._z1, self.h1, self.c1)
+            outputs_1[t] = self.h1
+
+        if not has_state:
+            self.h2[:len(self.h1)] = self.h1
+            self.h2[len(self.h1):] = self.h1
+            self.c2[:] = self.h2
+
+        inputs_2 = np.maximum(outputs_1 @ dense_kernel_1 + dense_bias_1, 0) @ self.kernel_2 + self.bias_2
+        for t in range(len(input_ids)):
+            np.dot(self.h2, self.recurrent_kernel_2, out=self._z2)
+            self._z2 += inputs_2[t]
+            _lstm_step(self._z2, self.h2, self.c2)
+
+        dense_kernel_2, dense_bias_2 = self.dense_2
+        np.dot(self.h2, dense_kernel_2, out=self._hidden)
+        self._hidden += dense_bias_2
+        np.maximum(self._hidden, 0, out=self._hidden)
+        np.dot(self._hidden, self.kernel_out, out=self._logits)
+        self._logits += self.bias_out
+        return self._logits[None].copy()
+
+    def generate(self, start_string, num_generate=1000, temperature=1.0, seed=None):
+        """ start_string followed by num_generate characters sampled from the softmax of logits / temperature """
+        rng = np.random.default_rng(seed)
+        self.reset_states()
+        logits = self([self.char2idx[char] for char in start_string])[0]
+        text_generated = []
+        for _ in range(num_generate):
+            logits /= temperature
+            probabilities = np.exp(logits - logits.max())
+            predicted_id = rng.choice(len(probabilities), p=probabilities / probabilities.sum())
+            text_generated.append(self.chars[predicted_id])
+            logits = self([predicted_id])[0]
+        return start_string + ''.join(text_generated)
@@ -0,0 +1,163 @@
+import tensorflow as tf
+
+# In char2idx the newline is 0 and the punctuation marks are the ids 1 to 10 inclusive
+NEWLINE_ID = 0
+MAX_PUNCTUATION_ID = 10
+
+# max number of rhymes (arbitrary choosen, it's an hyperparameter)
+MAX_RHYMES = 4
+
+
+def _last_index_before(mask):
+    """ For each position j the last index i < j where mask is True, -1 if there is none """
+    length = tf.shape(mask)[1]
+    positions = tf.range(length)
+    # before[i, j] is True when i < j
+    before = positions[:, tf.newaxis] < positions[tf.newaxis, :]
+    candidates = tf.where(mask[:, :, tf.newaxis] & before[tf.newaxis, :, :],
+                          positions[tf.newaxis, :, tf.newaxis], -1)
+    return tf.reduce_max(candidates, axis=1)
+
+
+def _segment_reduce(reduce_fn, data, segment_ids, n_segments):
+    """ Per-row segment reduction of a (batch, length) tensor into (batch, n_segments) """
+    batch = tf.shape(data)[0]
+    row_offsets = tf.range(batch)[:, tf.newaxis] * n_segments
+    reduced = reduce_fn(data, segment_ids + row_offsets, num_segments=batch * n_segments)
+    return tf.reshape(reduced, (batch, n_segments))
+
+
+class RhymeTable:
+    """ Rhyme id of every verse of a batch inside the graph, with the codes of a common.rhymes.RhymeIndex.
+
+    Like RhymeIndex.lookup, the codes of the last 1, 2, ..., max_length
+    letters of each verse are searched among the sorted keys of the index
+    and the longest ending found gives the rhyme, 0 if there's none.
+    """
+
+    def __init__(self, rhyme_index, char2idx):
+        self.max_length = rhyme_index.max_length
+        self.base = rhyme_index.base
+        self.letter_codes = tf.constant(rhyme_index.letter_codes(char2idx), dtype=tf.int64)
+        self.keys = tf.constant(rhyme_index.keys, dtype=tf.int64)
+        self.values = tf.constant(rhyme_index.values, dtype=tf.int32)
+
+    def lookup(self, codes):
+        """ Rhyme id of each code, 0 where it's not the code of an ending """
+        flat = tf.reshape(codes, (1, -1))
+        positions = tf.minimum(tf.searchsorted(self.keys[tf.newaxis, :], flat), tf.size(self.keys) - 1)
+        found = tf.equal(tf.gather(self.keys, positions), flat)
+        return tf.reshape(tf.where(found, tf.gather(self.values, positions), 0), tf.shape(codes))
+
+    def verse_rhymes(self, ids, char, verse_ids, n_segments):
+        """ (batch, n_segments) rhyme ids of the verses, numbered by verse_ids, of the characters where char is True """
+        length = tf.shape(ids)[1]
+        letter_codes = tf.pad(tf.gather(self.letter_codes, ids), [[0, 0], [0, 1]])  # index `length` reads 0
+        positions = tf.where(char, tf.range(length)[tf.newaxis, :], -1)
+
+        suffix = tf.zeros((tf.shape(ids)[0], n_segments), dtype=tf.int64)
+        rhyme = tf.zeros((tf.shape(ids)[0], n_segments), dtype=tf.int32)
+        for k in range(self.max_length):
+            # position of the k-th letter from the end of each verse, -1 if the verse is shorter
+            last_pos = _segment_reduce(tf.math.unsorted_segment_max, positions, verse_ids, n_segments)
+            positions = tf.where(tf.equal(positions, tf.gather(last_pos, verse_ids, batch_dims=1)), -1, positions)
+            code = tf.gather(letter_codes, tf.where(last_pos < 0, length, last_pos), batch_dims=1)
+            suffix += code * self.base ** k
+            # the longer endings found replace the shorter ones
+            found = self.lookup(suffix)
+            rhyme = tf.where((code > 0) & (found > 0), found, rhyme)
+        return rhyme
+
+
+def rhyme_pairs(ids, rhyme_table):
+    """ Rhyme scheme of a batch of encoded sequences, same rules as divide_versi + rhymes_extractor.
+
+    The sequence is split in verses on newlines (consecutive newlines count
+    once, punctuation is ignored), the last verse is dropped if the sequence
+    does not end with a newline and the first one if it is shorter than three
+    characters. Verse i rhymes with verse i+2 or i+4 when rhyme_table finds
+    the same rhyme for both.
+
+    Returns a (batch, 2 * (length + 1)) boolean tensor: position 2*i is True if
+    the verse i rhymes with i+2, position 2*i+1 if it rhymes with i+4, so the
+    True positions in order are exactly the list built by rhymes_extractor.
+    """
+    ids = tf.cast(ids, tf.int32)
+    batch = tf.shape(ids)[0]
+    length = tf.shape(ids)[1]
+    n_segments = length + 1  # there can't be more verses than characters + 1
+
+    newline = tf.equal(ids, NEWLINE_ID)
+    char = ids > MAX_PUNCTUATION_ID
+
+    # a newline opens a new verse unless the previous newline/character was a newline too
+    last = _last_index_before(newline | char)
+    previous_newline = tf.gather(tf.pad(newline, [[0, 0], [0, 1]]), tf.where(last < 0, length, last), batch_dims=1)
+    opens_verse = newline & ~previous_newline
+    verse_ids = tf.cumsum(tf.cast(opens_verse, tf.int32), axis=1)
+    n_verses = 1 + verse_ids[:, -1]
+
+    verse_lengths = _segment_reduce(tf.math.unsorted_segment_sum, tf.cast(char, tf.int32), verse_ids, n_segments)
+    rhyme = rhyme_table.verse_rhymes(ids, char, verse_ids, n_segments)
+
+    # incomplete last verse and too short first verse are not considered
+    n_verses -= tf.cast(tf.not_equal(ids[:, -1], NEWLINE_ID), tf.int32)
+    first = tf.cast((n_verses > 0) & (verse_lengths[:, 0] < 3), tf.int32)
+
+    # shift the kept verses to start at index 0, the rest is out of range
+    shift = tf.range(n_segments)[tf.newaxis, :] + first[:, tf.newaxis]
+    valid = shift < n_verses[:, tf.newaxis]
+    shift = tf.minimum(shift, n_segments - 1)
+    rhyme = tf.gather(rhyme, shift, batch_dims=1)
+
+    def rhymes_with(offset):
+        pad = [[0, 0], [0, offset]]
+        next_valid = tf.pad(valid, pad)[:, offset:]
+        next_rhyme = tf.pad(rhyme, pad)[:, offset:]
+        return valid & next_valid & (rhyme > 0) & tf.equal(rhyme, next_rhyme)
+
+    return tf.reshape(tf.stack([rhymes_with(2), rhymes_with(4)], axis=-1), (batch, 2 * n_segments))
+
+
+def rhyme_scores(x_ids, y_ids, rhyme_table, max_rhymes=MAX_RHYMES):
+    """ (batch, max_rhymes) scores of the generated rhymes x against Dante's rhymes y.
+
+    Like in the Python loss each score is 1 for a rhyme of Dante also generated,
+    0 for a rhyme of Dante missing in the generated text, 0.5 for a generated
+    rhyme that Dante doesn't have; all 0 if nothing rhymes in the generated text.
+    """
+    x_rhymes = rhyme_pairs(x_ids, rhyme_table)
+    y_rhymes = rhyme_pairs(y_ids, rhyme_table)
+
+    def nth_rhyme_found(rhymes, other):
+        # for the n-th rhyme of `rhymes`, is it also in `other`?
+        rank = tf.cumsum(tf.cast(rhymes, tf.int32), axis=1) - 1
+        nth = rhymes[:, :, tf.newaxis] & tf.equal(rank[:, :, tf.newaxis], tf.range(max_rhymes))
+        return tf.reduce_any(nth & other[:, :, tf.newaxis], axis=1)
+
+    n_x = tf.reduce_sum(tf.cast(x_rhymes, tf.int32), axis=1, keepdims=True)
+    n_y = tf.reduce_sum(tf.cast(y_rhymes, tf.int32), axis=1, keepdims=True)
+    i = tf.range(max_rhymes)[tf.newaxis, :]
+
+    x_bin = tf.where(n_x > 0, tf.ones((1, max_rhymes)), tf.zeros((1, max_rhymes)))
+    x_bin = tf.where((i < n_y) & ~nth_rhyme_found(y_rhymes, x_rhymes), 0.0, x_bin)
+    x_bin = tf.where((i < n_y) & (i < n_x) & ~nth_rhyme_found(x_rhymes, y_rhymes), 0.5, x_bin)
+    return x_bin
+
+
+def rhyme_loss(x_ids, y_ids, rhyme_table, max_rhymes=MAX_RHYMES):
+    """ MSE between the rhyme scores and Dante's scores, that are always 1 """
+    x_bin = rhyme_scores(x_ids, y_ids, rhyme_table, max_rhymes)
+    return tf.reduce_mean(tf.square(1.0 - x_bin))
+
+
+def get_custom_loss(x_batch, y_batch, rhyme_table):
+    """ In-graph rhyme loss of the predicted logits x_batch (batch, len_text, vocab_size).
+
+    Samples one character per position from the logits, like the Python
+    version, and scores the rhymes of the whole batch at once.
+    """
+    logits_shape = tf.shape(x_batch)
+    predicted_ids = tf.random.categorical(tf.reshape(x_batch, (-1, logits_shape[-1])), num_samples=1)
+    predicted_ids = tf.reshape(predicted_ids, logits_shape[:-1])
+    return rhyme_loss(predicted_ids, y_batch, rhyme_table)
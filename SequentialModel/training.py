@@ -0,0 +1,57 @@
+from contextlib import nullcontext
+
+import tensorflow as tf
+
+from rhyme_loss import get_custom_loss
+
+
+def make_train_step(model, optimizer, rhyme_table, compiled=True, jit_compile=False, recorder=None):
+    """ One optimization step on a batch, returns (current_loss, scce, custom).
+
+    With compiled=True the step is traced once with tf.function, so forward
+    pass, losses, gradients and the optimizer update run as a single graph
+    instead of being dispatched op by op from Python; jit_compile=True also
+    compiles that graph with XLA.
+
+    With a tf.keras.mixed_precision.LossScaleOptimizer (mixed precision
+    training, see deepcomedy.py) the loss is scaled before the gradients and
+    the gradients unscaled before the update, so the small bfloat16 gradients
+    don't underflow; the update is skipped when they are not finite.
+
+    With a common.telemetry.StepRecorder and compiled=False the forward pass,
+    the two losses, the gradients and apply_gradients are timed as phases of
+    the current step. A compiled step can only be timed as a whole.
+    """
+    loss_scaling = isinstance(optimizer, tf.keras.mixed_precision.LossScaleOptimizer)
+
+    def phase(name):
+        return recorder.phase(name) if recorder is not None and not compiled else nullcontext()
+
+    def train_step(x, y):
+        with tf.GradientTape() as tape:
+            with phase('forward'):
+                # returns a tensor with shape (batch_size, len_text, vocab_size)
+                y_predicted = model(x)
+
+            with phase('scce'):
+                scce = tf.keras.losses.sparse_categorical_crossentropy(y, y_predicted, from_logits = True)
+            with phase('custom_loss'):
+                # the custom loss is a scalar, it's summed to the loss of each character
+                custom = get_custom_loss(y_predicted, y, rhyme_table)
+
+            current_loss = tf.reduce_mean(scce + custom)
+            if loss_scaling:
+                scaled_loss = optimizer.get_scaled_loss(current_loss)
+
+        with phase('gradients'):
+            if loss_scaling:
+                gradients = optimizer.get_unscaled_gradients(tape.gradient(scaled_loss, model.trainable_variables))
+            else:
+                gradients = tape.gradient(current_loss, model.trainable_variables)
+        with phase('apply_gradients'):
+            optimizer.apply_gradients(zip(gradients, model.trainable_variables))
+        return current_loss, scce, custom
+
+    if compiled:
+        return tf.function(train_step, jit_compile=jit_compile)
+    return train_step
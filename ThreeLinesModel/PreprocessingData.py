@@ -1,79 +1,40 @@
+import sys
 import numpy as np
-import pandas as pd
-import re
 
-path = 'data/DivinaCommedia.txt'
-
-file = open(path, 'r')
-
-cont = 0
-riga = 0
-
-df = {
-    # "id": [],
-    "0": [],
-    "1": [],
-    "2": [],
-    "1_syllables": [],
-    "2_syllables": [],
-    "3_syllables": [],
-}
-
-for line in file:
-    l = line.strip()
-
-    # check useless lines
-    if l is "" or \
-            l[0] == "[" or \
-            l[0] == "" or \
-            l == "INFERNO" or \
-            l == "PURGATORIO" or \
-            l == "PARADISO" or \
-            l.startswith("Canto"):
-        continue
-
-    # Replace exceptional characters
-    l = l.replace("ä", "a")
-    l = l.replace("é", "è")
-    l = l.replace("ë", "è")
-    l = l.replace("Ë", "E")
-    l = l.replace("ï", "i")
-    l = l.replace("Ï", "I")
-    l = l.replace("ó", "ò")
-    l = l.replace("ö", "o")
-    l = l.replace("ü", "u")
-
-    l = l.replace("(", "-")
-    l = l.replace(")", "-")
-    l = l.replace("[", "")
-    l = l.replace("]", "")
-
-    l = re.sub(r'[0-9]+', '', l)
-    l = l.replace(" \n", "\n")
-    # print(l)
-
-    if cont == 0:
-        df["0"].append(l)
-        df["1_syllables"].append(11)
-        cont += 1
-    elif cont == 1:
-        df["1"].append(l)
-        df["2_syllables"].append(11)
-        cont += 1
-    elif cont == 2:
-        df["2"].append(l)
-        df["3_syllables"].append(11)
-        cont = 0
-        # df["id"].append(str(riga))
-        # riga += 1
-    else:
-        print("HOUSTON WE HAVE PRoBLEM")
-
-# the Inferno have one terzina more than other so I delete it
-df["0"] = df["0"][:-1]
-df["1_syllables"] = df["1_syllables"][:-1]
+sys.path.append("..")  # modules shared with the SequentialModel
+from common.normalize import normalize_text
+from common.structure import CANTICHE, PoemIndex
+from common.syllables import is_hendecasyllable, syllable_count, word_syllables
+from terzine import build_terzine, save_terzine
 
+path = 'data/DivinaCommedia.txt'
 
-dataframe = pd.DataFrame(df)
-print(dataframe)
-dataframe.to_csv("data/DivinaCommedia.csv")
+# rare characters, brackets, numbers and introductions of the Canti are removed by
+# common/normalize.py, the text and the offsets of its parts are cached on disk
+poem = PoemIndex.load(path)
+
+# the terzine of each Canto, its last line alone is left out so every Canto starts
+# with a new terzina
+terzine = list(poem.terzine())
+
+# the syllables are counted on the text with the diaeresis marks, that the normalized
+# one has lost; its terzine are the same
+with open(path, 'r', encoding="utf8") as file:
+    metrical_poem = PoemIndex.build(normalize_text(file.read().replace("\r\n", "\n"), keep_diaeresis=True))
+metrical_verses = [verses for _, _, verses in metrical_poem.terzine()]
+assert len(metrical_verses) == len(terzine)
+syllables = [[syllable_count(verse) for verse in verses] for verses in metrical_verses]
+
+arrays, tokenizer = build_terzine(terzine, syllables)
+
+for c, cantica in enumerate(CANTICHE):
+    print("{}: {} canti, {} terzine".format(cantica, arrays['canto'][arrays['cantica'] == c].max(),
+                                          np.count_nonzero(arrays['cantica'] == c)))
+print("Syllables: {}, {:.1%} of the lines can be read as hendecasyllables, {} distinct words".format(
+    dict(zip(*np.unique(arrays['syllables'], return_counts=True))),
+    np.mean([is_hendecasyllable(verse) for verses in metrical_verses for verse in verses]),
+    word_syllables.cache_info().currsize))
+print("{} tokens, lines padded to {} characters".format(tokenizer.n_tokens, arrays['inputs'].shape[2]))
+
+# token ids already shifted and padded, the trainer doesn't process any string
+save_terzine("data/DivinaCommedia.npz", arrays, tokenizer)
@@ -0,0 +1,85 @@
+import math
+
+import numpy as np
+from keras.utils import Sequence
+
+
+def unpadded_sequences(ids, lengths):
+    """ The (N, 3, width) padded ids of the terzine dataset as three lists of unpadded numpy arrays """
+    return [[line_ids[:length] for line_ids, length in zip(ids[:, i], lengths[:, i])] for i in range(3)]
+
+
+class BucketedTerzine(Sequence):
+    """ Batches of terzine of similar length, each padded only to its own longest line.
+
+    The terzine are sorted by length (with a little noise, so batches change
+    between epochs) and split in batches, and the order of the batches is
+    shuffled. Each line of a batch is padded with pad_id to the longest of
+    that line in the batch, and the padded timesteps get a sample weight of 0
+    so they don't count in the loss.
+
+    Yields ([char_0, syllables_0, char_1, syllables_1, char_2, syllables_2],
+    [out_0, out_1, out_2], [weights_0, weights_1, weights_2]) like the fit of
+    BasicDanteRNN with token ids expects.
+    """
+
+    def __init__(self, inputs, outputs, syllables, pad_id, batch_size=64, shuffle=True, seed=None):
+        super(BucketedTerzine, self).__init__()
+        self.inputs = inputs
+        self.outputs = outputs
+        self.syllables = np.asarray(syllables, dtype='float32')
+        self.pad_id = pad_id
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        self.lengths = np.array([[len(ids) for ids in inputs[i]] for i in range(3)]).T  # (N, 3)
+        self.batches = []
+        self.on_epoch_end()
+
+    def __len__(self):
+        return math.ceil(len(self.lengths) / self.batch_size)
+
+    def on_epoch_end(self):
+        key = self.lengths.max(axis=1).astype('float64')
+        if self.shuffle:
+            key += self.rng.uniform(0, 2, len(key))
+        order = np.argsort(key, kind='stable')
+        self.batches = [order[b:b+self.batch_size] for b in range(0, len(order), self.batch_size)]
+        if self.shuffle:
+            self.rng.shuffle(self.batches)
+
+    def _pad(self, sequences, rows, length):
+        batch = np.full((len(rows), length), self.pad_id, dtype='int32')
+        for r, row in enumerate(rows):
+            batch[r, :len(sequences[row])] = sequences[row]
+        return batch
+
+    def __getitem__(self, index):
+        rows = self.batches[index]
+        x, y, weights = [], [], []
+        for i in range(3):
+            length = self.lengths[rows, i].max()
+            x += [self._pad(self.inputs[i], rows, length), self.syllables[rows, i:i+1]]
+            y.append(self._pad(self.outputs[i], rows, length))
+            weights.append((np.arange(length)[np.newaxis, :] < self.lengths[rows, i:i+1]).astype('float32'))
+        # tuples, the Keras 3 data adapter can't make a signature of a batch of lists
+        return tuple(x), tuple(y), tuple(weights)
+
+    def padding_stats(self, fixed_length=None):
+        """ (real, padded bucketed, padded to fixed_length) timesteps of an epoch, all lines together """
+        real = int(self.lengths.sum())
+        bucketed = int(sum(self.lengths[rows].max(axis=0).sum() * len(rows) for rows in self.batches))
+        fixed = None if fixed_length is None else int(fixed_length * self.lengths.size)
+        return real, bucketed, fixed
+
+    def split(self, validation_split, seed=None):
+        """ (train, validation) BucketedTerzine with a random validation_split of the terzine """
+        order = np.random.default_rng(seed).permutation(len(self.lengths))
+        n_validation = int(len(order) * validation_split)
+
+        def subset(rows, shuffle):
+            return BucketedTerzine([[self.inputs[i][r] for r in rows] for i in range(3)],
+                                   [[self.outputs[i][r] for r in rows] for i in range(3)],
+                                   self.syllables[rows], self.pad_id, self.batch_size, shuffle, seed)
+
+        return subset(order[n_validation:], self.shuffle), subset(order[:n_validation], False)
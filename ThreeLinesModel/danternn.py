@@ -10,19 +10,28 @@ Original file is located at
 """
 
 # Commented out IPython magic to ensure Python compatibility.
+import sys
 import numpy as np
-import pandas as pd
 from pathlib import Path
 
 # %tensorflow_version 2.x
 import tensorflow as tf
 print(tf.__version__)
 
-from keras.callbacks import ModelCheckpoint,  CSVLogger
-from keras.preprocessing.text import Tokenizer
+from keras import mixed_precision as keras_mixed_precision
+from keras.callbacks import CSVLogger
+from keras.optimizers import RMSprop
 from keras.utils import np_utils
 from matplotlib import pyplot as plt
-from model import BasicDanteRNN
+from model import BasicDanteRNN, generate_terzine
+from bucketing import BucketedTerzine, unpadded_sequences
+
+sys.path.append("..")  # modules shared with the SequentialModel
+from common.checkpoint import AsyncCheckpointWriter, AsyncModelCheckpoint, load_checkpoint, latest_checkpoint
+from common.telemetry import JsonlSink, StepRecorder, TelemetryCallback
+from common.syllables import HENDECASYLLABLE, is_hendecasyllable
+from terzine import load_terzine
+from export import export_dante_rnn
 
 
 # Settings
@@ -36,8 +45,26 @@ latent_dim = 2048
 # Number of epochs to train for
 epochs = 20
 
-# path of the data
-data_path = 'data/DivinaCommedia.csv'
+# path of the data, written by PreprocessingData.py
+data_path = 'data/DivinaCommedia.npz'
+
+# Cantiche to train on, None for all of them
+cantiche = None
+
+# Feed the lines as token ids, one-hot encoded inside the model, with a sparse loss,
+# instead of one-hot encoded arrays n_tokens times bigger
+sparse_tokens = True
+
+# Batches of terzine of similar length, padded only to the longest line of the batch with the
+# padding masked out of the loss, so no line has to be dropped (needs sparse_tokens)
+bucketed_batches = True
+
+# Syllables of the generated lines, fed to the model in place of the counted ones
+generated_syllables = HENDECASYLLABLE
+
+# Train with bfloat16 computations on float32 weights (opt-in, see benchmarks/bench_mixed_precision.py),
+# with loss scaling of the gradients; the generative model always runs in float32
+mixed_precision = False
 
 name = 'all_data_test_2'
 output_dir = Path('output_%s' % name)
@@ -48,74 +75,71 @@ except FileExistsError:
 
 """# Data import and preprocessing"""
 
-df = pd.read_csv(str(data_path))
-df = df.sample(frac=sample_size)
-
+# token ids of the inputs and outputs of each line, already shifted and padded with new lines
+data, tokenizer = load_terzine(data_path, cantiche)
+tokenizer.save(output_dir / 'tokenizer.json')
+n_tokens = tokenizer.n_tokens
 
-max_line_length = int(max([df['%s' % i].astype(str).str.len().quantile(.99) for i in range(3)]))
+rows = np.random.permutation(len(data['lengths']))[:int(len(data['lengths']) * sample_size)]
+data = { field: values[rows] for field, values in data.items() }
 
-df = df[
-    (df['0'].astype(str).str.len() <= max_line_length) & 
-    (df['1'].astype(str).str.len() <= max_line_length) & 
-    (df['2'].astype(str).str.len() <= max_line_length)
-].copy()
+# lengths of the input (first character + line + new line) of each line
+lengths = data['lengths']
+max_line_length = int(np.quantile(lengths, .99, axis=0).max())
 
-# preprocessing data
-# Pad the lines to the max line length with new lines
-for i in range(3):
-    # For input, duplicate the first character
-    # TODO - Why?
-    df['%s_in' % i] = (df[str(i)].str[0] + df[str(i)]).str.pad(max_line_length+2, 'right', '\n')
-    
-    # 
-    #df['%s_out' % i] = df[str(i)].str.pad(max_line_len, 'right', '\n') + ('\n' if i == 2 else df[str(i+1)].str[0])
-    
-    # TODO - trying to add the next line's first character before the line breaks
-    if i == 2: # If it's the last line
-        df['%s_out' % i] = df[str(i)].str.pad(max_line_length+2, 'right', '\n')
-    else: 
-        # If it's the first or second line, add the first character of the next line to the end of this line.
-        # This helps with training so that the next RNN has a better chance of getting the first character right.
-        df['%s_out' % i] = (df[str(i)] + '\n' + df[str(i+1)].str[0]).str.pad(max_line_length+2, 'right', '\n')
-    
-max_line_length += 2
+if not bucketed_batches:
+    # with a fixed length the lines longer than the 99th percentile are dropped
+    data = { field: values[(lengths <= max_line_length).all(axis=1)] for field, values in data.items() }
 
-inputs = df[['0_in', '1_in', '2_in']].values
+print("{} terzine, {} tokens".format(len(data['lengths']), n_tokens))
 
+if bucketed_batches:
+    # the token ids are padded batch by batch by BucketedTerzine
+    X = Y = None
+elif sparse_tokens:
+    # X is the input for each line in sequences of token ids, one-hot encoded inside the model
+    X = data['inputs'][:, :, :max_line_length].transpose(1, 0, 2).astype('int32')
 
-tokenizer = Tokenizer(filters='', char_level=True)
-tokenizer.fit_on_texts(inputs.flatten())
-n_tokens = len(tokenizer.word_counts) + 1
+    # Y is the output for each line in sequences of token ids, for the sparse categorical loss
+    Y = data['outputs'][:, :, :max_line_length].transpose(1, 0, 2).astype('int32')
+else:
+    # X is the input for each line in sequences of one-hot-encoded values
+    X = np_utils.to_categorical(data['inputs'][:, :, :max_line_length].transpose(1, 0, 2), num_classes=n_tokens)
 
-print(df)
+    # Y is the output for each line in sequences of one-hot-encoded values
+    Y = np_utils.to_categorical(data['outputs'][:, :, :max_line_length].transpose(1, 0, 2), num_classes=n_tokens)
 
-# X is the input for each line in sequences of one-hot-encoded values
-X = np_utils.to_categorical([
-  tokenizer.texts_to_sequences(inputs[:,i]) for i in range(3)
-  ], num_classes=n_tokens)
-
-outputs = df[['0_out', '1_out', '2_out']].values
-
-# Y is the output for each line in sequences of one-hot-encoded values
-Y = np_utils.to_categorical([
-    tokenizer.texts_to_sequences(outputs[:,i]) for i in range(3)
-], num_classes=n_tokens)
-
-# X_syllables is the count of syllables for each line
-X_syllables = df[['0_syllables', '1_syllables', '2_syllables']].values
+# X_syllables is the count of syllables for each line, counted by PreprocessingData.py
+X_syllables = data['syllables']
 
 # The latent dimension of the LSTM
 latent_dim = 2048
+
+optimizer = 'rmsprop'
+if mixed_precision:
+    keras_mixed_precision.set_global_policy('mixed_bfloat16')
+    optimizer = keras_mixed_precision.LossScaleOptimizer(RMSprop())
+
 model = BasicDanteRNN(latent_dim, n_tokens, tokenizer)
 
-model.compile(optimizer='rmsprop', loss='categorical_crossentropy')
+model.compile(optimizer=optimizer, loss='sparse_categorical_crossentropy' if sparse_tokens else 'categorical_crossentropy')
 
-filepath = str(output_dir / ("%s-{epoch:02d}-{loss:.2f}.ckpt" % latent_dim))
-checkpoint = ModelCheckpoint(filepath, monitor='loss', verbose=1, save_best_only=True, save_weights_only=True, mode='min', save_freq=10)
+# weights are snapshotted in memory every 10 batches if the loss improved,
+# and written on a background thread at most once every 30 seconds
+checkpoint_writer = AsyncCheckpointWriter(output_dir, filename="%s-{epoch:02d}-{step:06d}-{loss:.2f}.npz" % latent_dim,
+                                          min_interval_sec=30, keep_last=3)
+checkpoint = AsyncModelCheckpoint(checkpoint_writer, monitor='loss', verbose=1, save_best_only=True, mode='min', save_freq=10)
 
 csv_logger = CSVLogger(str(output_dir / 'training_log.csv'), append=True, separator=',')
 
-callbacks_list = [checkpoint, csv_logger]
+# time of each batch and between batches, chars/sec and RSS, one JSON line per batch in telemetry.jsonl;
+# with profile_steps = (first, last) the TensorFlow profiler traces those batches in the "profile" folder
+profile_steps = None
+telemetry = StepRecorder(JsonlSink(output_dir / 'telemetry.jsonl'), profile_dir=output_dir / 'profile',
+                         profile_steps=profile_steps)
+telemetry_callback = TelemetryCallback(telemetry, chars_per_batch=64 * 3 * max_line_length)
+
+callbacks_list = [checkpoint, csv_logger, telemetry_callback]
 
 # Save the weights using the `checkpoint_path` format
 # model.save_weights(checkpoint_path.format(epoch=0))
@@ -130,108 +154,62 @@ callbacks_list = [checkpoint, csv_logger]
 # 46 è il numero di caratteri massimo per riga
 # 41 è il numero di caratteri possibili per ogni carattare
 
-model.fit([
-    X[0], X_syllables[:,0],
-    X[1], X_syllables[:,1], 
-    X[2], X_syllables[:,2]
-], [Y[0], Y[1], Y[2]], batch_size=64, epochs=epochs, validation_split=.1, callbacks=callbacks_list)
+if bucketed_batches:
+    terzine = BucketedTerzine(unpadded_sequences(data['inputs'], data['lengths']),
+                              unpadded_sequences(data['outputs'], data['lengths']), X_syllables,
+                              pad_id=tokenizer.word_index['\n'], batch_size=64)
+    real_steps, bucketed_steps, fixed_steps = terzine.padding_stats(max_line_length)
+    print("Padded timesteps: {} with buckets, {} padding to {} characters ({:.1%} saved)".format(
+        bucketed_steps - real_steps, fixed_steps - real_steps, max_line_length,
+        1 - (bucketed_steps - real_steps) / (fixed_steps - real_steps)))
+
+    train_batches, validation_batches = terzine.split(.1)
+    # the real characters of a batch, on average
+    telemetry_callback.chars_per_batch = real_steps / len(terzine)
+    model.fit(train_batches, validation_data=validation_batches, epochs=epochs, callbacks=callbacks_list)
+else:
+    model.fit([
+        X[0], X_syllables[:,0],
+        X[1], X_syllables[:,1], 
+        X[2], X_syllables[:,2]
+    ], [Y[0], Y[1], Y[2]], batch_size=64, epochs=epochs, validation_split=.1, callbacks=callbacks_list)
+
+checkpoint_writer.close()
+telemetry.close()
 
 
 """# Generation"""
 
 
 def generate_text(model, num_terzine=33):
-    # Evaluation step (generating text using the learned model)
-
-    first_char = chr(int(np.random.randint(ord('a'), ord('z') + 1)))
-    # print(first_char)
-    # print(tokenizer.texts_to_sequences(first_char))
-    # print(tokenizer.texts_to_sequences(first_char)[0])
-    # Converting our start string to numbers (vectorizing)
-    input_eval = np_utils.to_categorical([
-        tokenizer.texts_to_sequences(first_char)
-    ], num_classes=n_tokens)
-
-    # Empty string to store our results
-    text_generated = []
-
-    # Low temperatures results in more predictable text.
-    # Higher temperatures results in more surprising text.
-    temperature = 1.5
-
-    # given the number of Terzine to write we call the model that return a Terzina
-    # we have to pass as argument of the next call (for the next terzina) the end
-    # of the last generated terzina
-
-    end = False
-    model.reset_states()
-    for _ in range(num_terzine):
-        # one array for each TrainingLine
-        line_output = [[], [], []]
-        for _ in range(max_line_length):
-            # print("START")
-            # print(input_eval)
-            predictions = model((input_eval, X_syllables[0, 0]), training=False)
-
-            cont = 0
-            # print(predictions)
-            # predictions is an array that contains 3 array, each one is a new predicted char
-            for pred in predictions:
-                char = sample(pred[0, 0], temperature)
-                # print("CHAR")
-                # print(char)
-                if char == 1 and not end:
-                    end = True
-                if char != 1 and end:
-                    next_char = char
-                    char = 1
-
-                line_output[cont].append(char)
-                cont += 1
-
-            # use as input the last predicted line
-            # print("END")
-            input_eval = np_utils.to_categorical([
-                tokenizer.texts_to_sequences(tokenizer.sequences_to_texts([line_output[2]])[0])
-            ], num_classes=n_tokens)
-
-        terzina = []
-        # print(line_output)
-        for i in range(3):
-            # print(line_output[i])
-            cleaned_text = tokenizer.sequences_to_texts([
-                line_output[i]
-            ])[0].strip()[1:].replace(
-                '   ', '\n'
-            ).replace(' ', '').replace('\n', ' ')
-
-            terzina.append(cleaned_text)
-
-        # print(terzina)
-
-        text_generated.append(terzina)
-
-    return text_generated
-
-def sample(preds, temperature=1.0):
-    # helper function to sample an index from a probability array
-    # From https://github.com/llSourcell/keras_explained/blob/master/gentext.py
-    preds = np.asarray(preds).astype('float64')
-    preds = np.log(preds) / temperature
-    exp_preds = np.exp(preds)
-    preds = exp_preds / np.sum(exp_preds)
-    probas = np.random.multinomial(1, preds, 1)
-    return np.argmax(probas)
+    # one terzina per call of the model, the last line of each one starts the next (see model.py)
+    return generate_terzine(model, tokenizer, max_line_length, generated_syllables, num_terzine, temperature=1.5)
 
+keras_mixed_precision.set_global_policy('float32')
 generative_model = BasicDanteRNN(latent_dim, n_tokens, tokenizer, generative=True)
 
 generative_model.compile(optimizer='rmsprop', loss='categorical_crossentropy')
 
-latest = tf.train.latest_checkpoint("output_all_data_test_2/")
+latest = latest_checkpoint(output_dir)
 
 print(latest)
 
-generative_model.load_weights(latest if latest else "output_all_data_test_2/2048-97-0.18.ckpt")
-
-for [x,y,z] in generate_text(generative_model):
-  print(x + "\n" + y + "\n" + z + "\n\n")
\ No newline at end of file
+if latest:
+    # build the weights of the model before restoring them
+    generative_model((np.zeros((1, 1), dtype='int32'), np.float32(generated_syllables)))
+    load_checkpoint(generative_model, latest)
+else:
+    generative_model.load_weights("output_all_data_test_2/2048-97-0.18.ckpt")
+
+# TFLite model with int8 weights for CPU inference, run with export.QuantizedDanteRNN in place of the
+# generative model (see benchmarks/bench_quantized_generation.py)
+export_quantized = False
+if export_quantized:
+    export_dante_rnn(generative_model, output_dir / 'dante_rnn-int8.tflite', quantization='dynamic')
+
+generated_terzine = generate_text(generative_model)
+for [x,y,z] in generated_terzine:
+  print(x + "\n" + y + "\n" + z + "\n\n")
+
+print("Hendecasyllables: {:.1%} of the generated lines".format(
+    np.mean([is_hendecasyllable(line) for terzina in generated_terzine for line in terzina])))
\ No newline at end of file
@@ -0,0 +1,69 @@
+import numpy as np
+import tensorflow as tf
+
+from common.syllables import HENDECASYLLABLE
+from common.tflite import TFLiteRunner, convert, lstm_sequence
+
+
+def dante_rnn_step(model):
+    """ tf.function of one call of a generative BasicDanteRNN.
+
+    step(chars (1, T) int32, syllables (1,) float32) returns the three
+    (1, T, n_tokens) predictions of model((chars, syllables)). The model
+    carries no LSTM state from a call to the next, each line starts from the
+    syllables and the states of the line before (see model.py).
+    """
+    @tf.function(input_signature=[tf.TensorSpec((1, None), tf.int32), tf.TensorSpec((1,), tf.float32)])
+    def step(chars, syllables):
+        syllable = tf.reshape(syllables, (1, 1))
+        x = tf.one_hot(chars, model.n_tokens)
+        lstm_h = lstm_c = None
+        outputs = []
+        for line in (model.tl1, model.tl2, model.tl3):
+            state = line.dense_in(syllable)
+            if lstm_h is None:
+                lstm_out, lstm_h, lstm_c = lstm_sequence(model.lstm.cell, x, state, state)
+            else:
+                lstm_out, lstm_h, lstm_c = lstm_sequence(model.lstm.cell, x, lstm_h + state, lstm_c + state)
+            # the prediction of a line is the input of the next one
+            x = line.dense_out(lstm_out)
+            outputs.append(x)
+        return outputs
+
+    return step
+
+
+def calibration_lines(inputs, lengths, n_lines=100, seed=0):
+    """ Representative dataset of the third lines of random terzine, as in the generation """
+    rng = np.random.default_rng(seed)
+
+    def dataset():
+        for row in rng.choice(len(lengths), n_lines, replace=False):
+            chars = np.asarray(inputs[row, 2, :lengths[row, 2]], dtype=np.int32)[None]
+            yield { 'chars': chars, 'syllables': np.float32([HENDECASYLLABLE]) }
+    return dataset
+
+
+def export_dante_rnn(model, path, quantization='dynamic', data=None):
+    """ Write a generative BasicDanteRNN as a TFLite model, with int8 weights by default (see common.tflite.convert).
+
+    data, the arrays of load_terzine, is needed by the 'int8' quantization to
+    calibrate the activations on lines of the poem.
+    """
+    step = dante_rnn_step(model)
+    representative_dataset = calibration_lines(data['inputs'], data['lengths']) if data is not None else None
+    return convert(step, path, quantization, representative_dataset)
+
+
+class QuantizedDanteRNN:
+    """ Runs a model written by export_dante_rnn, a drop in for the generative model of generate_terzine:
+
+        generate_terzine(QuantizedDanteRNN('dante_rnn-int8.tflite'), tokenizer, max_line_length, syllables)
+    """
+
+    def __init__(self, path, num_threads=None):
+        self.runner = TFLiteRunner(path, num_threads=num_threads)
+
+    def __call__(self, inputs, training=None):
+        chars, syllables = inputs
+        return self.runner(chars=np.reshape(chars, (1, -1)), syllables=np.reshape(syllables, (1,)))
@@ -34,10 +34,8 @@ class BasicDanteRNN(Model):
             if input_eval is None:
                 # using random start
                 first_char = chr(int(np.random.randint(ord('a'), ord('z') + 1)))
-                # print(tokenizer.texts_to_sequences(first_char))
-                # Converting start string to numbers (vectorizing)
-                input_eval = self.tokenizer.texts_to_sequences(first_char)[0]
-                input_eval = tf.expand_dims(input_eval, 0)
+                # Converting start string to numbers (vectorizing), one-hot encoded by the TrainingLine
+                input_eval = tf.constant(self.tokenizer.encode([first_char]))
 
             # print((input_eval, syl))
 
@@ -72,7 +70,8 @@ class BasicTrainingLine(Layer):
         self.lstm = lstm
         self.n_tokens = n_tokens
         self.dense_in = Dense(latent_dim, activation='relu')
-        self.dense_out = Dense(self.n_tokens, activation='softmax')
+        # the softmax in float32 even with a mixed precision policy
+        self.dense_out = Dense(self.n_tokens, activation='softmax', dtype='float32')
         self.lstm_h = None
         self.lstm_c = None
 
@@ -84,6 +83,9 @@ class BasicTrainingLine(Layer):
         #       <tf.Tensor 'input_152:0' shape=(None, 1) dtype=float32>]) NUMERO SILLABE
 
         chars, syllable = inputs
+        if chars.dtype.is_integer:
+            # token ids, one-hot encoded here inside the graph instead of in the input data
+            chars = tf.one_hot(chars, self.n_tokens)
         # print(chars)
         # print(syllable)
 
@@ -118,4 +120,65 @@ class BasicTrainingLine(Layer):
 
         # print("BasicTrainingLine End")
 
-        return outputs
\ No newline at end of file
+        return outputs
+
+def generate_terzine(model, tokenizer, max_line_length, syllables, num_terzine=33, temperature=1.5):
+    """ num_terzine terzine of a generative BasicDanteRNN, as lists of three lines.
+
+    Each call of the model predicts one character of each of the three
+    lines, the last line predicted is the input of the next terzina.
+    """
+    # a random lowercase letter of the corpus, some of a-z (w, x, ...) are not in it
+    letters = [char for char in tokenizer.chars if 'a' <= char <= 'z']
+    first_char = letters[np.random.randint(len(letters))]
+    # Converting our start string to numbers (vectorizing), one-hot encoded inside the model
+    input_eval = tokenizer.encode([first_char])
+
+    # Empty string to store our results
+    text_generated = []
+
+    # given the number of Terzine to write we call the model that return a Terzina
+    # we have to pass as argument of the next call (for the next terzina) the end
+    # of the last generated terzina
+
+    # the lstm is not stateful, there are no states to reset between the terzine
+    end = False
+    for _ in range(num_terzine):
+        # one array for each TrainingLine
+        line_output = [[], [], []]
+        for _ in range(max_line_length):
+            predictions = model((input_eval, np.float32(syllables)), training=False)
+
+            # predictions is an array that contains 3 array, each one is a new predicted char
+            for cont, pred in enumerate(predictions):
+                char = sample(pred[0, 0], temperature)
+                if char == 1 and not end:
+                    end = True
+                if char != 1 and end:
+                    char = 1
+
+                line_output[cont].append(char)
+
+            # use as input the last predicted line
+            input_eval = np.array([line_output[2]], dtype='int32')
+
+        terzina = []
+        for i in range(3):
+            cleaned_text = tokenizer.decode(line_output[i]).strip()[1:].replace('\n', ' ')
+            terzina.append(cleaned_text)
+
+        text_generated.append(terzina)
+
+    return text_generated
+
+
+def sample(preds, temperature=1.0):
+    # helper function to sample an index from a probability array
+    # From https://github.com/llSourcell/keras_explained/blob/master/gentext.py
+    preds = np.asarray(preds).astype('float64')
+    # the softmax of a fully int8 model (export.py) rounds the unlikely tokens to exactly 0
+    preds = np.log(np.maximum(preds, 1e-12)) / temperature
+    exp_preds = np.exp(preds)
+    preds = exp_preds / np.sum(exp_preds)
+    probas = np.random.multinomial(1, preds, 1)
+    return np.argmax(probas)
@@ -0,0 +1,70 @@
+import numpy as np
+
+from common.structure import CANTICHE
+from tokenizer import CharTokenizer
+
+# arrays of each cantica in the dataset file
+FIELDS = ('inputs', 'outputs', 'lengths', 'syllables', 'canto')
+
+
+def build_terzine(terzine, syllables=None, tokenizer=None):
+    """ Arrays of the dataset of the terzine of PoemIndex.terzine, and the tokenizer of the ids.
+
+    inputs and outputs are the sequences of danternn.py, right padded with
+    '\\n' to the longest one: the input is the first character + the line +
+    '\\n', the output is the line + '\\n' + the first character of the next
+    line ('\\n' for the last line). lengths are the unpadded lengths, the same
+    for the input and the output of a line. The tokenizer is fitted on the
+    padded inputs, like danternn.py did, if not given.
+    """
+    lines = np.array([verses for _, _, verses in terzine], dtype=str)  # (N, 3)
+    width = max(len(line) for line in lines.flatten()) + 2
+
+    texts_in = np.char.add(np.char.add(lines.astype('<U1'), lines), '\n')
+    next_first = np.concatenate([lines[:, 1:].astype('<U1'), np.full((len(lines), 1), '\n')], axis=1)
+    texts_out = np.char.add(np.char.add(lines, '\n'), next_first)
+    texts_in = np.char.ljust(texts_in, width, '\n')
+    texts_out = np.char.ljust(texts_out, width, '\n')
+
+    if tokenizer is None:
+        tokenizer = CharTokenizer.fit(texts_in.flatten())
+    arrays = {
+        'inputs': tokenizer.encode(texts_in.flatten()).reshape(len(lines), 3, width).astype(np.uint8),
+        'outputs': tokenizer.encode(texts_out.flatten()).reshape(len(lines), 3, width).astype(np.uint8),
+        'lengths': (np.char.str_len(lines) + 2).astype(np.int16),
+        'syllables': np.asarray(syllables if syllables is not None else np.full(lines.shape, 11), dtype=np.uint8),
+        'canto': np.array([canto for _, canto, _ in terzine], dtype=np.int16),
+        'cantica': np.array([CANTICHE.index(cantica) for cantica, _, _ in terzine], dtype=np.int8),
+    }
+    return arrays, tokenizer
+
+
+def save_terzine(path, arrays, tokenizer):
+    """ Write the arrays of build_terzine in an npz file, each cantica in its own members.
+
+    The members are named '<cantica>/<field>', so load_terzine reads only the
+    cantiche it's asked for.
+    """
+    members = { 'tokenizer': np.array(tokenizer.to_json()) }
+    for c, cantica in enumerate(CANTICHE):
+        rows = arrays['cantica'] == c
+        for field in FIELDS:
+            members['%s/%s' % (cantica, field)] = arrays[field][rows]
+    np.savez_compressed(path, **members)
+
+
+def load_terzine(path, cantiche=None):
+    """ (arrays, tokenizer) of an npz file of save_terzine, of all or some cantiche.
+
+    arrays has the fields of build_terzine, syllables as float32; only the
+    members of the cantiche asked for are read from the file.
+    """
+    cantiche = CANTICHE if cantiche is None else [cantica.upper() for cantica in cantiche]
+    with np.load(path) as data:
+        tokenizer = CharTokenizer.from_json(str(data['tokenizer']))
+        parts = [{ field: data['%s/%s' % (cantica, field)] for field in FIELDS } for cantica in cantiche]
+    arrays = { field: np.concatenate([part[field] for part in parts]) for field in FIELDS }
+    arrays['cantica'] = np.concatenate([np.full(len(part['canto']), CANTICHE.index(cantica), dtype=np.int8)
+                                        for cantica, part in zip(cantiche, parts)])
+    arrays['syllables'] = arrays['syllables'].astype('float32')
+    return arrays, tokenizer
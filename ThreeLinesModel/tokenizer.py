@@ -0,0 +1,90 @@
+import json
+from collections import Counter
+
+import numpy as np
+
+
+class CharTokenizer:
+    """ Char level tokenizer backed by lookup tables, a drop-in for the Keras
+    Tokenizer(filters='', char_level=True) used by danternn.py.
+
+    The ids are the same of the Keras tokenizer: 1 for the most frequent
+    character and so on, 0 is left for the padding, and upper case
+    characters get the id of their lower case. Whole arrays of strings are
+    encoded at once through their UTF-32 code points, and whole arrays of ids
+    are decoded the same way.
+    """
+
+    def __init__(self, chars, word_counts=None):
+        # chars[i] has id i+1
+        self.chars = list(chars)
+        self.word_index = { char: idx + 1 for idx, char in enumerate(self.chars) }
+        self.word_counts = word_counts if word_counts is not None else { char: 0 for char in self.chars }
+        self.n_tokens = len(self.chars) + 1
+
+        max_code_point = max(max(ord(char), ord(char.upper()[0])) for char in self.chars)
+        self.encode_table = np.full(max_code_point + 1, -1, dtype=np.int32)
+        self.encode_table[0] = 0  # the padding of numpy fixed size strings
+        for char, idx in self.word_index.items():
+            upper = char.upper()
+            if len(upper) == 1 and upper.lower() == char:
+                self.encode_table[ord(upper)] = idx
+            self.encode_table[ord(char)] = idx
+        self.decode_table = np.array([0] + [ord(char) for char in self.chars], dtype=np.uint32)
+
+    @classmethod
+    def fit(cls, texts):
+        """ Vocabulary of texts, sorted like the Keras Tokenizer: by count, then by first appearance """
+        counts = Counter()
+        for text in texts:
+            counts.update(str(text).lower())
+        word_counts = dict(counts)
+        chars = sorted(word_counts, key=lambda char: word_counts[char], reverse=True)
+        return cls(chars, word_counts)
+
+    @classmethod
+    def from_keras(cls, tokenizer):
+        chars = sorted(tokenizer.word_index, key=tokenizer.word_index.get)
+        return cls(chars, dict(tokenizer.word_counts))
+
+    def encode(self, texts):
+        """ Ids of a string (1-D) or of an array of strings (2-D, right padded with 0) """
+        single = isinstance(texts, str)
+        texts = np.asarray([texts] if single else texts, dtype=str)
+        width = max(texts.dtype.itemsize // 4, 1)
+        code_points = np.ascontiguousarray(texts.astype('<U%d' % width)).view(np.uint32).reshape(len(texts), width)
+
+        ids = self.encode_table[np.minimum(code_points, len(self.encode_table) - 1)]
+        unknown = (ids < 0) | (code_points >= len(self.encode_table))
+        if unknown.any():
+            row, column = np.argwhere(unknown)[0]
+            raise KeyError(chr(code_points[row, column]))
+        return ids[0] if single else ids
+
+    def decode(self, ids):
+        """ String of 1-D ids, or array of strings of 2-D ids; the padding 0 is dropped """
+        ids = np.asarray(ids)
+        single = ids.ndim == 1
+        ids = np.atleast_2d(ids)
+        # move the 0s at the end of each row, numpy strings drop the trailing ones
+        ids = np.take_along_axis(ids, np.argsort(ids == 0, axis=1, kind='stable'), axis=1)
+        code_points = np.ascontiguousarray(self.decode_table[ids])
+        texts = code_points.view('<U%d' % max(ids.shape[1], 1))[:, 0]
+        return str(texts[0]) if single else texts
+
+    def to_json(self):
+        return json.dumps({ 'chars': self.chars, 'word_counts': self.word_counts }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, data):
+        data = json.loads(data)
+        return cls(data['chars'], data['word_counts'])
+
+    def save(self, path):
+        with open(path, 'w', encoding="utf8") as file:
+            file.write(self.to_json())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding="utf8") as file:
+            return cls.from_json(file.read())
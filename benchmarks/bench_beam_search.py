@@ -0,0 +1,80 @@
+"""Hendecasyllables and chars/sec of BeamSearchDecoder against plain sampling.
+
+A small DeepComedy model is trained on the poem for a few steps on CPU (the
+sizes are arguments), then both decoders continue the opening of the Inferno:
+GraphDecoder sampling one character at a time, and BeamSearchDecoder with
+every verse constrained to 11 syllables, and to the terza rima with the
+rhymes of common/rhymes.py. The share of the generated verses
+that can be read as hendecasyllables is counted by common/syllables.py.
+
+    python benchmarks/bench_beam_search.py [train_steps beam_width num_generate lstm_unit_1 lstm_unit_2]
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+
+import tensorflow as tf
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root / 'SequentialModel'))
+sys.path.insert(0, str(root))  # the common package
+from architecture import build_model
+from dataset import make_training_dataset
+from generation import BeamSearchDecoder, GraphDecoder
+from common.encoding import load_encoded_corpus
+from common.rhymes import RhymeIndex
+from common.structure import PoemIndex
+from common.syllables import is_hendecasyllable
+
+corpus_path = root / 'SequentialModel' / 'DivinaCommedia.txt'
+
+
+def verses_stats(text, start_string):
+    verses = [verse for verse in text[len(start_string):].split('\n')[:-1] if verse.strip()]
+    return len(verses), sum(is_hendecasyllable(verse) for verse in verses)
+
+
+def main(train_steps=1500, beam_width=8, num_generate=500, lstm_unit_1=128, lstm_unit_2=256):
+    encoded_text, unique_chars = load_encoded_corpus(corpus_path)
+    char2idx = { char: idx for idx, char in enumerate(unique_chars) }
+    start_string = "\n" + PoemIndex.load(corpus_path).terzina("inferno", 1, 1) + "\n\n"
+
+    model = build_model(len(unique_chars), 32, 64, lstm_unit_1, lstm_unit_2, 128)
+    model.compile(optimizer='adam', loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True))
+    start = time.perf_counter()
+    history = model.fit(make_training_dataset(encoded_text, 100, 32, seed=0), steps_per_epoch=train_steps, epochs=1, verbose=0)
+    print("Trained {} steps in {:.0f} sec, loss {:.3f}".format(train_steps, time.perf_counter() - start,
+                                                               history.history['loss'][-1]))
+
+    sampler = build_model(len(unique_chars), 1, 64, lstm_unit_1, lstm_unit_2, 128, stateful=True)
+    sampler.set_weights(model.get_weights())
+    graph_decoder = GraphDecoder(sampler, char2idx)
+    beam_generator = build_model(len(unique_chars), beam_width, 64, lstm_unit_1, lstm_unit_2, 128, stateful=True)
+    beam_generator.set_weights(model.get_weights())
+    beam_decoder = BeamSearchDecoder(beam_generator, char2idx)
+    rhyme_decoder = BeamSearchDecoder(beam_generator, char2idx, rhyme_index=RhymeIndex.load(corpus_path))
+
+    # warm up, tracing of the decoding loops
+    graph_decoder.generate([start_string], 2)
+    beam_decoder.generate(start_string, 2)
+
+    for name, generate in [
+        ("sampling, temperature 1.0", lambda: graph_decoder.generate([start_string], num_generate, 1.0)[0]),
+        ("sampling, temperature 0.5", lambda: graph_decoder.generate([start_string], num_generate, 0.5)[0]),
+        ("beam search, width {}".format(beam_width), lambda: beam_decoder.generate(start_string, num_generate, seed=0)),
+        ("beam search, terza rima", lambda: rhyme_decoder.generate(start_string, num_generate, seed=0)),
+    ]:
+        start = time.perf_counter()
+        text = generate()
+        elapsed = time.perf_counter() - start
+        n_verses, n_valid = verses_stats(text, start_string)
+        print("{:28s} {:3d}/{:3d} hendecasyllables ({:5.1%}), {:6.1f} chars/sec".format(
+            name, n_valid, n_verses, n_valid / max(n_verses, 1), (len(text) - len(start_string)) / elapsed))
+    print(text[len(start_string):])
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
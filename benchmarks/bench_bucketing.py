@@ -0,0 +1,72 @@
+"""Padded timesteps and epoch time of BasicDanteRNN, fixed length against length buckets.
+
+The terzine are the npz arrays of load_terzine. The fixed length path pads
+every line to the 99th percentile and drops the longer terzine, like
+danternn.py does without bucketed_batches; the bucketed path keeps all of them.
+The latent dimension is an argument, the default is far smaller than 2048.
+
+    python benchmarks/bench_bucketing.py [latent_dim epochs]
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+
+import numpy as np
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root / 'ThreeLinesModel'))
+sys.path.insert(0, str(root))  # the common package
+from bucketing import BucketedTerzine, unpadded_sequences
+from model import BasicDanteRNN
+from terzine import load_terzine
+
+terzine_path = root / 'ThreeLinesModel' / 'data' / 'DivinaCommedia.npz'
+
+
+def epoch_time(model, epochs, *fit_args, **fit_kwargs):
+    # the first epoch traces the model, only the following ones are timed
+    model.fit(*fit_args, epochs=1, verbose=0, **fit_kwargs)
+    start = time.perf_counter()
+    model.fit(*fit_args, epochs=epochs, verbose=0, **fit_kwargs)
+    return (time.perf_counter() - start) / epochs
+
+
+def main(latent_dim=128, epochs=1):
+    data, tokenizer = load_terzine(terzine_path)
+    n_tokens = tokenizer.n_tokens
+    lengths = data['lengths']
+    max_line_length = int(np.quantile(lengths, .99, axis=0).max())
+
+    # the fixed length path of danternn.py: the lines longer than the 99th percentile are dropped
+    fixed = (lengths <= max_line_length).all(axis=1)
+    X = data['inputs'][fixed, :, :max_line_length].transpose(1, 0, 2).astype('int32')
+    Y = data['outputs'][fixed, :, :max_line_length].transpose(1, 0, 2).astype('int32')
+    X_syllables = data['syllables'][fixed]
+
+    model = BasicDanteRNN(latent_dim, n_tokens, tokenizer)
+    model.compile(optimizer='rmsprop', loss='sparse_categorical_crossentropy')
+    fixed_time = epoch_time(model, epochs, [X[0], X_syllables[:,0:1], X[1], X_syllables[:,1:2], X[2], X_syllables[:,2:3]],
+                            [Y[0], Y[1], Y[2]], batch_size=64)
+    fixed_terzine = int(fixed.sum())
+
+    terzine = BucketedTerzine(unpadded_sequences(data['inputs'], lengths), unpadded_sequences(data['outputs'], lengths),
+                              data['syllables'], pad_id=tokenizer.word_index['\n'], batch_size=64, seed=0)
+    real, bucketed, fixed = terzine.padding_stats(max_line_length)
+
+    model = BasicDanteRNN(latent_dim, n_tokens, tokenizer)
+    model.compile(optimizer='rmsprop', loss='sparse_categorical_crossentropy')
+    bucketed_time = epoch_time(model, epochs, terzine)
+
+    print("fixed length: {} terzine, {} timesteps, {:.1%} padding, {:.2f} sec/epoch".format(
+        fixed_terzine, fixed, 1 - real / fixed, fixed_time))
+    print("buckets:      {} terzine, {} timesteps, {:.1%} padding, {:.2f} sec/epoch".format(
+        len(lengths), bucketed, 1 - real / bucketed, bucketed_time))
+    print("padded timesteps saved: {:.1%}, epoch time: {:.2f}x".format(
+        1 - (bucketed - real) / (fixed - real), fixed_time / bucketed_time))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,67 @@
+"""Time to generate a canto with the Python sampling loop and with GraphDecoder.
+
+Runs on CPU with a small untrained generator (the sizes are arguments); the
+Python loop is the one of deepcomedy.generate_text, one model call,
+tf.random.categorical and .numpy() per character.
+
+    python benchmarks/bench_decoding.py [lstm_unit_1 lstm_unit_2 num_generate]
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+
+import tensorflow as tf
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'SequentialModel'))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))  # the common package
+from architecture import build_model
+from generation import GraphDecoder
+
+start_inferno = """
+Nel mezzo del cammin di nostra vita
+mi ritrovai per una selva oscura,
+chè la diritta via era smarrita.
+
+"""
+
+
+def python_loop(start_string, model, char2idx, num_generate, temperature):
+    idx2char = { v: k for k, v in char2idx.items() }
+    input_eval = tf.expand_dims([char2idx[s] for s in start_string], 0)
+    text_generated = []
+    model.reset_states()
+    for i in range(num_generate):
+        predictions = tf.squeeze(model(input_eval), 0) / temperature
+        predicted_id = tf.random.categorical(predictions, num_samples=1)[-1,0].numpy()
+        input_eval = tf.expand_dims([predicted_id], 0)
+        text_generated.append(idx2char[predicted_id])
+    return start_string + ''.join(text_generated)
+
+
+def main(lstm_unit_1=256, lstm_unit_2=512, num_generate=7000):
+    char2idx = { char: idx for idx, char in enumerate(sorted(set(start_inferno) | set('abcdefghilmnopqrstuvz'))) }
+    generator = build_model(len(char2idx), 1, 64, lstm_unit_1, lstm_unit_2, 64, stateful=True)
+    decoder = GraphDecoder(generator, char2idx)
+
+    # warm up: first calls of the model and tracing of the decoding loop
+    python_loop(start_inferno, generator, char2idx, 2, 0.1)
+    decoder.generate([start_inferno], 2, 0.1)
+
+    start = time.perf_counter()
+    python_loop(start_inferno, generator, char2idx, num_generate, 0.1)
+    loop_time = time.perf_counter() - start
+    print("Python loop:  {:7.2f} sec for {} characters ({:.0f} chars/sec)".format(
+        loop_time, num_generate, num_generate / loop_time))
+
+    start = time.perf_counter()
+    decoder.generate([start_inferno], num_generate, 0.1)
+    graph_time = time.perf_counter() - start
+    print("GraphDecoder: {:7.2f} sec for {} characters ({:.0f} chars/sec, {:.1f}x)".format(
+        graph_time, num_generate, num_generate / graph_time, loop_time / graph_time))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,54 @@
+"""Characters/sec of the DeepComedy stateful generator against batch size.
+
+Runs on CPU with a small untrained generator (the sizes are arguments), each
+row of the batch is an independent sequence with its own temperature and seed.
+
+    python benchmarks/bench_generation.py [lstm_unit_1 lstm_unit_2 num_generate]
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+
+import tensorflow as tf
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'SequentialModel'))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))  # the common package
+from architecture import build_model
+from generation import generate_batch
+
+start_string = """
+Nel mezzo del cammin di nostra vita
+mi ritrovai per una selva oscura,
+chè la diritta via era smarrita.
+
+"""
+
+
+def main(lstm_unit_1=256, lstm_unit_2=512, num_generate=200):
+    char2idx = { char: idx for idx, char in enumerate(sorted(set(start_string) | set('abcdefghilmnopqrstuvz'))) }
+    weights = None
+    base = None
+
+    for batch_size in [1, 2, 4, 8, 16, 32]:
+        tf.keras.backend.clear_session()
+        generator = build_model(len(char2idx), batch_size, 64, lstm_unit_1, lstm_unit_2, 64, stateful=True)
+        if weights is None:
+            weights = generator.get_weights()
+        generator.set_weights(weights)
+
+        # warm up, the first calls of a new model are slower
+        generate_batch([start_string] * batch_size, generator, char2idx, 2)
+
+        start = time.perf_counter()
+        generate_batch([start_string] * batch_size, generator, char2idx, num_generate,
+                       temperatures=[0.1 * (b + 1) for b in range(batch_size)], seeds=range(batch_size))
+        chars_per_sec = batch_size * num_generate / (time.perf_counter() - start)
+        base = base or chars_per_sec
+        print("batch {:3d}: {:9.1f} chars/sec  ({:.1f}x batch 1)".format(batch_size, chars_per_sec, chars_per_sec / base))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,47 @@
+"""Time of the structural metrics of common/metrics.py on a batch of canti.
+
+The 100 canti of the poem stand for the generated ones: they are scored all
+together with CantoMetrics.evaluate, and one at a time, as a script reading a
+generated.txt per canto would do (without the start of a process).
+
+    python benchmarks/bench_metrics.py [repeats]
+"""
+import sys
+import time
+from pathlib import Path
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root))  # the common package
+from common.metrics import CantoMetrics
+from common.structure import CANTICHE, PoemIndex
+
+corpus_path = root / 'SequentialModel' / 'DivinaCommedia.txt'
+
+
+def best_time(function, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main(repeats=3):
+    poem = PoemIndex.load(corpus_path)
+    canti = [poem.canto(cantica, canto) for cantica in CANTICHE for canto in range(1, poem.n_canti(cantica) + 1)]
+
+    start = time.perf_counter()
+    metrics = CantoMetrics.load(corpus_path)
+    print("load indexes:   {:8.1f} ms".format(1000 * (time.perf_counter() - start)))
+
+    batch_time, summary = best_time(lambda: metrics.summary(canti), repeats)
+    print("{} canti batch: {:8.1f} ms".format(len(canti), 1000 * batch_time))
+    single_time, _ = best_time(lambda: [metrics.evaluate([canto]) for canto in canti], repeats)
+    print("one at a time:  {:8.1f} ms".format(1000 * single_time))
+    for name, value in summary.items():
+        print("  {:18s} {:.3f}".format(name, value))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,136 @@
+"""Throughput, peak RSS and perplexity of float32 against mixed bfloat16 training.
+
+Trains DeepComedy with its custom train step and BasicDanteRNN with
+train_on_batch for the same steps and seed under each policy, each run in
+its own process so its peak RSS is not shared with the others, then reports
+the perplexity of the trained model on held-out batches. The sizes are
+arguments, the defaults are far smaller than the real 2048/4096 units and
+2048 latent dimensions.
+
+    python benchmarks/bench_mixed_precision.py [lstm_unit_1 lstm_unit_2 latent_dim n_steps]
+"""
+import os
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root / 'SequentialModel'))
+sys.path.insert(0, str(root / 'ThreeLinesModel'))
+sys.path.insert(0, str(root))  # the common package
+
+corpus_path = root / 'SequentialModel' / 'DivinaCommedia.txt'
+terzine_path = root / 'ThreeLinesModel' / 'data' / 'DivinaCommedia.npz'
+
+len_text = 100
+batch_size = 32
+# LossScaleOptimizer with mixed_bfloat16, no loss scaling with float32
+POLICIES = ['float32', 'mixed_bfloat16']
+
+
+def run_deepcomedy(policy, lstm_unit_1, lstm_unit_2, n_steps):
+    import numpy as np
+    import tensorflow as tf
+    from architecture import build_model
+    from dataset import make_training_dataset
+    from rhyme_loss import RhymeTable
+    from training import make_train_step
+    from common.encoding import load_encoded_corpus
+    from common.rhymes import RhymeIndex
+
+    tf.keras.mixed_precision.set_global_policy(policy)
+    tf.random.set_seed(0)
+    encoded_text, unique_chars = load_encoded_corpus(corpus_path)
+    char2idx = { char: idx for idx, char in enumerate(unique_chars) }
+    # the last 10% of the poem is held out
+    split = int(len(encoded_text) * .9)
+
+    model = build_model(len(unique_chars), batch_size, 64, lstm_unit_1, lstm_unit_2, 64)
+    optimizer = tf.keras.optimizers.Adamax(learning_rate=0.001)
+    if policy != 'float32':
+        optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
+    train_step = make_train_step(model, optimizer, RhymeTable(RhymeIndex.load(corpus_path), char2idx))
+    batches = iter(make_training_dataset(encoded_text[:split], len_text, batch_size, seed=0))
+
+    # the first call traces the step, it's not counted
+    train_step(*next(batches))
+    start = time.perf_counter()
+    for _ in range(n_steps):
+        current_loss, scce, custom = train_step(*next(batches))
+    float(current_loss)  # wait for the last step
+    chars_per_sec = n_steps * batch_size * len_text / (time.perf_counter() - start)
+
+    losses = []
+    for x, y in make_training_dataset(encoded_text[split:], len_text, batch_size, seed=1).take(10):
+        logits = model(x, training=False)
+        losses.append(float(tf.reduce_mean(tf.keras.losses.sparse_categorical_crossentropy(y, logits, from_logits=True))))
+    return chars_per_sec, float(np.exp(np.mean(losses)))
+
+
+def run_danternn(policy, latent_dim, n_steps):
+    import numpy as np
+    import tensorflow as tf
+    from keras import mixed_precision
+    from keras.optimizers import RMSprop
+    from model import BasicDanteRNN
+    from terzine import load_terzine
+
+    mixed_precision.set_global_policy(policy)
+    tf.random.set_seed(0)
+    data, tokenizer = load_terzine(terzine_path)
+    max_line_length = int(np.quantile(data['lengths'], .99, axis=0).max())
+    rows = np.random.default_rng(0).permutation(len(data['lengths']))
+    # the last 512 terzine, shuffled, are held out
+    train_rows, test_rows = rows[:-512], rows[-512:]
+
+    def batch(rows):
+        X = data['inputs'][rows, :, :max_line_length].transpose(1, 0, 2).astype('int32')
+        Y = data['outputs'][rows, :, :max_line_length].transpose(1, 0, 2).astype('int32')
+        syllables = data['syllables'][rows].astype('float32')
+        return [X[0], syllables[:, 0:1], X[1], syllables[:, 1:2], X[2], syllables[:, 2:3]], [Y[0], Y[1], Y[2]]
+
+    optimizer = RMSprop() if policy == 'float32' else mixed_precision.LossScaleOptimizer(RMSprop())
+    model = BasicDanteRNN(latent_dim, tokenizer.n_tokens, tokenizer)
+    model.compile(optimizer=optimizer, loss='sparse_categorical_crossentropy')
+
+    batches = [batch(train_rows[start:start + 64]) for start in range(0, 64 * (n_steps + 1), 64)]
+    # the first batch traces the step, it's not counted
+    model.train_on_batch(*batches[0])
+    start = time.perf_counter()
+    for inputs, outputs in batches[1:]:
+        model.train_on_batch(inputs, outputs)
+    chars_per_sec = n_steps * 64 * 3 * max_line_length / (time.perf_counter() - start)
+
+    inputs, outputs = batch(test_rows)
+    predictions = model(inputs, training=False)
+    log_probs = [np.log(np.take_along_axis(np.asarray(p, dtype='float64'), y[..., None], -1) + 1e-12)
+                 for p, y in zip(predictions, outputs)]
+    return chars_per_sec, float(np.exp(-np.mean(log_probs)))
+
+
+def run(model, policy, sizes, n_steps):
+    if model == 'deepcomedy':
+        chars_per_sec, perplexity = run_deepcomedy(policy, sizes[0], sizes[1], n_steps)
+    else:
+        chars_per_sec, perplexity = run_danternn(policy, sizes[2], n_steps)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print("{:10s} {:15s} {:10.0f} chars/sec  peak RSS {:8.1f} MB  perplexity {:7.3f}".format(
+        model, policy, chars_per_sec, peak_rss, perplexity), flush=True)
+
+
+def main(lstm_unit_1=256, lstm_unit_2=512, latent_dim=256, n_steps=20):
+    for model in ['deepcomedy', 'danternn']:
+        for policy in POLICIES:
+            subprocess.run([sys.executable, __file__, '--run', model, policy,
+                            str(lstm_unit_1), str(lstm_unit_2), str(latent_dim), str(n_steps)], check=True)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--run']:
+        run(sys.argv[2], sys.argv[3], [int(arg) for arg in sys.argv[4:7]], int(sys.argv[7]))
+    else:
+        main(*[int(arg) for arg in sys.argv[1:]])
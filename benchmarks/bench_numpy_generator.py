@@ -0,0 +1,138 @@
+"""Cold start and per character latency of the NumPy generator against the Keras one, and their difference.
+
+The Keras generator of build_model (random weights, the sizes are
+arguments) is exported with numpy_generator.export_weights. A first
+process compares the logits of both generators over a prompt and the
+characters generated after it. Then each generator is started in a fresh
+process: the cold start is the time from the start of the process to the
+logits of the first character, with the imports, the model and the weights
+loaded; the NumPy process checks that TensorFlow was never imported. The
+defaults are far smaller than the real 2048/4096 units.
+
+    python benchmarks/bench_numpy_generator.py [lstm_unit_1 lstm_unit_2 num_generate]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+start_time = time.perf_counter()
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root / 'SequentialModel'))
+sys.path.insert(0, str(root))  # the common package
+
+corpus_path = root / 'SequentialModel' / 'DivinaCommedia.txt'
+
+prompt_length = 100
+embedding_size = 256
+hidden_size = 256
+
+
+def keras_generator(vocab_size, lstm_unit_1, lstm_unit_2, weights_path=None):
+    import numpy as np
+    import tensorflow as tf
+    from architecture import build_model
+
+    tf.random.set_seed(0)
+    generator = build_model(vocab_size, 1, embedding_size, lstm_unit_1, lstm_unit_2, hidden_size, stateful=True)
+    if weights_path is not None:
+        with np.load(weights_path) as data:
+            generator.set_weights([data['arr_%d' % i] for i in range(len(generator.get_weights()))])
+    else:
+        # moving statistics away from 0 and 1, so the folding of the batch normalizations is checked
+        rng = np.random.default_rng(0)
+        generator.set_weights([w + rng.normal(0, .1, w.shape).astype(w.dtype) if w.ndim == 1 else w
+                               for w in generator.get_weights()])
+    return generator
+
+
+def generate(step, reset_states, prompt, num_generate):
+    """ Logits of each call, sampling the characters after the prompt with a fixed seed """
+    import numpy as np
+    rng = np.random.default_rng(0)
+    reset_states()
+    logits = [step(prompt)]
+    for _ in range(num_generate):
+        probabilities = np.exp(logits[-1][0] - logits[-1][0].max())
+        predicted_id = rng.choice(len(probabilities), p=probabilities / probabilities.sum())
+        logits.append(step([predicted_id]))
+    return np.concatenate(logits)
+
+
+def load_prompt():
+    from common.encoding import load_encoded_corpus
+    encoded_text, unique_chars = load_encoded_corpus(corpus_path)
+    return encoded_text[:prompt_length], unique_chars
+
+
+def run_compare(lstm_unit_1, lstm_unit_2, num_generate, weights_path):
+    import numpy as np
+    from numpy_generator import NumpyGenerator, export_weights
+
+    prompt, unique_chars = load_prompt()
+    generator = keras_generator(len(unique_chars), lstm_unit_1, lstm_unit_2)
+    export_weights(generator, weights_path, unique_chars)
+    engine = NumpyGenerator.load(weights_path)
+
+    def keras_step(ids):
+        return generator(np.asarray(ids, dtype=np.int32).reshape(1, -1))[:, -1, :].numpy()
+
+    # the same sampled characters, from the logits of Keras
+    expected = generate(keras_step, generator.reset_states, prompt, num_generate)
+    engine.reset_states()
+    actual = [engine(prompt)]
+    rng = np.random.default_rng(0)
+    for logits in expected[:-1]:
+        probabilities = np.exp(logits - logits.max())
+        actual.append(engine([rng.choice(len(probabilities), p=probabilities / probabilities.sum())]))
+    actual = np.concatenate(actual)
+    print("max abs difference of the logits over {} calls: {:.2e} (logits up to {:.2f})".format(
+        len(expected), np.abs(actual - expected).max(), np.abs(expected).max()), flush=True)
+
+
+def run_cold(engine, lstm_unit_1, lstm_unit_2, num_generate, weights_path):
+    prompt, unique_chars = load_prompt()
+    if engine == 'numpy':
+        from numpy_generator import NumpyGenerator
+        generator = NumpyGenerator.load(weights_path)
+        step, reset_states = generator, generator.reset_states
+    else:
+        import numpy as np
+        generator = keras_generator(len(unique_chars), lstm_unit_1, lstm_unit_2, weights_path)
+
+        def step(ids):
+            return generator(np.asarray(ids, dtype=np.int32).reshape(1, -1))[:, -1, :].numpy()
+        reset_states = generator.reset_states
+
+    reset_states()
+    step(prompt[:1])
+    cold_start = time.perf_counter() - start_time
+    assert engine != 'numpy' or 'tensorflow' not in sys.modules, "the NumPy generator imported TensorFlow"
+
+    start = time.perf_counter()
+    generate(step, reset_states, prompt, num_generate)
+    per_char = (time.perf_counter() - start) / (prompt_length + num_generate)
+    print("{:6s} cold start {:7.3f} s   {:8.3f} ms/char   {:9.1f} chars/sec".format(
+        engine, cold_start, per_char * 1e3, 1 / per_char), flush=True)
+
+
+def main(lstm_unit_1=256, lstm_unit_2=512, num_generate=300):
+    with tempfile.TemporaryDirectory() as directory:
+        weights_path = str(Path(directory) / 'generator.npz')
+        args = [str(lstm_unit_1), str(lstm_unit_2), str(num_generate), weights_path]
+        subprocess.run([sys.executable, __file__, '--run', 'compare', *args], check=True)
+        for engine in ('keras', 'numpy'):
+            subprocess.run([sys.executable, __file__, '--run', engine, *args], check=True)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:3] == ['--run', 'compare']:
+        run_compare(int(sys.argv[3]), int(sys.argv[4]), int(sys.argv[5]), sys.argv[6])
+    elif sys.argv[1:2] == ['--run']:
+        run_cold(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), int(sys.argv[5]), sys.argv[6])
+    else:
+        main(*[int(arg) for arg in sys.argv[1:]])
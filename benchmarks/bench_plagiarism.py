@@ -0,0 +1,63 @@
+"""Time of the n-gram plagiarism test of a Canto against the whole poem.
+
+NgramIndex (common/plagiarism.py) is built from scratch in a temporary cache,
+loaded from that cache, and then scores every Canto of the Paradiso. The
+baseline builds a Python set of word n-gram tuples of the poem at each test,
+like a checker without a persisted index does.
+
+    python benchmarks/bench_plagiarism.py [n repeats]
+"""
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root))  # the common package
+from common.plagiarism import NgramIndex
+from common.structure import PoemIndex
+
+corpus_path = root / 'SequentialModel' / 'DivinaCommedia.txt'
+
+
+def best_time(function, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def set_plagiarism(generated, poem_text, n):
+    words = re.findall(r"[^\W\d_]+", poem_text.lower())
+    ngrams = { tuple(words[i:i + n]) for i in range(len(words) - n + 1) }
+    generated_words = re.findall(r"[^\W\d_]+", generated.lower())
+    generated_ngrams = [tuple(generated_words[i:i + n]) for i in range(len(generated_words) - n + 1)]
+    return sum(ngram in ngrams for ngram in generated_ngrams) / max(len(generated_ngrams), 1)
+
+
+def main(n=4, repeats=5):
+    poem = PoemIndex.load(corpus_path)
+    canti = [poem.canto('paradiso', canto) for canto in range(1, poem.n_canti('paradiso') + 1)]
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        start = time.perf_counter()
+        index = NgramIndex.load(corpus_path, n, cache_dir=cache_dir)
+        print("build:        {:8.1f} ms, {} distinct {}-grams".format(1000 * (time.perf_counter() - start),
+                                                                   len(index.hashes), n))
+        load_time, index = best_time(lambda: NgramIndex.load(corpus_path, n, cache_dir=cache_dir), repeats)
+        print("load:         {:8.1f} ms".format(1000 * load_time))
+
+    score_time, scores = best_time(lambda: [index.score(canto) for canto in canti], repeats)
+    print("score canto:  {:8.2f} ms".format(1000 * score_time / len(canti)))
+    baseline_time, baseline = best_time(lambda: set_plagiarism(canti[0], poem.text, n), 1)
+    print("Python set:   {:8.2f} ms ({:.0f}x slower)".format(1000 * baseline_time,
+                                                           baseline_time / (score_time / len(canti))))
+    print("Paradiso I: {:.1%} in the poem (Python set {:.1%}), {:.1%} inferno, {:.1%} purgatorio, {:.1%} paradiso".format(
+        scores[0]['poem'], baseline, scores[0]['inferno'], scores[0]['purgatorio'], scores[0]['paradiso']))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,173 @@
+"""Chars/sec and perplexity of the TFLite generators, float32 and quantized, against the Keras models.
+
+DeepComedy and BasicDanteRNN are trained for a few steps on the real data,
+so the perplexities are not those of random weights, then exported with
+each quantization of common.tflite. The perplexity of DeepComedy is
+measured feeding held-out text one character at a time, the LSTM states
+carried across calls like in the generation; the one of DanteRNN on the
+first line predicted for held-out lines. Each model runs in its own process,
+both have an export module. The sizes are arguments, the defaults are far
+smaller than the real 2048/4096 units and 2048 latent dimensions.
+
+    python benchmarks/bench_quantized_generation.py [lstm_unit_1 lstm_unit_2 latent_dim n_steps]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+
+root = Path(__file__).resolve().parent.parent
+corpus_path = root / 'SequentialModel' / 'DivinaCommedia.txt'
+terzine_path = root / 'ThreeLinesModel' / 'data' / 'DivinaCommedia.npz'
+
+QUANTIZATIONS = [None, 'dynamic', 'int8']
+# characters generated for the chars/sec, and held-out characters for the perplexity
+num_generate = 300
+num_eval = 300
+
+
+def report(name, size, chars_per_sec, perplexity, reference):
+    print("{:22s} {:9.1f} KB {:9.1f} chars/sec  perplexity {:8.4f} ({:+.4f})".format(
+        name, size / 2 ** 10, chars_per_sec, perplexity, perplexity - reference), flush=True)
+
+
+def run_deepcomedy(lstm_unit_1, lstm_unit_2, n_steps, directory):
+    import numpy as np
+    import tensorflow as tf
+    sys.path.insert(0, str(root / 'SequentialModel'))
+    sys.path.insert(0, str(root))  # the common package
+    from architecture import build_model
+    from dataset import make_training_dataset
+    from export import QuantizedGenerator, export_generator
+    from rhyme_loss import RhymeTable
+    from training import make_train_step
+    from common.encoding import load_encoded_corpus
+    from common.rhymes import RhymeIndex
+
+    tf.random.set_seed(0)
+    encoded_text, unique_chars = load_encoded_corpus(corpus_path)
+    char2idx = { char: idx for idx, char in enumerate(unique_chars) }
+    # the last 10% of the poem is held out
+    split = int(len(encoded_text) * .9)
+    held_out = np.asarray(encoded_text[split:split + num_eval + 1], dtype=np.int32)
+
+    model = build_model(len(unique_chars), 32, 64, lstm_unit_1, lstm_unit_2, 64)
+    train_step = make_train_step(model, tf.keras.optimizers.Adamax(learning_rate=0.001),
+                                 RhymeTable(RhymeIndex.load(corpus_path), char2idx))
+    batches = iter(make_training_dataset(encoded_text[:split], 100, 32, seed=0))
+    for _ in range(n_steps):
+        train_step(*next(batches))
+
+    generator = build_model(len(unique_chars), 1, 64, lstm_unit_1, lstm_unit_2, 64, stateful=True)
+    generator.set_weights(model.get_weights())
+
+    def keras_step(ids):
+        return generator(np.asarray(ids, dtype=np.int32).reshape(1, -1))[:, -1, :].numpy()
+
+    def evaluate(step, reset_states):
+        # perplexity of the held-out characters, fed one at a time
+        reset_states()
+        log_probs = []
+        for i in range(num_eval):
+            logits = step(held_out[i:i + 1])[0].astype('float64')
+            log_probs.append(logits[held_out[i + 1]] - np.log(np.sum(np.exp(logits - logits.max()))) - logits.max())
+        perplexity = float(np.exp(-np.mean(log_probs)))
+
+        rng = np.random.default_rng(0)
+        reset_states()
+        logits = step(held_out[:100])
+        start = time.perf_counter()
+        for _ in range(num_generate):
+            probabilities = np.exp(logits[0] - logits[0].max())
+            predicted_id = rng.choice(len(probabilities), p=probabilities / probabilities.sum())
+            logits = step([predicted_id])
+        return num_generate / (time.perf_counter() - start), perplexity
+
+    chars_per_sec, reference = evaluate(keras_step, generator.reset_states)
+    report('deepcomedy keras', sum(w.nbytes for w in generator.get_weights()), chars_per_sec, reference, reference)
+    for quantization in QUANTIZATIONS:
+        path = export_generator(model, Path(directory) / 'generator-{}.tflite'.format(quantization), quantization,
+                                encoded_text[:split])
+        runner = QuantizedGenerator(path)
+        chars_per_sec, perplexity = evaluate(runner, runner.reset_states)
+        report('deepcomedy {}'.format(quantization or 'float32'), path.stat().st_size, chars_per_sec, perplexity,
+               reference)
+
+
+def run_danternn(latent_dim, n_steps, directory):
+    import numpy as np
+    import tensorflow as tf
+    sys.path.insert(0, str(root / 'ThreeLinesModel'))
+    sys.path.insert(0, str(root))  # the common package
+    from export import QuantizedDanteRNN, export_dante_rnn
+    from model import BasicDanteRNN, generate_terzine
+    from terzine import load_terzine
+    from common.syllables import HENDECASYLLABLE
+
+    tf.random.set_seed(0)
+    data, tokenizer = load_terzine(terzine_path)
+    max_line_length = int(np.quantile(data['lengths'], .99, axis=0).max())
+    rows = np.random.default_rng(0).permutation(len(data['lengths']))
+    # the last 100 terzine, shuffled, are held out
+    train_rows, test_rows = rows[:-100], rows[-100:]
+
+    model = BasicDanteRNN(latent_dim, tokenizer.n_tokens, tokenizer)
+    model.compile(optimizer='rmsprop', loss='sparse_categorical_crossentropy')
+    for start in range(0, 64 * n_steps, 64):
+        batch = train_rows[start:start + 64]
+        X = data['inputs'][batch, :, :max_line_length].transpose(1, 0, 2).astype('int32')
+        Y = data['outputs'][batch, :, :max_line_length].transpose(1, 0, 2).astype('int32')
+        syllables = data['syllables'][batch].astype('float32')
+        model.train_on_batch([X[0], syllables[:, 0:1], X[1], syllables[:, 1:2], X[2], syllables[:, 2:3]],
+                             [Y[0], Y[1], Y[2]])
+
+    generative_model = BasicDanteRNN(latent_dim, tokenizer.n_tokens, tokenizer, generative=True)
+    generative_model((np.zeros((1, 1), dtype='int32'), np.float32(HENDECASYLLABLE)))
+    generative_model.set_weights(model.get_weights())
+
+    def evaluate(model):
+        # perplexity of the first line of each held-out terzina, predicted from its input
+        log_probs = []
+        for row in test_rows:
+            length = data['lengths'][row, 0]
+            chars = data['inputs'][row, 0, :length][None].astype('int32')
+            predictions = np.asarray(model((chars, np.float32(data['syllables'][row, 0])), training=False)[0][0])
+            log_probs.append(np.log(predictions[np.arange(length), data['outputs'][row, 0, :length]] + 1e-12))
+        perplexity = float(np.exp(-np.mean(np.concatenate(log_probs))))
+
+        np.random.seed(0)
+        start = time.perf_counter()
+        generate_terzine(model, tokenizer, max_line_length, HENDECASYLLABLE, 1)
+        # three lines of max_line_length characters
+        return 3 * max_line_length / (time.perf_counter() - start), perplexity
+
+    chars_per_sec, reference = evaluate(generative_model)
+    report('danternn keras', sum(w.nbytes for w in generative_model.get_weights()), chars_per_sec, reference,
+           reference)
+    for quantization in QUANTIZATIONS:
+        path = export_dante_rnn(generative_model, Path(directory) / 'dante_rnn-{}.tflite'.format(quantization),
+                                quantization, data)
+        chars_per_sec, perplexity = evaluate(QuantizedDanteRNN(path))
+        report('danternn {}'.format(quantization or 'float32'), path.stat().st_size, chars_per_sec, perplexity,
+               reference)
+
+
+def main(lstm_unit_1=256, lstm_unit_2=512, latent_dim=256, n_steps=50):
+    with tempfile.TemporaryDirectory() as directory:
+        subprocess.run([sys.executable, __file__, '--run', 'deepcomedy', str(lstm_unit_1), str(lstm_unit_2),
+                        str(n_steps), directory], check=True)
+        subprocess.run([sys.executable, __file__, '--run', 'danternn', str(latent_dim), str(n_steps), directory],
+                       check=True)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:3] == ['--run', 'deepcomedy']:
+        run_deepcomedy(int(sys.argv[3]), int(sys.argv[4]), int(sys.argv[5]), sys.argv[6])
+    elif sys.argv[1:3] == ['--run', 'danternn']:
+        run_danternn(int(sys.argv[3]), int(sys.argv[4]), sys.argv[5])
+    else:
+        main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,54 @@
+"""Time from the data file to the X/Y token id arrays of danternn.py, CSV against npz.
+
+The CSV path reads data/DivinaCommedia.csv with pandas, pads the _in/_out
+strings and tokenizes them like danternn.py did; the npz path loads the
+already tokenized data/DivinaCommedia.npz of PreprocessingData.py, all of it
+and a single cantica.
+
+    python benchmarks/bench_terzine_dataset.py [repeats]
+"""
+import sys
+import time
+
+import numpy as np
+
+from three_lines_data import load_terzine as load_csv_terzine, three_lines_dir
+from terzine import load_terzine
+
+
+def best_time(function, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def from_csv():
+    _, _, tokenizer, inputs, outputs = load_csv_terzine()
+    X = tokenizer.encode(inputs.T.flatten()).reshape(3, len(inputs), -1)
+    Y = tokenizer.encode(outputs.T.flatten()).reshape(3, len(outputs), -1)
+    return X, Y
+
+
+def from_npz(cantiche=None):
+    data, _ = load_terzine(three_lines_dir / 'data' / 'DivinaCommedia.npz', cantiche)
+    max_line_length = int(np.quantile(data['lengths'], .99, axis=0).max())
+    rows = (data['lengths'] <= max_line_length).all(axis=1)
+    X = data['inputs'][rows, :, :max_line_length].transpose(1, 0, 2).astype('int32')
+    Y = data['outputs'][rows, :, :max_line_length].transpose(1, 0, 2).astype('int32')
+    return X, Y
+
+
+def main(repeats=5):
+    csv_time = best_time(from_csv, repeats)
+    npz_time = best_time(from_npz, repeats)
+    inferno_time = best_time(lambda: from_npz(['inferno']), repeats)
+    print("CSV + string processing: {:.3f} s".format(csv_time))
+    print("npz, all cantiche:       {:.3f} s ({:.0f}x)".format(npz_time, csv_time / npz_time))
+    print("npz, Inferno only:       {:.3f} s".format(inferno_time))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
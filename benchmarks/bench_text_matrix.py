@@ -0,0 +1,61 @@
+"""Memory and build time of the DeepComedy training matrix.
+
+Compares the legacy float64 get_text_matrix against the strided uint8 views
+returned by get_text_windows on the full Divina Commedia.
+
+    python benchmarks/bench_text_matrix.py [len_text]
+"""
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'SequentialModel'))
+from dataset import get_text_matrix, get_text_windows, split_input_target
+
+corpus_path = Path(__file__).resolve().parent.parent / 'SequentialModel' / 'DivinaCommedia.txt'
+
+
+def measure(build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main(len_text=150):
+    with open(corpus_path, 'r', encoding="utf8") as file:
+        text = file.read()
+    unique_chars = sorted(set(text))
+    char2idx = { char: idx for idx, char in enumerate(unique_chars) }
+    encoded_text = np.array([char2idx[char] for char in text])
+
+    print("corpus: {} characters, vocabulary: {}, len_text: {}".format(
+        len(encoded_text), len(unique_chars), len_text))
+
+    windows, windows_time, windows_peak = measure(lambda: get_text_windows(encoded_text, len_text))
+    train, target = split_input_target(windows)
+    assert np.shares_memory(train, target)
+    print("get_text_windows: {:8.4f} sec  peak {:8.2f} MB  shape {} {}".format(
+        windows_time, windows_peak / 2**20, train.shape, train.dtype))
+
+    matrix, matrix_time, matrix_peak = measure(lambda: get_text_matrix(encoded_text, len_text))
+    print("get_text_matrix:  {:8.4f} sec  peak {:8.2f} MB  shape {} {}".format(
+        matrix_time, matrix_peak / 2**20, matrix.shape, matrix.dtype))
+
+    # same train/target pairs as text_matrix[i] / text_matrix[i+1]
+    sample = np.random.randint(0, matrix.shape[0]-1, 1000)
+    assert np.array_equal(matrix[sample], train[sample])
+    assert np.array_equal(matrix[sample+1], target[sample])
+
+    print("speedup: {:.0f}x  memory: {:.0f}x less".format(
+        matrix_time / windows_time, matrix_peak / max(windows_peak, 1)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
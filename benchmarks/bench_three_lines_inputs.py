@@ -0,0 +1,57 @@
+"""Peak RSS and epoch time of BasicDanteRNN with one-hot against token id inputs.
+
+Each mode runs in its own process on the full data/DivinaCommedia.csv, so
+its peak RSS is not shared with the other one. The latent dimension is an
+argument, the default is far smaller than the real 2048.
+
+    python benchmarks/bench_three_lines_inputs.py [latent_dim epochs]
+"""
+import os
+import resource
+import subprocess
+import sys
+import time
+
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+
+
+def run(mode, latent_dim, epochs):
+    import numpy as np
+    from three_lines_data import load_terzine
+    from model import BasicDanteRNN
+
+    df, max_line_length, tokenizer, inputs, outputs = load_terzine()
+    n_tokens = tokenizer.n_tokens
+
+    X = tokenizer.encode(inputs.T.flatten()).reshape(3, len(inputs), -1)
+    Y = tokenizer.encode(outputs.T.flatten()).reshape(3, len(outputs), -1)
+    if mode == 'one-hot':
+        X = np.eye(n_tokens, dtype='float32')[X]
+        Y = np.eye(n_tokens, dtype='float32')[Y]
+    X_syllables = df[['0_syllables', '1_syllables', '2_syllables']].values.astype('float32')
+
+    model = BasicDanteRNN(latent_dim, n_tokens, tokenizer)
+    model.compile(optimizer='rmsprop', loss='categorical_crossentropy' if mode == 'one-hot' else 'sparse_categorical_crossentropy')
+
+    fit_inputs = [X[0], X_syllables[:,0:1], X[1], X_syllables[:,1:2], X[2], X_syllables[:,2:3]]
+    # the first epoch traces the model, only the following ones are timed
+    model.fit(fit_inputs, [Y[0], Y[1], Y[2]], batch_size=64, epochs=1, verbose=0)
+    start = time.perf_counter()
+    model.fit(fit_inputs, [Y[0], Y[1], Y[2]], batch_size=64, epochs=epochs, verbose=0)
+    epoch_time = (time.perf_counter() - start) / epochs
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print("{:8s} X+Y {:8.1f} MB  peak RSS {:8.1f} MB  {:6.2f} sec/epoch".format(
+        mode, (X.nbytes + Y.nbytes) / 2**20, peak_rss, epoch_time))
+
+
+def main(latent_dim=128, epochs=1):
+    for mode in ['one-hot', 'ids']:
+        subprocess.run([sys.executable, __file__, '--run', mode, str(latent_dim), str(epochs)], check=True)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--run']:
+        run(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+    else:
+        main(*[int(arg) for arg in sys.argv[1:]])
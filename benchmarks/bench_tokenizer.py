@@ -0,0 +1,56 @@
+"""Encode and decode throughput of CharTokenizer against the Keras Tokenizer.
+
+Both tokenizers are fitted on the padded input lines of danternn.py, the ids
+of the two must be the same; then every input and output line is encoded
+and decoded back by each of them.
+
+    python benchmarks/bench_tokenizer.py [repeats]
+"""
+import os
+import sys
+import time
+
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+
+import numpy as np
+from keras.preprocessing.text import Tokenizer
+
+from three_lines_data import load_terzine
+
+
+def best_time(function, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main(repeats=3):
+    _, _, tokenizer, inputs, outputs = load_terzine()
+    texts = np.concatenate([inputs.flatten(), outputs.flatten()])
+    n_chars = sum(len(text) for text in texts)
+
+    keras_tokenizer = Tokenizer(filters='', char_level=True)
+    keras_tokenizer.fit_on_texts(inputs.flatten())
+    assert keras_tokenizer.word_index == tokenizer.word_index
+
+    keras_encode, keras_ids = best_time(lambda: keras_tokenizer.texts_to_sequences(texts), repeats)
+    encode, ids = best_time(lambda: tokenizer.encode(texts), repeats)
+    assert np.array_equal(np.array(keras_ids), ids)
+
+    keras_decode, keras_texts = best_time(lambda: keras_tokenizer.sequences_to_texts(keras_ids), repeats)
+    decode, decoded = best_time(lambda: tokenizer.decode(ids), repeats)
+    # Keras joins the characters with spaces
+    assert [text[::2] for text in keras_texts] == list(decoded)
+
+    print("{} lines, {} characters".format(len(texts), n_chars))
+    print("encode: Keras {:.3f} s, CharTokenizer {:.4f} s ({:.0f}x), {:.1f} M chars/s".format(
+        keras_encode, encode, keras_encode / encode, n_chars / encode / 1e6))
+    print("decode: Keras {:.3f} s, CharTokenizer {:.4f} s ({:.0f}x), {:.1f} M chars/s".format(
+        keras_decode, decode, keras_decode / decode, n_chars / decode / 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
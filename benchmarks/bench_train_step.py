@@ -0,0 +1,60 @@
+"""Steps/sec of the DeepComedy training step, eager against compiled.
+
+Runs on CPU with a small model (the sizes are arguments, the defaults are far
+smaller than the real 2048/4096 units) on random windows of the real corpus.
+
+    python benchmarks/bench_train_step.py [lstm_unit_1 lstm_unit_2 batch_size n_steps]
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+
+import tensorflow as tf
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root / 'SequentialModel'))
+sys.path.insert(0, str(root))  # the common package
+from architecture import build_model
+from dataset import make_training_dataset
+from rhyme_loss import RhymeTable
+from training import make_train_step
+from common.encoding import load_encoded_corpus
+from common.rhymes import RhymeIndex
+
+corpus_path = root / 'SequentialModel' / 'DivinaCommedia.txt'
+
+len_text = 150
+
+
+def steps_per_sec(train_step, batches, n_steps):
+    # the first call traces/compiles the step, it's not counted
+    train_step(*next(batches))
+    start = time.perf_counter()
+    for _ in range(n_steps):
+        current_loss, scce, custom = train_step(*next(batches))
+    float(current_loss)  # wait for the last step
+    return n_steps / (time.perf_counter() - start)
+
+
+def main(lstm_unit_1=256, lstm_unit_2=512, batch_size=32, n_steps=10):
+    encoded_text, unique_chars = load_encoded_corpus(corpus_path)
+    rhyme_index = RhymeIndex.load(corpus_path)
+
+    results = {}
+    for mode, compiled, jit_compile in [('eager', False, False), ('tf.function', True, False), ('tf.function+XLA', True, True)]:
+        tf.keras.backend.clear_session()
+        tf.random.set_seed(0)
+        model = build_model(len(unique_chars), batch_size, 64, lstm_unit_1, lstm_unit_2, 64)
+        optimizer = tf.keras.optimizers.Adamax(learning_rate=0.001)
+        batches = iter(make_training_dataset(encoded_text, len_text, batch_size, seed=0))
+        rhyme_table = RhymeTable(rhyme_index, { char: idx for idx, char in enumerate(unique_chars) })
+        train_step = make_train_step(model, optimizer, rhyme_table, compiled=compiled, jit_compile=jit_compile)
+        results[mode] = steps_per_sec(train_step, batches, n_steps)
+        print("{:16s} {:8.3f} steps/sec  ({:.2f}x eager)".format(mode, results[mode], results[mode] / results['eager']))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
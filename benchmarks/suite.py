@@ -0,0 +1,385 @@
+"""Benchmark suite of the preprocessing, the training steps and the generation, on CPU.
+
+Every case runs with fixed seeds on small models (the sizes of CONFIG, far
+smaller than the real ones, like the debug_model switch of deepcomedy.py)
+and keeps the median of a few repeats, each one calling the case for at
+least MIN_REPEAT_SEC so the fastest cases are not timed on a single call.
+The results are printed and, with --save, written as JSON with the
+versions and the configuration; --compare runs the suite again and flags
+the cases slower than the baseline by more than the tolerance, and the cases
+that failed or have no value in the baseline, exiting with status 1 if there
+is any. A baseline is only compared with a run of the same --threads.
+
+The same case can be 20-30% slower in one process than in another on a
+shared CPU, so a baseline is saved with --runs: the suite runs in that many
+fresh processes, each case keeps the median of the runs and the slowest
+one, and a case is a regression only when it's slower than the slowest run
+of the baseline by more than the tolerance.
+
+The SequentialModel cases use tf.keras as Keras 2, TF_USE_LEGACY_KERAS is
+set to 1 before TensorFlow is imported unless it is already in the
+environment (with another value those cases fail, and fail the compare).
+
+    python benchmarks/suite.py [--only case,case] [--repeats 5] [--threads 1]
+    python benchmarks/suite.py --save benchmarks/baseline.json --runs 5
+    python benchmarks/suite.py --compare benchmarks/baseline.json [--tolerance 0.2]
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+os.environ.setdefault('TF_USE_LEGACY_KERAS', '1')
+
+import numpy as np
+import tensorflow as tf
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root / 'SequentialModel'))
+sys.path.insert(0, str(root / 'ThreeLinesModel'))
+sys.path.insert(0, str(root))  # the common package
+
+corpus_path = root / 'SequentialModel' / 'DivinaCommedia.txt'
+terzine_path = root / 'ThreeLinesModel' / 'data' / 'DivinaCommedia.npz'
+
+CONFIG = {
+    'len_text': 100,
+    'batch_size': 16,
+    'embedding_size': 32,
+    'lstm_unit_1': 64,
+    'lstm_unit_2': 128,
+    'hidden_size': 64,
+    'latent_dim': 64,
+    'num_generate': 300,
+    'num_terzine': 1,
+    'seed': 0,
+}
+
+CASES = {}
+
+# least seconds of a repeat, the case is called as many times as needed and the time of one call is kept
+MIN_REPEAT_SEC = 0.2
+
+
+def case(unit, higher_is_better):
+    """ Register a benchmark, a function of the repeats returning its value in unit """
+    def register(function):
+        CASES[function.__name__] = (function, unit, higher_is_better)
+        return function
+    return register
+
+
+def median_time(function, repeats):
+    """ Median seconds of one call of function() over the repeats, after a first untimed call.
+
+    A repeat calls function() number times, with number doubled from 1
+    until the repeat lasts at least MIN_REPEAT_SEC (like timeit.autorange).
+    The median, and not the best, so a lucky repeat doesn't set the baseline.
+    """
+    function()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        seconds = time.perf_counter() - start
+        if seconds >= MIN_REPEAT_SEC:
+            break
+        number *= 2
+    times = [seconds / number]
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+    return float(np.median(times))
+
+
+def corpus():
+    from common.encoding import load_encoded_corpus
+    encoded_text, unique_chars = load_encoded_corpus(corpus_path)
+    return encoded_text, { char: idx for idx, char in enumerate(unique_chars) }
+
+
+# Preprocessing
+
+@case('sec', higher_is_better=False)
+def normalize(repeats):
+    from common.normalize import flatten_text, normalize_text
+    with open(corpus_path, 'r', encoding='utf8') as file:
+        text = file.read()
+    return median_time(lambda: flatten_text(normalize_text(text)), repeats)
+
+
+@case('sec', higher_is_better=False)
+def numerical_encoding(repeats):
+    from common.encoding import numerical_encoding
+    from common.normalize import load_corpus
+    text = load_corpus(corpus_path, flat=True)
+    _, char2idx = corpus()
+    return median_time(lambda: numerical_encoding(text, char2idx), repeats)
+
+
+@case('sec', higher_is_better=False)
+def text_windows(repeats):
+    from dataset import get_text_windows, split_input_target
+    encoded_text, _ = corpus()
+    return median_time(lambda: split_input_target(get_text_windows(encoded_text, CONFIG['len_text'])), repeats)
+
+
+@case('sec', higher_is_better=False)
+def get_text_matrix(repeats):
+    from dataset import get_text_matrix
+    encoded_text, _ = corpus()
+    return median_time(lambda: get_text_matrix(encoded_text[:200000], CONFIG['len_text']), repeats)
+
+
+# Training
+
+@case('sec', higher_is_better=False)
+def custom_loss(repeats):
+    from common.rhymes import RhymeIndex
+    from rhyme_loss import RhymeTable, get_custom_loss
+    from dataset import make_training_dataset
+    encoded_text, char2idx = corpus()
+    rhyme_table = RhymeTable(RhymeIndex.load(corpus_path), char2idx)
+    tf.random.set_seed(CONFIG['seed'])
+    _, y = next(iter(make_training_dataset(encoded_text, CONFIG['len_text'], CONFIG['batch_size'], seed=CONFIG['seed'])))
+    logits = tf.random.normal(tuple(y.shape) + (len(char2idx),))
+    loss = tf.function(lambda logits, y: get_custom_loss(logits, y, rhyme_table))
+    return median_time(lambda: float(loss(logits, y)), repeats)
+
+
+@case('chars/sec', higher_is_better=True)
+def deepcomedy_train_step(repeats):
+    from architecture import build_model
+    from common.rhymes import RhymeIndex
+    from dataset import make_training_dataset
+    from rhyme_loss import RhymeTable
+    from training import make_train_step
+    encoded_text, char2idx = corpus()
+    tf.random.set_seed(CONFIG['seed'])
+    model = build_model(len(char2idx), CONFIG['batch_size'], CONFIG['embedding_size'], CONFIG['lstm_unit_1'],
+                        CONFIG['lstm_unit_2'], CONFIG['hidden_size'])
+    optimizer = tf.keras.optimizers.Adamax(learning_rate=0.001)
+    train_step = make_train_step(model, optimizer, RhymeTable(RhymeIndex.load(corpus_path), char2idx))
+    x, y = next(iter(make_training_dataset(encoded_text, CONFIG['len_text'], CONFIG['batch_size'], seed=CONFIG['seed'])))
+    seconds = median_time(lambda: float(train_step(x, y)[0]), repeats)
+    return CONFIG['batch_size'] * CONFIG['len_text'] / seconds
+
+
+@case('chars/sec', higher_is_better=True)
+def danternn_fit_step(repeats):
+    from model import BasicDanteRNN
+    from terzine import load_terzine
+    data, tokenizer = load_terzine(terzine_path)
+    max_line_length = int(data['lengths'].max())
+    rows = np.random.default_rng(CONFIG['seed']).choice(len(data['lengths']), 64, replace=False)
+    X = data['inputs'][rows, :, :max_line_length].transpose(1, 0, 2).astype('int32')
+    Y = data['outputs'][rows, :, :max_line_length].transpose(1, 0, 2).astype('int32')
+    syllables = data['syllables'][rows].astype('float32')
+
+    tf.random.set_seed(CONFIG['seed'])
+    model = BasicDanteRNN(CONFIG['latent_dim'], tokenizer.n_tokens, tokenizer)
+    model.compile(optimizer='rmsprop', loss='sparse_categorical_crossentropy')
+    inputs = [X[0], syllables[:, 0:1], X[1], syllables[:, 1:2], X[2], syllables[:, 2:3]]
+    seconds = median_time(lambda: model.train_on_batch(inputs, [Y[0], Y[1], Y[2]]), repeats)
+    return X.size / seconds
+
+
+# Generation
+
+def deepcomedy_generator(char2idx, batch_size=1):
+    from architecture import build_model
+    tf.random.set_seed(CONFIG['seed'])
+    return build_model(len(char2idx), batch_size, CONFIG['embedding_size'], CONFIG['lstm_unit_1'],
+                       CONFIG['lstm_unit_2'], CONFIG['hidden_size'], stateful=True)
+
+
+def start_terzina():
+    from common.structure import PoemIndex
+    return "\n" + PoemIndex.load(corpus_path).terzina('inferno', 1, 1) + "\n\n"
+
+
+@case('chars/sec', higher_is_better=True)
+def deepcomedy_generate_loop(repeats):
+    from bench_decoding import python_loop
+    _, char2idx = corpus()
+    generator = deepcomedy_generator(char2idx)
+    start_string = start_terzina()
+    seconds = median_time(lambda: python_loop(start_string, generator, char2idx, CONFIG['num_generate'], 1.0), repeats)
+    return CONFIG['num_generate'] / seconds
+
+
+@case('chars/sec', higher_is_better=True)
+def deepcomedy_generate_graph(repeats):
+    from generation import GraphDecoder
+    _, char2idx = corpus()
+    decoder = GraphDecoder(deepcomedy_generator(char2idx), char2idx)
+    start_string = start_terzina()
+    seconds = median_time(lambda: decoder.generate([start_string], CONFIG['num_generate'], 1.0), repeats)
+    return CONFIG['num_generate'] / seconds
+
+
+@case('chars/sec', higher_is_better=True)
+def danternn_generate(repeats):
+    from common.syllables import HENDECASYLLABLE
+    from model import BasicDanteRNN, generate_terzine
+    from terzine import load_terzine
+    data, tokenizer = load_terzine(terzine_path)
+    max_line_length = int(np.quantile(data['lengths'], .99, axis=0).max())
+
+    tf.random.set_seed(CONFIG['seed'])
+    np.random.seed(CONFIG['seed'])
+    model = BasicDanteRNN(CONFIG['latent_dim'], tokenizer.n_tokens, tokenizer, generative=True)
+    seconds = median_time(lambda: generate_terzine(model, tokenizer, max_line_length, HENDECASYLLABLE,
+                                                 CONFIG['num_terzine']), repeats)
+    # three lines of max_line_length characters for each terzina
+    return 3 * max_line_length * CONFIG['num_terzine'] / seconds
+
+
+def run(names, repeats):
+    results = {}
+    for name in names:
+        function, unit, higher_is_better = CASES[name]
+        tf.keras.backend.clear_session()
+        np.random.seed(CONFIG['seed'])
+        try:
+            value = function(repeats)
+        except Exception as e:  # a broken case is reported, the others still run
+            results[name] = { 'error': '{}: {}'.format(type(e).__name__, e) }
+            print("{:28s} ERROR {}".format(name, results[name]['error']))
+            continue
+        results[name] = { 'value': value, 'unit': unit, 'higher_is_better': higher_is_better }
+        print("{:28s} {:14.6f} {}".format(name, value, unit))
+    return results
+
+
+def run_processes(names, repeats, threads, runs):
+    """ run() in runs fresh processes, each case with the median of the runs and the slowest one """
+    reports = []
+    with tempfile.TemporaryDirectory() as directory:
+        for r in range(runs):
+            path = Path(directory) / 'run-{}.json'.format(r)
+            subprocess.run([sys.executable, __file__, '--only', ','.join(names), '--repeats', str(repeats),
+                            '--threads', str(threads), '--save', str(path)], check=True)
+            with open(path) as file:
+                reports.append(json.load(file)['results'])
+
+    results = {}
+    print("\nmedian of {} runs:".format(runs))
+    for name in names:
+        errors = [report[name] for report in reports if 'value' not in report[name]]
+        if errors:
+            results[name] = errors[0]
+            print("{:28s} ERROR {}".format(name, results[name]['error']))
+            continue
+        _, unit, higher_is_better = CASES[name]
+        values = [report[name]['value'] for report in reports]
+        results[name] = { 'value': float(np.median(values)), 'unit': unit, 'higher_is_better': higher_is_better,
+                          'slowest': min(values) if higher_is_better else max(values), 'runs': values }
+        print("{:28s} {:14.6f} {}".format(name, results[name]['value'], unit))
+    return results
+
+
+def speed(result, reference_value):
+    """ Speed of a result against a value of the baseline, > 1 is faster """
+    if result['higher_is_better']:
+        return result['value'] / reference_value
+    return reference_value / result['value']
+
+
+def compare(results, baseline, tolerance):
+    """ Names of the cases slower than the baseline by more than tolerance, failed or without a baseline value.
+
+    The speed printed is against the median of the baseline, the regressions
+    are against its slowest run (the median of a baseline of a single run).
+    """
+    regressions = []
+    print("\n{:28s} {:>14s} {:>14s} {:>8s}".format('case', 'baseline', 'current', 'speed'))
+    for name, result in results.items():
+        reference = baseline['results'].get(name)
+        if 'value' not in result:
+            regressions.append(name)
+            print("{:28s} {:>14s} REGRESSION".format(name, 'error'))
+            continue
+        if reference is None or 'value' not in reference:
+            regressions.append(name)
+            print("{:28s} {:>14s} REGRESSION".format(name, 'no baseline'))
+            continue
+        flag = 'REGRESSION' if speed(result, reference.get('slowest', reference['value'])) < 1 - tolerance else ''
+        if flag:
+            regressions.append(name)
+        print("{:28s} {:14.6f} {:14.6f} {:7.2f}x {}".format(
+            name, reference['value'], result['value'], speed(result, reference['value']), flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of DeepComedy and DanteRNN on CPU")
+    parser.add_argument('--only', help="comma separated cases, all by default: " + ', '.join(CASES))
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=0, help="TensorFlow threads, 0 for its default")
+    parser.add_argument('--save', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="baseline JSON file to compare with")
+    parser.add_argument('--runs', type=int, default=1, help="fresh processes of the suite, for a baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="slowdown flagged as a regression")
+    args = parser.parse_args()
+
+    if args.threads:
+        tf.config.threading.set_intra_op_parallelism_threads(args.threads)
+        tf.config.threading.set_inter_op_parallelism_threads(args.threads)
+
+    names = args.only.split(',') if args.only else list(CASES)
+    unknown = [name for name in names if name not in CASES]
+    if unknown:
+        parser.error("unknown cases: {}".format(', '.join(unknown)))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        # the timings of another number of threads are not comparable
+        if baseline.get('threads') != args.threads:
+            parser.error("the baseline was run with --threads {}, not {}".format(baseline.get('threads'), args.threads))
+
+    results = run(names, args.repeats) if args.runs == 1 else run_processes(names, args.repeats, args.threads,
+                                                                            args.runs)
+    report = {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'tensorflow': tf.__version__,
+        'threads': args.threads,
+        'repeats': args.repeats,
+        'runs': args.runs,
+        'min_repeat_sec': MIN_REPEAT_SEC,
+        'legacy_keras': os.environ['TF_USE_LEGACY_KERAS'],
+        'config': CONFIG,
+        'results': results,
+    }
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if baseline is not None:
+        if baseline.get('config') != CONFIG:
+            print("The baseline was run with another configuration: {}".format(baseline.get('config')))
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\n{} regression(s): {}".format(len(regressions), ', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+"""Data of ThreeLinesModel/danternn.py, prepared the same way for the benchmarks."""
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+three_lines_dir = Path(__file__).resolve().parent.parent / 'ThreeLinesModel'
+sys.path.insert(0, str(three_lines_dir))
+sys.path.insert(0, str(three_lines_dir.parent))  # the common package
+
+from tokenizer import CharTokenizer
+
+
+def load_terzine(drop_long_lines=True):
+    """ (df, max_line_length, tokenizer, inputs, outputs) with the padded _in/_out lines of danternn.py """
+    df = pd.read_csv(str(three_lines_dir / 'data' / 'DivinaCommedia.csv'))
+    max_line_length = int(max([df['%s' % i].astype(str).str.len().quantile(.99) for i in range(3)]))
+    if drop_long_lines:
+        df = df[(df['0'].astype(str).str.len() <= max_line_length) &
+                (df['1'].astype(str).str.len() <= max_line_length) &
+                (df['2'].astype(str).str.len() <= max_line_length)].copy()
+    for i in range(3):
+        df['%s_in' % i] = (df[str(i)].str[0] + df[str(i)]).str.pad(max_line_length+2, 'right', '\n')
+        if i == 2:
+            df['%s_out' % i] = df[str(i)].str.pad(max_line_length+2, 'right', '\n')
+        else:
+            df['%s_out' % i] = (df[str(i)] + '\n' + df[str(i+1)].str[0]).str.pad(max_line_length+2, 'right', '\n')
+    max_line_length += 2
+
+    inputs = df[['0_in', '1_in', '2_in']].values
+    outputs = df[['0_out', '1_out', '2_out']].values
+    tokenizer = CharTokenizer.fit(inputs.flatten())
+    return df, max_line_length, tokenizer, inputs, outputs
@@ -0,0 +1,192 @@
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+import tensorflow as tf
+
+
+class AsyncCheckpointWriter:
+    """ Writes model weights to disk on a background thread.
+
+    save() only takes an in-memory snapshot of the weights (model.get_weights())
+    and returns, the file is written by a worker thread, first to a temporary
+    file and then renamed, so a checkpoint on disk is never half written.
+    If a new snapshot arrives while the previous one is still waiting to be
+    written, only the newest is kept.
+
+    min_interval_sec / min_interval_steps throttle the writes: a save() that
+    comes too early after the last accepted one returns False and its
+    snapshot is deferred, replacing any older deferred one. poll() queues the
+    deferred snapshot once the interval has passed, flush() and close() queue
+    it right away, so the last snapshot given to save() always reaches disk.
+    Only the last keep_last checkpoints are kept on disk.
+    """
+
+    def __init__(self, directory, filename='ckpt-{step:07d}.npz', min_interval_sec=0, min_interval_steps=0,
+                 keep_last=3):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.filename = filename
+        self.min_interval_sec = min_interval_sec
+        self.min_interval_steps = min_interval_steps
+        self.keep_last = keep_last
+
+        self.last_save_time = None
+        self.last_save_step = None
+        self.written = deque()
+        self.error = None
+
+        self._pending = None
+        self._deferred = None
+        self._busy = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._worker, name='AsyncCheckpointWriter', daemon=True)
+        self._thread.start()
+
+    def due(self, step):
+        """ True if a save at this step is not throttled """
+        if self.last_save_time is None:
+            return True
+        return (time.time() - self.last_save_time >= self.min_interval_sec and
+                step - self.last_save_step >= self.min_interval_steps)
+
+    def save(self, model, step, force=False, **format_kwargs):
+        """ Snapshot the weights of model and queue them to be written, returns True if queued, False if deferred """
+        if self.error is not None:
+            raise self.error
+        if self._closed:
+            raise RuntimeError("the checkpoint writer is closed")
+
+        snapshot = (self.directory / self.filename.format(step=step, **format_kwargs), model.get_weights())
+        if not force and not self.due(step):
+            self._deferred = snapshot
+            return False
+        self._deferred = None
+        self._queue(snapshot, step)
+        return True
+
+    def poll(self, step):
+        """ Queue the deferred snapshot if the interval has passed, returns True if it was queued """
+        if self._deferred is None or not self.due(step):
+            return False
+        snapshot, self._deferred = self._deferred, None
+        self._queue(snapshot, step)
+        return True
+
+    def _queue(self, snapshot, step):
+        with self._condition:
+            self._pending = snapshot
+            self._condition.notify_all()
+        self.last_save_time = time.time()
+        self.last_save_step = step
+
+    def flush(self):
+        """ Wait until every snapshot given to save(), deferred ones included, is on disk """
+        if self._deferred is not None:
+            snapshot, self._deferred = self._deferred, None
+            self._queue(snapshot, self.last_save_step)
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending is None and not self._busy)
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self.flush()
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None or self._closed)
+                if self._pending is None:
+                    return
+                path, weights = self._pending
+                self._pending = None
+                self._busy = True
+            try:
+                self._write(path, weights)
+            except Exception as e:  # reported to the training thread on the next save/flush
+                self.error = e
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+    def _write(self, path, weights):
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'wb') as file:
+            np.savez(file, *weights)
+        os.replace(tmp_path, path)
+
+        if path in self.written:
+            self.written.remove(path)
+        self.written.append(path)
+        while len(self.written) > self.keep_last:
+            old = self.written.popleft()
+            if old.exists():
+                old.unlink()
+
+
+def load_checkpoint(model, path):
+    """ Restore into model the weights written by AsyncCheckpointWriter """
+    with np.load(path) as data:
+        model.set_weights([data['arr_%d' % i] for i in range(len(data.files))])
+
+
+def latest_checkpoint(directory, pattern='*.npz'):
+    """ Path of the most recently written checkpoint in directory, None if there is none """
+    checkpoints = sorted(Path(directory).glob(pattern), key=os.path.getmtime)
+    return str(checkpoints[-1]) if checkpoints else None
+
+
+class AsyncModelCheckpoint(tf.keras.callbacks.Callback):
+    """ Keras callback like ModelCheckpoint(save_best_only=True, save_weights_only=True),
+    every save_freq batches, that writes through an AsyncCheckpointWriter.
+
+    The writer filename can use {step}, {epoch} and the monitored {loss}. A
+    best model that comes while the writer is throttled is deferred, then
+    written when the interval has passed or at the end of the training.
+    """
+
+    def __init__(self, writer, monitor='loss', mode='min', save_best_only=True, save_freq=10, verbose=0):
+        super(AsyncModelCheckpoint, self).__init__()
+        self.writer = writer
+        self.monitor = monitor
+        self.save_best_only = save_best_only
+        self.save_freq = save_freq
+        self.verbose = verbose
+        self.better = np.less if mode == 'min' else np.greater
+        self.best = np.inf if mode == 'min' else -np.inf
+        self.step = 0
+        self.epoch = 0
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.step += 1
+        self.writer.poll(self.step)
+        if self.step % self.save_freq != 0:
+            return
+
+        current = (logs or {}).get(self.monitor)
+        if current is None:
+            return
+        if self.save_best_only and not self.better(current, self.best):
+            return
+
+        saved = self.writer.save(self.model, self.step, epoch=self.epoch + 1, loss=float(current))
+        if self.verbose:
+            print("\nstep {}: {} improved from {:.5f} to {:.5f}, {} checkpoint".format(
+                self.step, self.monitor, self.best, current, 'saving' if saved else 'deferring'))
+        self.best = current
+
+    def on_train_end(self, logs=None):
+        self.writer.flush()
@@ -0,0 +1,72 @@
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from common.normalize import corpus_key, load_corpus
+
+
+def lookup_table(char2idx, dtype=np.uint8, missing=None):
+    """ Array indexed by code point with the id of each character, `missing` for the others.
+
+    By default `missing` is the largest value of dtype, that must not be a valid id.
+    """
+    if missing is None:
+        missing = np.iinfo(dtype).max
+    table = np.full(max(ord(char) for char in char2idx) + 1, missing, dtype=dtype)
+    for char, idx in char2idx.items():
+        table[ord(char)] = idx
+    return table
+
+
+def code_points(text):
+    """ Code point of each character of text, as a numpy array """
+    return np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+
+
+def numerical_encoding(text, char_dict, dtype=np.uint8):
+    """ Text to np.array of numerical idx, with a lookup table instead of a loop on the characters """
+    table = lookup_table(char_dict, dtype)
+    points = code_points(text)
+    missing = np.iinfo(dtype).max
+    encoded = table[np.minimum(points, len(table) - 1)]
+    unknown = (encoded == missing) | (points >= len(table))
+    if unknown.any():
+        raise KeyError(text[int(np.flatnonzero(unknown)[0])])
+    return encoded
+
+
+def load_encoded_corpus(path, cache_dir=None):
+    """ (encoded_text, unique_chars) of load_corpus(path, flat=True), memory-mapped from disk.
+
+    The first time the text is encoded with numerical_encoding and written as a
+    uint8 .npy next to a .vocab.json with the sorted characters; afterwards
+    the .npy is only memory-mapped (read-only), so processes start at once and
+    share its pages.
+    """
+    path = Path(path)
+    cache_dir = Path(cache_dir) if cache_dir is not None else path.parent / '.corpus_cache'
+    key = corpus_key(path)
+    encoded_path = cache_dir / '{}-flat-encoded.npy'.format(key)
+    vocab_path = cache_dir / '{}-flat-encoded.vocab.json'.format(key)
+
+    if not (encoded_path.exists() and vocab_path.exists()):
+        text = load_corpus(path, flat=True, cache_dir=cache_dir)
+        # sorted to make sure you get the same encoding at each run
+        unique_chars = sorted(set(text))
+        encoded_text = numerical_encoding(text, { char: idx for idx, char in enumerate(unique_chars) })
+
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = encoded_path.with_name(encoded_path.name + '.%d.tmp' % os.getpid())
+        with open(tmp_path, 'wb') as file:
+            np.save(file, encoded_text)
+        os.replace(tmp_path, encoded_path)
+        tmp_path = vocab_path.with_name(vocab_path.name + '.%d.tmp' % os.getpid())
+        with open(tmp_path, 'w', encoding="utf8") as file:
+            json.dump(unique_chars, file, ensure_ascii=False)
+        os.replace(tmp_path, vocab_path)
+
+    with open(vocab_path, 'r', encoding="utf8") as file:
+        unique_chars = json.load(file)
+    return np.load(encoded_path, mmap_mode='r'), unique_chars
@@ -0,0 +1,119 @@
+import re
+
+import numpy as np
+
+from common.plagiarism import NgramIndex
+from common.rhymes import RhymeIndex
+from common.syllables import HENDECASYLLABLE, syllable_ranges
+
+_WORD = re.compile(r"[^\W\d_]+")
+
+METRICS = ('verses', 'terzine', 'hendecasyllables', 'syllables', 'rhymes', 'novel_words', 'copied_ngrams')
+
+
+class CantoMetrics:
+    """ Structural metrics of generated canti, computed in process on the strings.
+
+    All the verses of all the texts are flattened in a single list and all
+    their words in a single array, so the syllables, the rhymes, the words
+    and the n-grams are computed once for the whole batch (each distinct word
+    looked up once) and reduced per text with bincount. For each text:
+
+        verses: number of verses
+        terzine: share of the stanzas (verses between blank lines) of exactly
+            three verses, the last verse of a canto, alone, is not counted
+        hendecasyllables: share of the verses that can be read with 11 syllables
+        syllables: mean metrical syllables of a verse
+        rhymes: share of the pairs of the terza rima (ABA BCB CDC ..., the verse
+            k with k + 2 unless k is the last of a terzina) with the same rhyme
+        novel_words: share of the distinct words that are not in the poem
+        copied_ngrams: share of the word n-grams copied from the poem
+
+        metrics = CantoMetrics.load('DivinaCommedia.txt')
+        metrics.evaluate(generated_canti)['hendecasyllables']
+    """
+
+    def __init__(self, rhyme_index, ngram_index):
+        self.rhyme_index = rhyme_index
+        self.ngram_index = ngram_index
+
+    @classmethod
+    def load(cls, path, n=4, cache_dir=None):
+        """ Metrics with the rhymes and the n-grams of the poem at path, read from the corpus cache """
+        return cls(RhymeIndex.load(path, cache_dir=cache_dir), NgramIndex.load(path, n, cache_dir=cache_dir))
+
+    def evaluate(self, texts):
+        """ Dict of METRICS, each an array with the value of every text """
+        n_texts = len(texts)
+        verses, verse_text, verse_position = [], [], []
+        stanza_text, stanza_length = [], []
+        for t, text in enumerate(texts):
+            lines = [line.strip() for line in text.split('\n')]
+            position = 0
+            stanza = 0
+            for line in lines + ['']:
+                if line:
+                    verses.append(line)
+                    verse_text.append(t)
+                    verse_position.append(position)
+                    position += 1
+                    stanza += 1
+                elif stanza:
+                    stanza_text.append(t)
+                    stanza_length.append(stanza)
+                    stanza = 0
+            # the last verse of a canto is alone
+            if stanza_length and stanza_text[-1] == t and stanza_length[-1] == 1:
+                stanza_text.pop()
+                stanza_length.pop()
+
+        verse_text = np.array(verse_text, dtype=np.int64)
+        verse_position = np.array(verse_position, dtype=np.int64)
+        n_verses = np.bincount(verse_text, minlength=n_texts)
+
+        def mean_per_text(values, text_ids, counts):
+            return np.bincount(text_ids, weights=values, minlength=n_texts) / np.maximum(counts, 1)
+
+        ranges = syllable_ranges(verses)
+        hendecasyllables = (ranges[:, 1] <= HENDECASYLLABLE) & (HENDECASYLLABLE <= ranges[:, 2])
+
+        stanza_text = np.array(stanza_text, dtype=np.int64)
+        n_stanzas = np.bincount(stanza_text, minlength=n_texts)
+        terzine = np.array(stanza_length) == 3
+
+        # the verse k rhymes with k + 2 in the same text, unless it's the last of a terzina
+        rhymes = self.rhyme_index.lookup(verses)
+        pairs = np.flatnonzero((verse_position % 3 != 2) & (verse_position + 2 < n_verses[verse_text]))
+        rhyming = (rhymes[pairs] > 0) & (rhymes[pairs] == rhymes[pairs + 2])
+        n_pairs = np.bincount(verse_text[pairs], minlength=n_texts)
+
+        # the words of all the texts, each distinct one looked up once in the poem
+        text_words = [_WORD.findall(text.lower()) for text in texts]
+        word_text = np.repeat(np.arange(n_texts), [len(words) for words in text_words])
+        unique_words = {}
+        inverse = np.array([unique_words.setdefault(word, len(unique_words))
+                            for words in text_words for word in words], dtype=np.int64)
+        unique_ids = self.ngram_index.word_ids(list(unique_words))
+
+        # the distinct words of each text, as text * len(unique_words) + word
+        distinct = np.unique(word_text * len(unique_words) + inverse)
+        distinct_text = distinct // max(len(unique_words), 1)
+        novel = unique_ids[distinct % max(len(unique_words), 1)] == 0
+        novel_words = mean_per_text(novel, distinct_text, np.bincount(distinct_text, minlength=n_texts))
+
+        ngram_text, cantiche = self.ngram_index.copied_ids(unique_ids[inverse], word_text)
+        copied_ngrams = mean_per_text(cantiche > 0, ngram_text, np.bincount(ngram_text, minlength=n_texts))
+
+        return {
+            'verses': n_verses,
+            'terzine': mean_per_text(terzine, stanza_text, n_stanzas),
+            'hendecasyllables': mean_per_text(hendecasyllables, verse_text, n_verses),
+            'syllables': mean_per_text(ranges[:, 0], verse_text, n_verses),
+            'rhymes': mean_per_text(rhyming, verse_text[pairs], n_pairs),
+            'novel_words': novel_words,
+            'copied_ngrams': copied_ngrams,
+        }
+
+    def summary(self, texts):
+        """ Mean of each metric over the texts """
+        return { name: float(np.mean(values)) for name, values in self.evaluate(texts).items() }
@@ -0,0 +1,94 @@
+import hashlib
+import os
+import re
+from pathlib import Path
+
+# bump it whenever the normalization changes, the cached corpora are then rebuilt
+NORMALIZER_VERSION = 1
+
+# Replace rare characters, brackets and drop the numbers of the verses, in a single pass
+_REPLACEMENTS = {
+    "ä": "a",
+    "é": "è",
+    "ë": "è",
+    "Ë": "E",
+    "ï": "i",
+    "Ï": "I",
+    "ó": "ò",
+    "ö": "o",
+    "ü": "u",
+    "(": "-",
+    ")": "-",
+    "[": None,
+    "]": None,
+    **{ digit: None for digit in "0123456789" },
+}
+_CHAR_TABLE = str.maketrans(_REPLACEMENTS)
+
+# the same, but the vowels with a diaeresis are kept: they split a diphthong and
+# change the count of the syllables
+_METRICAL_TABLE = str.maketrans({ char: replacement for char, replacement in _REPLACEMENTS.items()
+                                  if char not in "äëËïÏöü" })
+
+# introductory text of each Canto, a whole line between brackets
+_BRACKET_LINE = re.compile(r'\[.*\r?\n')
+# title of each Canto
+_CANTO_TITLE = re.compile(r'.*Canto.*\r?\n')
+# last row of each Canto, it's alone and can ruin the generation on correct terzine
+_LAST_ROW = re.compile(r'.*?\n\n\n\n')
+
+
+def normalize_text(text, keep_diaeresis=False):
+    """ Uniform version of the text: no introductions, rare characters, brackets and numbers.
+
+    The structure (Cantiche and Canti titles, blank lines) is kept. With
+    keep_diaeresis the vowels with a diaeresis are not replaced, for counting
+    the syllables.
+    """
+    text = _BRACKET_LINE.sub('', text)
+    return text.translate(_METRICAL_TABLE if keep_diaeresis else _CHAR_TABLE)
+
+
+def flatten_text(text):
+    """ Only the terzine of a normalized text: titles and last row of each Canto removed """
+    text = _CANTO_TITLE.sub('', text)
+    return _LAST_ROW.sub('', text)
+
+
+def corpus_key(path, source=None):
+    """ Name of the cached artifacts of the file at path: its name, content hash and NORMALIZER_VERSION """
+    path = Path(path)
+    if source is None:
+        with open(path, 'rb') as file:
+            source = file.read()
+    return '{}-{}-v{}'.format(path.stem, hashlib.sha256(source).hexdigest()[:16], NORMALIZER_VERSION)
+
+
+def load_corpus(path, flat=False, cache_dir=None):
+    """ normalize_text (and flatten_text if flat) of the file at path, cached on disk.
+
+    The cached file is named after the hash of the source file and
+    NORMALIZER_VERSION, so it's rebuilt only when one of them changes.
+    By default the cache is the .corpus_cache directory next to the source.
+    """
+    path = Path(path)
+    cache_dir = Path(cache_dir) if cache_dir is not None else path.parent / '.corpus_cache'
+
+    with open(path, 'rb') as file:
+        source = file.read()
+    cache_path = cache_dir / '{}-{}.txt'.format(corpus_key(path, source), 'flat' if flat else 'lines')
+
+    if cache_path.exists():
+        with open(cache_path, 'r', encoding="utf8", newline='') as file:
+            return file.read()
+
+    text = normalize_text(source.decode("utf8").replace("\r\n", "\n"))
+    if flat:
+        text = flatten_text(text)
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(cache_path.name + '.%d.tmp' % os.getpid())
+    with open(tmp_path, 'w', encoding="utf8", newline='') as file:
+        file.write(text)
+    os.replace(tmp_path, cache_path)
+    return text
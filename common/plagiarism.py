@@ -0,0 +1,146 @@
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+
+from common.normalize import corpus_key
+from common.structure import CANTICHE, PoemIndex
+
+_WORD = re.compile(r"[^\W\d_]+")
+
+# version of the cached index, to change with the hashing of the n-grams or the layout of the cantiche bits
+NGRAM_INDEX_VERSION = 1
+
+# odd multiplier of the polynomial hash, the arithmetic wraps modulo 2**64
+_HASH_BASE = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _words(text):
+    return _WORD.findall(text.lower())
+
+
+def ngram_hashes(word_ids, n):
+    """ 64 bit polynomial hash of each n-gram of an array of word ids, computed for all of them at once.
+
+    The hash of the n-gram starting at i is the sum of word_ids[i + k] * base**(n - 1 - k),
+    accumulated for every window together in n passes over the array, in linear time.
+    """
+    word_ids = np.asarray(word_ids, dtype=np.uint64)
+    count = len(word_ids) - n + 1
+    if count <= 0:
+        return np.zeros(0, dtype=np.uint64)
+    hashes = np.zeros(count, dtype=np.uint64)
+    for k in range(n):
+        hashes = hashes * _HASH_BASE + word_ids[k:k + count]
+    return hashes
+
+
+class NgramIndex:
+    """ Hashes of every word n-gram of the poem, to score the plagiarism of a generated text.
+
+    The index is built once from the verses of PoemIndex.load(path), one
+    cantica at a time so no n-gram spans two cantiche, and persisted next to
+    the corpus. A generated text is scored in one pass: its n-grams are
+    hashed like the poem ones and searched in the sorted hashes, so a canto
+    is checked in milliseconds. The n-grams with a word that is not in the
+    poem can't be copied and are not searched.
+
+    Arrays:
+        words (W,): the words of the poem, the word id i + 1
+        hashes (H,) uint64: sorted hashes of the distinct n-grams
+        cantiche (H,) uint8: bit c set if the n-gram is in the cantica CANTICHE[c]
+    """
+
+    FIELDS = ('words', 'hashes', 'cantiche')
+
+    def __init__(self, n, arrays):
+        self.n = n
+        for field in self.FIELDS:
+            setattr(self, field, arrays[field])
+        self._word_ids = { str(word): i for i, word in enumerate(self.words, 1) }
+
+    @classmethod
+    def build(cls, poem, n=4):
+        """ Index of the n-grams of each cantica of a PoemIndex """
+        cantiche_words = []
+        for c in range(len(CANTICHE)):
+            first, last = poem.canto_verse[poem.cantica_canto[c]], poem.canto_verse[poem.cantica_canto[c + 1]]
+            cantiche_words.append(_words('\n'.join(poem.text[start:end] for start, end in poem.verse_spans[first:last])))
+
+        index = cls(n, { 'words': np.array(sorted({ word for words in cantiche_words for word in words })),
+                         'hashes': np.zeros(0, dtype=np.uint64), 'cantiche': np.zeros(0, dtype=np.uint8) })
+        hashes = [ngram_hashes(index.word_ids(words), n) for words in cantiche_words]
+        cantiche = np.concatenate([np.full(len(h), 1 << c, dtype=np.uint8) for c, h in enumerate(hashes)])
+        hashes = np.concatenate(hashes)
+
+        # one entry per distinct n-gram, with the cantiche where it occurs
+        order = np.argsort(hashes, kind='stable')
+        hashes, cantiche = hashes[order], cantiche[order]
+        starts = np.flatnonzero(np.concatenate([[True], hashes[1:] != hashes[:-1]]))
+        index.hashes = hashes[starts]
+        index.cantiche = np.bitwise_or.reduceat(cantiche, starts).astype(np.uint8)
+        return index
+
+    @classmethod
+    def load(cls, path, n=4, cache_dir=None):
+        """ Index of the n-grams of PoemIndex.load(path), built the first time and then read from the corpus cache.
+
+        The cached file is named after corpus_key, n and NGRAM_INDEX_VERSION,
+        so it's rebuilt when the corpus, the normalizer or the index change.
+        """
+        path = Path(path)
+        cache_dir = Path(cache_dir) if cache_dir is not None else path.parent / '.corpus_cache'
+        index_path = cache_dir / '{}-ngrams-{}-v{}.npz'.format(corpus_key(path), n, NGRAM_INDEX_VERSION)
+
+        if index_path.exists():
+            with np.load(index_path) as data:
+                return cls(n, { field: data[field] for field in cls.FIELDS })
+
+        index = cls.build(PoemIndex.load(path, cache_dir=cache_dir), n)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = index_path.with_name(index_path.name + '.%d.tmp' % os.getpid())
+        with open(tmp_path, 'wb') as file:
+            np.savez(file, **{ field: getattr(index, field) for field in cls.FIELDS })
+        os.replace(tmp_path, index_path)
+        return index
+
+    def word_ids(self, words):
+        """ Id of each word, 0 if it's not in the poem """
+        return np.array([self._word_ids.get(word, 0) for word in words], dtype=np.uint64)
+
+    def copied(self, text):
+        """ (n-grams of text, and for each one the cantiche bits where it's found, 0 if it's not in the poem) """
+        word_ids = self.word_ids(_words(text))
+        _, cantiche = self.copied_ids(word_ids, np.zeros(len(word_ids), dtype=np.int64))
+        return len(cantiche), cantiche
+
+    def copied_ids(self, word_ids, text_ids):
+        """ (text id, cantiche bits) of every n-gram of many texts, their word ids concatenated.
+
+        text_ids (sorted, one per word) tells the text of each word: the
+        n-grams that span two texts are dropped, the others are hashed and
+        searched all together.
+        """
+        word_ids, text_ids = np.asarray(word_ids, dtype=np.uint64), np.asarray(text_ids)
+        hashes = ngram_hashes(word_ids, self.n)
+        count = len(hashes)
+        # an n-gram with an unknown word is not searched
+        unknown = np.concatenate([[0], np.cumsum(word_ids == 0)])
+        known = unknown[self.n:] == unknown[:count]
+        positions = np.minimum(np.searchsorted(self.hashes, hashes), len(self.hashes) - 1)
+        found = known & (self.hashes[positions] == hashes)
+        inside = text_ids[self.n - 1:] == text_ids[:count]
+        return text_ids[:count][inside], np.where(found, self.cantiche[positions], 0)[inside]
+
+    def score(self, text):
+        """ Share of the n-grams of text found in the whole poem, and in each cantica.
+
+        Returns a dict with 'ngrams' (their number), 'poem' and one share for
+        each cantica, all 0 if the text is shorter than n words.
+        """
+        n_ngrams, cantiche = self.copied(text)
+        scores = { 'ngrams': n_ngrams, 'poem': float(np.mean(cantiche > 0)) if n_ngrams else 0.0 }
+        for c, cantica in enumerate(CANTICHE):
+            scores[cantica.lower()] = float(np.mean(cantiche & (1 << c) > 0)) if n_ngrams else 0.0
+        return scores
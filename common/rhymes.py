@@ -0,0 +1,175 @@
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+
+from common.encoding import code_points
+from common.normalize import corpus_key
+from common.structure import PoemIndex
+from common.syllables import stressed_vowel
+
+_WORD = re.compile(r"[^\W\d_]+")
+
+# version of the cached index, to change with the way the rhyme chains, endings, codes or tails are built
+RHYME_INDEX_VERSION = 1
+
+# the codes of the suffixes are int64
+_MAX_CODE = 2 ** 63 - 1
+
+
+def rhyme_ending(verse):
+    """ The rhyme of a verse: its last word from the stressed vowel on, None if it has no vowels """
+    words = _WORD.findall(verse.lower())
+    if not words:
+        return None
+    vowel = stressed_vowel(words[-1])
+    return None if vowel is None else words[-1][vowel:]
+
+
+def _common_suffix(words):
+    """ Longest suffix shared by all the words, '' if there's none """
+    suffix = words[0] if words else ''
+    for word in words[1:]:
+        while not word.endswith(suffix):
+            suffix = suffix[1:]
+    return suffix
+
+
+class RhymeIndex:
+    """ Compact ids of the rhyme endings of the poem, from 1, 0 for no known rhyme.
+
+    The endings are found once with rhyme_ending on every verse of the poem
+    (see build) and persisted next to the corpus, like PoemIndex. Each ending is stored as
+    the integer code of its letters read from the end,
+
+        code = letter_1 + base * letter_2 + base**2 * letter_3 + ...
+
+    with letter_1 the last one, so the rhyme of a verse is found with
+    integer comparisons only: the codes of its last 1, 2, ..., max_length
+    letters are searched among the sorted keys and the longest one found
+    wins. Punctuation and spaces are skipped, like in the rhyme loss, and a
+    verse of an unknown word gets the rhyme of its longest known ending.
+
+    Arrays:
+        endings (R,): the ending of the rhyme id i + 1, sorted
+        keys (R,) int64: codes of the endings, sorted
+        values (R,) int32: rhyme id of each key
+    """
+
+    FIELDS = ('endings', 'keys', 'values')
+
+    def __init__(self, arrays):
+        for field in self.FIELDS:
+            setattr(self, field, arrays[field])
+        # letter codes from 1, base - 1 is any other letter, 0 is not a letter
+        self.letters = ''.join(sorted(set(''.join(self.endings))))
+        self.base = len(self.letters) + 2
+        self.max_length = max((len(ending) for ending in self.endings), default=0)
+        self._codes = { letter: code for code, letter in enumerate(self.letters, 1) }
+
+    @classmethod
+    def build(cls, poem):
+        """ Index of the rhyme endings of a PoemIndex.
+
+        The verses that rhyme in the terza rima of a canto (ABA BCB ... YZY Z)
+        all get the longest common suffix of their endings, so the stress
+        guessed wrong on a word (paura read as pàura) is fixed by the other
+        words of its rhyme (oscura, dura).
+        """
+        endings = set()
+        for first, end in zip(poem.canto_verse[:-1], poem.canto_verse[1:]):
+            # chain of each verse of the canto, the verse i rhymes with i + 2 unless it's the last of a terzina
+            chain_of, chains = {}, []
+            for i in range(end - first):
+                if i not in chain_of:
+                    chain_of[i] = len(chains)
+                    chains.append([])
+                start, stop = poem.verse_spans[first + i]
+                chains[chain_of[i]].append(rhyme_ending(poem.text[start:stop]))
+                if i % 3 != 2:
+                    chain_of[i + 2] = chain_of[i]
+            endings.update(_common_suffix([ending for ending in chain if ending]) for chain in chains)
+        endings = sorted(endings - { None, '' })
+        base = len(set(''.join(endings))) + 2
+        # the longest endings (very rare) would overflow the codes
+        max_length = 1
+        while base ** (max_length + 1) <= _MAX_CODE:
+            max_length += 1
+        endings = [ending for ending in endings if len(ending) <= max_length]
+
+        index = cls({ 'endings': np.array(endings), 'keys': np.zeros(0, dtype=np.int64),
+                      'values': np.zeros(0, dtype=np.int32) })
+        keys = index.tails(endings)
+        keys = (keys * index.base ** np.arange(index.max_length, dtype=np.int64)).sum(axis=1)
+        order = np.argsort(keys)
+        index.keys = keys[order]
+        index.values = (order + 1).astype(np.int32)
+        return index
+
+    @classmethod
+    def load(cls, path, cache_dir=None):
+        """ Index of the verses of PoemIndex.load(path), built the first time and then read from the corpus cache.
+
+        The cached file is named after corpus_key and RHYME_INDEX_VERSION, so
+        it's rebuilt when the corpus, the normalizer or the index change.
+        """
+        path = Path(path)
+        cache_dir = Path(cache_dir) if cache_dir is not None else path.parent / '.corpus_cache'
+        index_path = cache_dir / '{}-rhymes-v{}.npz'.format(corpus_key(path), RHYME_INDEX_VERSION)
+
+        if index_path.exists():
+            with np.load(index_path) as data:
+                return cls({ field: data[field] for field in cls.FIELDS })
+
+        poem = PoemIndex.load(path, cache_dir=cache_dir)
+        index = cls.build(poem)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = index_path.with_name(index_path.name + '.%d.tmp' % os.getpid())
+        with open(tmp_path, 'wb') as file:
+            np.savez(file, **{ field: getattr(index, field) for field in cls.FIELDS })
+        os.replace(tmp_path, index_path)
+        return index
+
+    def letter_codes(self, char2idx):
+        """ Code of each character id of char2idx, for the lookup inside the graph """
+        codes = np.zeros(len(char2idx), dtype=np.int64)
+        for char, idx in char2idx.items():
+            if char.isalpha():
+                codes[idx] = self._codes.get(char.lower(), self.base - 1)
+        return codes
+
+    def tails(self, verses):
+        """ (n, max_length) codes of the last letters of each verse, the last one first, 0 where it's shorter """
+        # the code of every character of all the verses at once, from the distinct code points
+        points = code_points('\n'.join(verses))
+        unique_points, inverse = np.unique(points, return_inverse=True)
+        codes = np.array([self._codes.get(chr(point).lower(), self.base - 1) if chr(point).isalpha() else 0
+                          for point in unique_points], dtype=np.int64)[inverse]
+        letters = np.flatnonzero(codes)
+
+        # the letters of each verse are letters[first:end], the last ones are read backwards from end
+        verse_ends = np.cumsum([len(verse) + 1 for verse in verses]) - 1
+        first = np.searchsorted(letters, verse_ends - [len(verse) for verse in verses])
+        end = np.searchsorted(letters, verse_ends)
+        backwards = end[:, np.newaxis] - 1 - np.arange(self.max_length)
+        inside = backwards >= first[:, np.newaxis]
+        return np.where(inside, codes[letters[np.where(inside, backwards, 0)]] if len(letters) else 0, 0)
+
+    def lookup_tails(self, tails):
+        """ Rhyme id of each row of codes built like tails, with integer comparisons only """
+        if not len(self.keys):
+            return np.zeros(len(tails), dtype=np.int32)
+        suffixes = np.cumsum(tails * self.base ** np.arange(tails.shape[1], dtype=np.int64), axis=1)
+        positions = np.minimum(np.searchsorted(self.keys, suffixes), len(self.keys) - 1)
+        found = (self.keys[positions] == suffixes) & (tails > 0)
+        longest = tails.shape[1] - 1 - np.argmax(found[:, ::-1], axis=1)
+        rows = np.arange(len(tails))
+        return np.where(found.any(axis=1), self.values[positions[rows, longest]], 0).astype(np.int32)
+
+    def lookup(self, verses):
+        """ Rhyme id of each verse of a list, 0 if none of its endings is known """
+        return self.lookup_tails(self.tails(verses))
+
+    def ending(self, rhyme_id):
+        return str(self.endings[rhyme_id - 1]) if rhyme_id > 0 else None
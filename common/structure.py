@@ -0,0 +1,170 @@
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+
+from common.normalize import corpus_key, load_corpus
+
+CANTICHE = ('INFERNO', 'PURGATORIO', 'PARADISO')
+
+# version of the cached index, to change with the way the offsets are found or laid out
+STRUCTURE_INDEX_VERSION = 1
+
+_LINE = re.compile(r'[^\n]*\n?')
+
+
+class PoemIndex:
+    """ Character offsets of every cantica, canto, terzina and verse of the normalized poem.
+
+    The index is built in a single pass over load_corpus(path) and persisted
+    next to it, so cantiche, canti, terzine and verses are sliced out of the
+    text by offset without scanning it again. Canti, terzine and verses are
+    numbered from 1, inside their cantica, canto and terzina:
+
+        poem = PoemIndex.load('DivinaCommedia.txt')
+        poem.terzina('inferno', 5, 12)
+
+    A canto is made of its terzine and of its last verse, alone; that verse
+    belongs to the canto and to no terzina.
+
+    Arrays, all int32:
+        verse_spans (V, 2): start and end offset of each verse, without trailing spaces
+        terzina_verse (T,): first verse of each terzina, the other two follow it
+        canto_spans (C, 2): offset of the first and end of the last verse of each canto
+        canto_terzina (C + 1,): first terzina of each canto, and T at the end
+        canto_verse (C + 1,): first verse of each canto, and V at the end
+        cantica_canto (4,): first canto of each cantica, and C at the end
+    """
+
+    FIELDS = ('verse_spans', 'terzina_verse', 'canto_spans', 'canto_terzina', 'canto_verse', 'cantica_canto')
+
+    def __init__(self, text, arrays):
+        self.text = text
+        for field in self.FIELDS:
+            setattr(self, field, arrays[field])
+
+    @classmethod
+    def build(cls, text):
+        """ Index of a text normalized by normalize_text, with its titles """
+        verse_spans, terzina_verse, canto_verse, cantica_canto = [], [], [], []
+        stanza = []
+
+        def end_stanza():
+            if len(stanza) == 3:
+                terzina_verse.append(stanza[0])
+            stanza.clear()
+
+        offset = 0
+        for match in _LINE.finditer(text):
+            line = match.group().rstrip()
+            start, offset = offset, match.end()
+            if not line:
+                end_stanza()
+                if offset == len(text):
+                    break
+            elif line in CANTICHE:
+                end_stanza()
+                cantica_canto.append(len(canto_verse))
+            elif line.startswith('Canto'):
+                end_stanza()
+                canto_verse.append(len(verse_spans))
+            else:
+                stanza.append(len(verse_spans))
+                verse_spans.append((start, start + len(line)))
+        end_stanza()
+
+        if len(cantica_canto) != len(CANTICHE):
+            raise ValueError("Found {} cantiche instead of {}".format(len(cantica_canto), len(CANTICHE)))
+
+        verse_spans = np.array(verse_spans, dtype=np.int32).reshape(-1, 2)
+        terzina_verse = np.array(terzina_verse, dtype=np.int32)
+        canto_verse = np.array(canto_verse + [len(verse_spans)], dtype=np.int32)
+        last_verse = canto_verse[1:] - 1
+        return cls(text, {
+            'verse_spans': verse_spans,
+            'terzina_verse': terzina_verse,
+            'canto_spans': np.stack([verse_spans[canto_verse[:-1], 0], verse_spans[last_verse, 1]], axis=1),
+            'canto_terzina': np.searchsorted(terzina_verse, canto_verse).astype(np.int32),
+            'canto_verse': canto_verse,
+            'cantica_canto': np.array(cantica_canto + [len(canto_verse) - 1], dtype=np.int32),
+        })
+
+    @classmethod
+    def load(cls, path, cache_dir=None):
+        """ Index of load_corpus(path), built the first time and then read from the corpus cache.
+
+        The cached file is named after corpus_key and STRUCTURE_INDEX_VERSION,
+        so it's rebuilt when the corpus, the normalizer or the index change.
+        """
+        path = Path(path)
+        cache_dir = Path(cache_dir) if cache_dir is not None else path.parent / '.corpus_cache'
+        index_path = cache_dir / '{}-index-v{}.npz'.format(corpus_key(path), STRUCTURE_INDEX_VERSION)
+        text = load_corpus(path, cache_dir=cache_dir)
+
+        if index_path.exists():
+            with np.load(index_path) as data:
+                return cls(text, { field: data[field] for field in cls.FIELDS })
+
+        index = cls.build(text)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = index_path.with_name(index_path.name + '.%d.tmp' % os.getpid())
+        with open(tmp_path, 'wb') as file:
+            np.savez(file, **{ field: getattr(index, field) for field in cls.FIELDS })
+        os.replace(tmp_path, index_path)
+        return index
+
+    # Numbers of the parts
+
+    def canto_id(self, cantica, canto):
+        """ Index of a canto among all the canti of the poem """
+        c = CANTICHE.index(cantica.upper())
+        n_canti = self.cantica_canto[c + 1] - self.cantica_canto[c]
+        if not 1 <= canto <= n_canti:
+            raise IndexError("{} has {} canti, not {}".format(CANTICHE[c], n_canti, canto))
+        return int(self.cantica_canto[c] + canto - 1)
+
+    def terzina_id(self, cantica, canto, terzina):
+        """ Index of a terzina among all the terzine of the poem """
+        c = self.canto_id(cantica, canto)
+        n_terzine = self.canto_terzina[c + 1] - self.canto_terzina[c]
+        if not 1 <= terzina <= n_terzine:
+            raise IndexError("The canto has {} terzine, not {}".format(n_terzine, terzina))
+        return int(self.canto_terzina[c] + terzina - 1)
+
+    def n_canti(self, cantica):
+        c = CANTICHE.index(cantica.upper())
+        return int(self.cantica_canto[c + 1] - self.cantica_canto[c])
+
+    def n_terzine(self, cantica, canto):
+        c = self.canto_id(cantica, canto)
+        return int(self.canto_terzina[c + 1] - self.canto_terzina[c])
+
+    # Text of the parts
+
+    def cantica(self, cantica):
+        c = CANTICHE.index(cantica.upper())
+        first, last = self.cantica_canto[c], self.cantica_canto[c + 1] - 1
+        return self.text[self.canto_spans[first, 0]:self.canto_spans[last, 1]]
+
+    def canto(self, cantica, canto):
+        start, end = self.canto_spans[self.canto_id(cantica, canto)]
+        return self.text[start:end]
+
+    def terzina(self, cantica, canto, terzina):
+        first = self.terzina_verse[self.terzina_id(cantica, canto, terzina)]
+        return self.text[self.verse_spans[first, 0]:self.verse_spans[first + 2, 1]]
+
+    def verse(self, cantica, canto, terzina, verse):
+        if not 1 <= verse <= 3:
+            raise IndexError("A terzina has 3 verses, not {}".format(verse))
+        start, end = self.verse_spans[self.terzina_verse[self.terzina_id(cantica, canto, terzina)] + verse - 1]
+        return self.text[start:end]
+
+    def terzine(self):
+        """ (cantica, canto, [verse_1, verse_2, verse_3]) of every terzina, in order """
+        for c, cantica in enumerate(CANTICHE):
+            for canto_id in range(self.cantica_canto[c], self.cantica_canto[c + 1]):
+                for first in self.terzina_verse[self.canto_terzina[canto_id]:self.canto_terzina[canto_id + 1]]:
+                    yield (cantica, int(canto_id - self.cantica_canto[c] + 1),
+                           [self.text[start:end] for start, end in self.verse_spans[first:first + 3]])
@@ -0,0 +1,223 @@
+import re
+from functools import lru_cache
+
+import numpy as np
+
+# vowels with a diaeresis are always a syllable of their own
+DIAERESIS = set("äëïöü")
+# stressed vowels, never the weak part of a diphthong
+ACCENTED = set("àèéìíòóùú")
+VOWELS = set("aeiou") | DIAERESIS | ACCENTED
+
+HENDECASYLLABLE = 11
+
+_WORD = re.compile(r"[^\W\d_]+")
+# the words of many verses joined by new lines, with the new lines between them
+_WORD_OR_NEWLINE = re.compile(r"[^\W\d_]+|\n")
+# h is silent, outside of ch and gh
+_SILENT_H = re.compile(r"(?<![cg])h")
+
+
+def _is_strong(vowel):
+    return vowel not in "iu"
+
+
+def _vowel_positions(word):
+    """ Positions of the letters of word that are vowels of a syllable.
+
+    The u of qu and gu before a vowel and the i of ci, gi, sci and gli before
+    a vowel only mark the sound of the consonant, they are not vowels.
+    """
+    positions = []
+    for i, char in enumerate(word):
+        if char not in VOWELS:
+            continue
+        followed_by_vowel = i + 1 < len(word) and word[i + 1] in VOWELS
+        if char == 'u' and i > 0 and word[i - 1] in "qg" and followed_by_vowel:
+            continue
+        if char == 'i' and i > 0 and word[i - 1] in "cg" and followed_by_vowel:
+            continue
+        if char == 'i' and i > 1 and word[i - 2:i] == "gl" and followed_by_vowel:
+            continue
+        positions.append(i)
+    return positions
+
+
+@lru_cache(maxsize=None)
+def word_syllables(word):
+    """ Syllables of a lower case word: (count, splittable, mergeable, starts_vowel, ends_vowel, oxytone).
+
+    Two strong vowels (a, e, o or stressed) are a hiatus and a weak one (i, u)
+    makes a diphthong with its neighbour, unless one of them has a diaeresis.
+    splittable is the number of diphthongs that a dieresis could split and
+    mergeable the number of hiatuses that a synaeresis could merge. oxytone is
+    True when the word is stressed on its last syllable: a final stressed
+    vowel, a monosyllable or a truncated word (cammin, amor).
+    """
+    word = _SILENT_H.sub('', word) or word
+    positions = _vowel_positions(word)
+    count = splittable = mergeable = 0
+    for n, i in enumerate(positions):
+        if n == 0 or positions[n - 1] != i - 1:
+            count += 1
+            continue
+        previous, vowel = word[i - 1], word[i]
+        if previous in DIAERESIS or vowel in DIAERESIS:
+            count += 1
+        elif _is_strong(previous) and _is_strong(vowel):
+            count += 1
+            mergeable += 1
+        else:
+            splittable += 1
+
+    starts_vowel = word[0] in VOWELS
+    ends_vowel = word[-1] in VOWELS
+    oxytone = count > 0 and (word[-1] in ACCENTED or count == 1 or not ends_vowel)
+    return count, splittable, mergeable, starts_vowel, ends_vowel, oxytone
+
+
+def _words(verse):
+    # the apostrophes of the elisions join the word to the next one, or are dropped
+    return _WORD.findall(verse.lower().replace("’", "'").replace("'", ""))
+
+
+def syllable_range(verse):
+    """ (count, minimum, maximum) metrical syllables of a verse.
+
+    count applies a synalepha between every word ending and word starting
+    with a vowel, and counts one more syllable after the last stress when the
+    verse ends with an oxytone word. minimum and maximum are the counts with
+    every possible synaeresis, or with every possible dieresis and dialefe
+    (a synalepha not applied). The stress of the other words is not known, so
+    the minimum also allows a last word of three or more syllables to be
+    stressed on the antepenultimate (margini, scendere).
+    """
+    count = splittable = mergeable = synalephas = 0
+    previous = None
+    for word in _words(verse):
+        syllables = word_syllables(word)
+        if syllables[0] == 0:
+            # an elided article or pronoun ('l, m'), only consonants
+            previous = syllables
+            continue
+        count += syllables[0]
+        splittable += syllables[1]
+        mergeable += syllables[2]
+        if previous is not None and previous[4] and syllables[3] and \
+                word[0] not in DIAERESIS and previous[0] > 0:
+            synalephas += 1
+        previous = syllables
+        last = syllables
+
+    if count == 0:
+        return 0, 0, 0
+    count -= synalephas
+    if last[5]:
+        count += 1
+    proparoxytone = 1 if not last[5] and last[0] >= 3 else 0
+    return count, count - mergeable - proparoxytone, count + splittable + synalephas
+
+
+def syllable_ranges(verses):
+    """ syllable_range of every verse, (N, 3) int64, computed on arrays of the words of all the verses.
+
+    Each distinct word is syllabified once (word_syllables is cached too) and
+    its features gathered for every occurrence; the synalephas, the last
+    stressed word and the sums of each verse are then computed for all the
+    verses together.
+    """
+    # the words of all the verses in one pass of the regular expression, as _words
+    text = '\n'.join(verses).lower().replace("’", "'").replace("'", "")
+    tokens = _WORD_OR_NEWLINE.findall(text)
+    ranges = np.zeros((len(verses), 3), dtype=np.int64)
+    if len(tokens) == text.count('\n'):
+        return ranges
+    unique_words = {}
+    inverse = np.array([unique_words.setdefault(token, len(unique_words)) for token in tokens])
+    newline = inverse == unique_words['\n'] if '\n' in unique_words else np.zeros(len(tokens), dtype=bool)
+    word_verse = np.cumsum(newline)[~newline]
+    features = np.array([word_syllables(word) + (word[0] in DIAERESIS,) if word != '\n' else (0,) * 7
+                         for word in unique_words], dtype=np.int64)[inverse[~newline]]
+    count, splittable, mergeable, starts_vowel, ends_vowel, oxytone, starts_diaeresis = features.T
+
+    # a synalepha joins a word to the word before it in the same verse, if that one has syllables
+    synalepha = np.zeros(len(word_verse), dtype=bool)
+    synalepha[1:] = ((word_verse[1:] == word_verse[:-1]) & (ends_vowel[:-1] == 1) & (count[:-1] > 0) &
+                     (count[1:] > 0) & (starts_vowel[1:] == 1) & (starts_diaeresis[1:] == 0))
+
+    def per_verse(values):
+        return np.bincount(word_verse, weights=values, minlength=len(verses)).astype(np.int64)
+
+    # the last word with syllables of each verse, the words are in the order of the verses
+    syllabic = np.flatnonzero(count > 0)
+    last = np.searchsorted(word_verse[syllabic], np.arange(len(verses)), side='right') - 1
+    has_syllables = last >= 0
+    has_syllables[has_syllables] = word_verse[syllabic[last[has_syllables]]] == np.flatnonzero(has_syllables)
+    last = syllabic[last[has_syllables]]
+
+    synalephas = per_verse(synalepha)
+    total = per_verse(count)[has_syllables] - synalephas[has_syllables] + oxytone[last]
+    proparoxytone = (oxytone[last] == 0) & (count[last] >= 3)
+    ranges[has_syllables, 0] = total
+    ranges[has_syllables, 1] = total - per_verse(mergeable)[has_syllables] - proparoxytone
+    ranges[has_syllables, 2] = total + per_verse(splittable)[has_syllables] + synalephas[has_syllables]
+    return ranges
+
+
+def syllable_count(verse):
+    """ Metrical syllables of a verse, see syllable_range """
+    return syllable_range(verse)[0]
+
+
+def is_hendecasyllable(verse):
+    """ True if the verse can be read with 11 syllables, with the licenses of syllable_range """
+    _, minimum, maximum = syllable_range(verse)
+    return minimum <= HENDECASYLLABLE <= maximum
+
+
+def can_reach_hendecasyllable(partial_verse):
+    """ False if no continuation of the beginning of a verse can be read as 11 syllables.
+
+    Going on with a verse only adds syllables, except the one counted after a
+    final stress and one more from a synalepha or a proparoxytone last word,
+    so the minimum of syllable_range - 2 bounds every continuation.
+    """
+    _, minimum, _ = syllable_range(partial_verse)
+    return minimum - 2 <= HENDECASYLLABLE
+
+
+@lru_cache(maxsize=None)
+def stressed_vowel(word):
+    """ Position of the stressed vowel of a lower case word, None if it has no vowels.
+
+    The last accented vowel if there is one, otherwise the last syllable of
+    an oxytone word (a monosyllable or a truncated word, see word_syllables)
+    and the penultimate of the others: the words stressed on the
+    antepenultimate are not told apart. In a syllable of more vowels the
+    stress is on the first strong one (fuoco, chiesa), or on the last of two
+    weak ones (chiuso), but on the weak one of a monosyllable ending with a
+    weak and a strong vowel (mio, via).
+    """
+    positions = _vowel_positions(word)
+    if not positions:
+        return None
+    accented = [i for i in positions if word[i] in ACCENTED]
+    if accented:
+        return accented[-1]
+
+    # vowels grouped by syllable, with the rules of word_syllables
+    syllables = []
+    for n, i in enumerate(positions):
+        previous = word[i - 1]
+        if n > 0 and positions[n - 1] == i - 1 and previous not in DIAERESIS and word[i] not in DIAERESIS \
+                and not (_is_strong(previous) and _is_strong(word[i])):
+            syllables[-1].append(i)
+        else:
+            syllables.append([i])
+
+    oxytone = len(syllables) == 1 or word[-1] not in VOWELS
+    syllable = syllables[-1] if oxytone else syllables[-2]
+    if len(syllables) == 1 and syllable == [len(word) - 2, len(word) - 1] and not _is_strong(word[-2]):
+        return syllable[0]
+    strong = [i for i in syllable if _is_strong(word[i])]
+    return strong[0] if strong else syllable[-1]
@@ -0,0 +1,174 @@
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import tensorflow as tf
+
+
+def rss_bytes():
+    """ Resident set size of the process, the peak one where /proc is not available """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # bytes on macOS, kilobytes elsewhere
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class JsonlSink:
+    """ Appends one JSON object per line to a file, from any thread.
+
+    The lines are buffered and written every flush_every records, and on
+    flush() / close(), so a step doesn't pay a write to disk.
+    """
+
+    def __init__(self, path, flush_every=100):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.flush_every = flush_every
+        self._file = open(self.path, 'a')
+        self._buffer = []
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record)
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) >= self.flush_every:
+                self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self._file.write('\n'.join(self._buffer) + '\n')
+            self._file.flush()
+            self._buffer = []
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._file.close()
+
+
+class StepRecorder:
+    """ Wall time of the phases of each training step, written to a sink with chars/sec and RSS.
+
+        recorder.begin_step(step)
+        with recorder.phase('input'):
+            x, y = next(batches)
+        with recorder.phase('train_step'):
+            ...
+        recorder.end_step(chars=x.size, loss=float(loss))
+
+    writes {"step", "time", "wall", "phases": {name: seconds}, "chars_per_sec",
+    "rss_mb", **values}; the time of the step not spent in a phase is in
+    "other". A phase outside of a step (the final model.save) is written at
+    once as {"event": name, "seconds", "rss_mb"}.
+
+    With profile_dir, the TensorFlow profiler traces the steps in
+    profile_steps = (first, last), last excluded, into profile_dir for
+    TensorBoard; it's off by default, the trace slows the steps down.
+    """
+
+    def __init__(self, sink, profile_dir=None, profile_steps=None):
+        self.sink = sink
+        self.profile_dir = profile_dir
+        self.profile_steps = profile_steps
+        self.step = None
+        self._profiling = False
+        self._start = None
+        self._phases = {}
+
+    def begin_step(self, step, start=None):
+        """ Start the step, at the time.perf_counter() start if it's given """
+        self.step = step
+        self._phases = {}
+        if self.profile_dir is not None and self.profile_steps is not None and step == self.profile_steps[0]:
+            Path(self.profile_dir).mkdir(parents=True, exist_ok=True)
+            tf.profiler.experimental.start(str(self.profile_dir))
+            self._profiling = True
+        self._start = time.perf_counter() if start is None else start
+
+    def add_phase(self, name, seconds):
+        if self.step is None:
+            self.sink.write({ 'event': name, 'time': time.time(), 'seconds': seconds,
+                              'rss_mb': rss_bytes() / 2 ** 20 })
+        else:
+            self._phases[name] = self._phases.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start)
+
+    def end_step(self, chars=None, **values):
+        wall = time.perf_counter() - self._start
+        phases = dict(self._phases)
+        phases['other'] = max(wall - sum(phases.values()), 0.0)
+        record = { 'step': self.step, 'time': time.time(), 'wall': wall, 'phases': phases,
+                   'chars_per_sec': chars / wall if chars and wall > 0 else None,
+                   'rss_mb': rss_bytes() / 2 ** 20 }
+        record.update(values)
+        self.sink.write(record)
+
+        if self._profiling and self.step + 1 >= self.profile_steps[1]:
+            tf.profiler.experimental.stop()
+            self._profiling = False
+        self.step = None
+
+    def close(self):
+        if self._profiling:
+            tf.profiler.experimental.stop()
+            self._profiling = False
+        self.sink.close()
+
+
+class TelemetryCallback(tf.keras.callbacks.Callback):
+    """ Keras callback recording every training batch of fit() with a StepRecorder.
+
+    The time of a batch is the "train_step" phase, the time from the end of
+    a batch to the start of the next one (input, other callbacks) is
+    "between_batches" of the next step. chars_per_batch, if given, is the
+    number of characters of a batch, for the chars/sec.
+    """
+
+    def __init__(self, recorder, chars_per_batch=None):
+        super(TelemetryCallback, self).__init__()
+        self.recorder = recorder
+        self.chars_per_batch = chars_per_batch
+        self.step = 0
+        self.epoch = 0
+        self._batch_end = None
+        self._batch_begin = None
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+        self._batch_end = None
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._batch_begin = time.perf_counter()
+        self.recorder.begin_step(self.step, start=self._batch_end)
+        if self._batch_end is not None:
+            self.recorder.add_phase('between_batches', self._batch_begin - self._batch_end)
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._batch_end = time.perf_counter()
+        self.recorder.add_phase('train_step', self._batch_end - self._batch_begin)
+        values = { name: float(value) for name, value in (logs or {}).items() }
+        self.recorder.end_step(chars=self.chars_per_batch, epoch=self.epoch, **values)
+        self.step += 1
+
+    def on_train_end(self, logs=None):
+        self.recorder.sink.flush()
@@ -0,0 +1,115 @@
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import tensorflow as tf
+
+QUANTIZATIONS = (None, 'dynamic', 'int8')
+
+
+def lstm_sequence(cell, x, h, c):
+    """ Outputs (batch, T, units) and last (h, c) of a Keras LSTM cell over x (batch, T, features) from (h, c).
+
+    The recurrence of the cell (default activations, gates in the Keras order
+    i, f, c, o) in a while loop that converts to plain TFLite ops: the fused
+    TFLite LSTM op needs constant initial states, and the calibration of the
+    int8 quantization crashes on the loop of the Keras RNN layers. The input
+    projection is computed once for all the steps, before the loop.
+    """
+    kernel, recurrent_kernel, bias = [tf.convert_to_tensor(weights)
+                                      for weights in (cell.kernel, cell.recurrent_kernel, cell.bias)]
+    steps = tf.shape(x)[1]
+    projected = tf.tensordot(x, kernel, [[2], [0]]) + bias
+    inputs = tf.TensorArray(x.dtype, size=steps, element_shape=(x.shape[0], kernel.shape[1]))
+    inputs = inputs.unstack(tf.transpose(projected, [1, 0, 2]))
+    outputs = tf.TensorArray(x.dtype, size=steps, element_shape=h.shape)
+
+    def step(t, h, c, outputs):
+        i, f, g, o = tf.split(inputs.read(t) + tf.matmul(h, recurrent_kernel), 4, axis=-1)
+        c = tf.sigmoid(f) * c + tf.sigmoid(i) * tf.tanh(g)
+        h = tf.sigmoid(o) * tf.tanh(c)
+        return t + 1, h, c, outputs.write(t, h)
+
+    _, h, c, outputs = tf.while_loop(lambda t, *_: t < steps, step, [0, h, c, outputs], maximum_iterations=steps)
+    return tf.transpose(outputs.stack(), [1, 0, 2]), h, c
+
+
+def convert(function, path, quantization='dynamic', representative_dataset=None):
+    """ Write a TFLite model of a tf.function with an input_signature to path.
+
+    quantization:
+        None: float32 weights and computations
+        'dynamic': int8 weights, dequantized or computed in int8 with the
+            activations quantized on the fly, no calibration needed
+        'int8': int8 weights and activations, the ranges of the activations
+            are calibrated on representative_dataset, a callable returning an
+            iterable of dicts of inputs by the names of the arguments; the ops
+            without an int8 kernel stay float32
+    """
+    if quantization not in QUANTIZATIONS:
+        raise ValueError("quantization must be one of {}, not {!r}".format(QUANTIZATIONS, quantization))
+    if quantization == 'int8' and representative_dataset is None:
+        raise ValueError("int8 quantization needs a representative_dataset to calibrate the activations")
+
+    # through a SavedModel, so the TFLite model has the signature of the function with named inputs
+    concrete_function = function.get_concrete_function()
+    module = tf.Module()
+    module.weights = list(concrete_function.variables)
+    with tempfile.TemporaryDirectory() as saved_model_dir:
+        tf.saved_model.save(module, saved_model_dir, signatures=concrete_function)
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+        if quantization is not None:
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if quantization == 'int8':
+            converter.representative_dataset = representative_dataset
+        flatbuffer = converter.convert()
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.%d.tmp' % os.getpid())
+    with open(tmp_path, 'wb') as file:
+        file.write(flatbuffer)
+    os.replace(tmp_path, path)
+    return path
+
+
+class TFLiteRunner:
+    """ Interpreter of a model written by convert(), called with and returning numpy arrays.
+
+    The tensors are allocated again only when the shape of an input changes,
+    so a run of calls with the same shapes (one character at a time) pays
+    only the invoke. The default XNNPACK delegate is not used, it can't
+    resize the loops of the LSTMs for inputs of another length.
+    """
+
+    def __init__(self, path, num_threads=None):
+        self.interpreter = tf.lite.Interpreter(
+            model_path=str(path), num_threads=num_threads,
+            experimental_op_resolver_type=tf.lite.experimental.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES)
+        self.interpreter.allocate_tensors()
+        # the single signature written by convert(): the inputs by name, the outputs in their order
+        key, signature = next(iter(self.interpreter.get_signature_list().items()))
+        runner = self.interpreter.get_signature_runner(key)
+        self.inputs = runner.get_input_details()
+        self._outputs = [runner.get_output_details()[name]['index'] for name in sorted(signature['outputs'],
+                                                                                      key=_output_position)]
+        self._shapes = { name: tuple(detail['shape']) for name, detail in self.inputs.items() }
+
+    def __call__(self, **inputs):
+        """ The outputs of the function for the inputs, given by name """
+        for name, value in inputs.items():
+            detail = self.inputs[name]
+            value = np.asarray(value, dtype=detail['dtype'])
+            if value.shape != self._shapes[name]:
+                self.interpreter.resize_tensor_input(detail['index'], value.shape)
+                self.interpreter.allocate_tensors()
+                self._shapes[name] = value.shape
+            self.interpreter.set_tensor(detail['index'], value)
+        self.interpreter.invoke()
+        return [self.interpreter.get_tensor(index) for index in self._outputs]
+
+
+def _output_position(name):
+    # the outputs of a concrete function are named output_0, output_1, ...
+    return int(name.rsplit('_', 1)[-1])